@@ -10,6 +10,14 @@ PROJECT_ROOT = Path(__file__).parent.parent
 # 模型配置
 MODEL_DIR = PROJECT_ROOT / "models" / "sherpa-onnx-kws-zipformer-wenetspeech-3.3M-2024-01-01"
 
+# KWS 模型的流式结构参数，须与 MODEL_DIR 中的模型一致，换模型时一起修改。
+# encoder 的 ONNX 元数据中有 decode_chunk_len 和 T 两项，安装了 onnx（可选依赖 onnx-metadata）时以元数据为准
+KWS_DECODE_CHUNK_LEN = 32     # 每次解码消耗的特征帧数（chunk-16 × 编码器前端 2 倍下采样）
+KWS_ENCODER_T = 45            # 每次解码送入编码器的特征帧数（decode_chunk_len + 13 帧右侧上下文）
+KWS_SUBSAMPLING_FACTOR = 4    # 特征帧到输出帧（token 时间戳）的下采样倍数
+KWS_FRAME_SHIFT_SECONDS = 0.01    # fbank 帧移
+KWS_FRAME_LENGTH_SECONDS = 0.025  # fbank 窗长
+
 # 自定义唤醒词配置 - 四个字唤醒词，使用最极端的参数
 # 格式: "唤醒词 :boosting_score #trigger_threshold"
 CUSTOM_KEYWORDS = [
@@ -18,13 +26,70 @@ CUSTOM_KEYWORDS = [
     "小立同学 :40.0 #0.001"     # 四个字唤醒词，很高提升分数，极低阈值
 ]
 
+# 按设备类型区分的唤醒词集合，会话连接时通过 keyword_set 参数选择（所有集合共用同一个模型实例）
+# 例如 "speaker": ["你好小立 :50.0 #0.001"], "car": ["小立同学 :40.0 #0.001", "你好小车 :40.0 #0.001"]
+KEYWORD_SETS = {
+    "default": CUSTOM_KEYWORDS,
+}
+DEFAULT_KEYWORD_SET = "default"  # 连接未指定集合时使用
+
+# 语音识别引擎：sherpa（sherpa-onnx 流式模型，需要 ASR_MODEL_DIR）或 fake（确定性假引擎，仅用于开发和测试）
+ASR_ENGINE = os.getenv("ASR_ENGINE", "sherpa").lower()
+# 流式语音识别模型目录
+ASR_MODEL_DIR = os.getenv("ASR_MODEL_DIR")
+
+# 语音合成配置
+TTS_VOICE = "default"
+TTS_RATE = 1.0
+TTS_CACHE_MAX_BYTES = 32 * 1024 * 1024   # 合成语音内存缓存预算
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR")  # 合成语音磁盘缓存目录（未配置时只用内存）
+TTS_CACHE_DISK_MAX_BYTES = int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))  # 合成语音磁盘缓存总大小上限
+
 # 音频配置
 SAMPLE_RATE = 16000
-CHUNK_SIZE = int(0.1 * SAMPLE_RATE)  # 100ms chunks
+CHUNK_SIZE = round(KWS_DECODE_CHUNK_LEN * KWS_FRAME_SHIFT_SECONDS * SAMPLE_RATE)  # 模型原生解码块（chunk-16 为 320ms），接收的音频按该大小重新切分后送入模型
+COALESCE_MAX_SECONDS = 0.64          # 解码落后时把排队的音频块合并为一次解码，单次合并的音频时长上限（需小于唤醒回看窗口）
+
+# 唤醒后语音捕获配置
+CAPTURE_LOOKBACK_SECONDS = 1.0    # 唤醒触发前回看的音频时长
+CAPTURE_MAX_SECONDS = 10.0        # 单次语句的最长捕获时长
+ENDPOINT_SILENCE_SECONDS = 0.8    # 语音之后持续静音多久判定为句尾
+ENDPOINT_NO_SPEECH_SECONDS = 5.0  # 唤醒后一直没有语音的超时时长
 
 # WebSocket配置
 WS_MAX_CONNECTIONS = 100
 WS_HEARTBEAT_INTERVAL = 30
+WS_PONG_TIMEOUT = 10             # 发送心跳后等待回复的时间（秒），超时视为连接失效
+WS_IDLE_AUDIO_TIMEOUT = 120      # 多久没有收到音频视为空闲会话并回收（秒）
+
+# 准入控制与过载降级
+ADMISSION_QUEUE_SIZE = 20         # 超过最大连接数后排队等待的会话数
+ADMISSION_QUEUE_TIMEOUT = 10.0    # 排队等待超时（秒）
+SHED_DROP_SILENCE_LAG = 0.5       # 积压超过该时长（秒）开始丢弃静音块
+SHED_DECIMATE_LAG = 1.5           # 积压超过该时长开始隔块丢弃
+SHED_DISCONNECT_LAG = 5.0         # 积压超过该时长断开连接
+SHED_SILENCE_RMS = 0.01           # 判定为静音的 RMS 能量阈值
+
+# CPU线程预算（并发解码数 × 每次解码线程数 不超过可用核数）
+THREAD_BUDGET_CPUS = int(os.getenv("THREAD_BUDGET_CPUS", "0")) or None  # 为空时使用 os.cpu_count()
+THREAD_BUDGET_RESERVED_CORES = 1    # 预留给事件循环和网络IO的核数
+EXPECTED_CONCURRENCY = int(os.getenv("EXPECTED_CONCURRENCY", str(WS_MAX_CONNECTIONS)))  # 预期同时活跃的音频流数
+
+# 进程内存预算（超过预算前拒绝新会话，接近预算时丢弃可丢弃的缓冲）
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", "0")) or None  # 为空时只记账不限制
+MEMORY_SHED_RATIO = 0.9           # RSS 超过预算的该比例时开始丢弃静音块、收紧消息队列
+
+# 会话录音（用于离线回放复现问题，默认关闭）
+RECORDING_ENABLED = os.getenv("RECORDING_ENABLED", "false").lower() == "true"
+RECORDING_DIR = Path(os.getenv("RECORDING_DIR", str(PROJECT_ROOT / "recordings")))
+RECORDING_SAMPLING_RATIO = float(os.getenv("RECORDING_SAMPLING_RATIO", "1.0"))  # 被录音的会话比例 (0-1)
+RECORDING_MAX_BYTES = int(os.getenv("RECORDING_MAX_BYTES", str(1 << 30)))      # 录音目录总大小上限
+RECORDING_QUEUE_SIZE = 256        # 待写盘的音频块上限，写盘跟不上时丢弃新块
+
+# 事件推送配置
+EVENT_QUEUE_SIZE = 100          # 每个订阅者的待发送消息上限
+EVENT_OVERFLOW_POLICY = "coalesce"  # 队列满时的策略: drop_oldest / coalesce
+EVENT_SEND_TIMEOUT = 2.0        # 单条消息发送超时（秒）
 
 # 日志配置
 LOG_LEVEL = "INFO"
@@ -34,3 +99,4 @@ LOG_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {name}:{function}:{line} |
 HOST = "0.0.0.0"
 PORT = 8000
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))  # 大于1时使用预 fork 多进程模式（调试模式下忽略）
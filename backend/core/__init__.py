@@ -3,6 +3,7 @@
 """
 from .keyword_spotter import KeywordSpotter
 from .vad_detector import SileroVAD
-from .voice_assistant_pipeline import VoiceAssistantPipeline, PipelineState, PipelineEvent
+from .voice_assistant_pipeline import VoiceAssistantPipeline, PipelineSession, PipelineState, PipelineEvent
+from .event_bus import EventBus
 
-__all__ = ["KeywordSpotter", "SileroVAD", "VoiceAssistantPipeline", "PipelineState", "PipelineEvent"]
+__all__ = ["KeywordSpotter", "SileroVAD", "VoiceAssistantPipeline", "PipelineSession", "PipelineState", "PipelineEvent", "EventBus"]
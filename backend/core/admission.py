@@ -0,0 +1,309 @@
+"""
+会话准入控制与过载降级
+超过容量的新会话进入有界等待队列，超时或队列满时拒绝；已接纳的会话按积压（已接收音频时长 - 已解码音频时长）
+逐级降级：先丢弃静音块，再隔块抽取，最后断开连接，优先保护其他已接纳会话
+"""
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+
+
+# 降级级别（按严重程度递增）
+SHED_NONE = "none"                  # 正常处理
+SHED_DROP_SILENCE = "drop_silence"  # 丢弃静音块
+SHED_DECIMATE = "decimate"          # 隔块丢弃
+SHED_DISCONNECT = "disconnect"      # 断开连接
+
+SHED_LEVELS = (SHED_NONE, SHED_DROP_SILENCE, SHED_DECIMATE, SHED_DISCONNECT)
+
+# 积压降到当前级别阈值的该比例以下才回落，避免在阈值附近反复切换
+RECOVER_RATIO = 0.5
+
+
+def drain_backlog(queue: asyncio.Queue, first: Tuple, max_samples: int) -> List[Tuple]:
+    """
+    取出队列中已经积压的音频块，与刚取出的 first 合并为一次解码
+
+    Args:
+        queue: 待解码队列，元素是第一项为音频数组的元组
+        first: 已从队列取出的元素
+        max_samples: 合并的样本数达到该值后不再继续取出
+
+    Returns:
+        按到达顺序排列的元素列表（至少包含 first）
+    """
+    items = [first]
+    total = len(first[0])
+    while total < max_samples and not queue.empty():
+        item = queue.get_nowait()
+        items.append(item)
+        total += len(item[0])
+    return items
+
+
+class SessionLoad:
+    """单个会话的积压跟踪与降级决策"""
+
+    def __init__(self, session_id: str, sample_rate: int = 16000,
+                 drop_silence_lag: float = 0.5, decimate_lag: float = 1.5,
+                 disconnect_lag: float = 5.0, silence_rms: float = 0.01):
+        """
+        初始化积压跟踪
+
+        Args:
+            session_id: 会话ID
+            sample_rate: 采样率
+            drop_silence_lag: 积压超过该时长（秒）开始丢弃静音块
+            decimate_lag: 积压超过该时长开始隔块丢弃
+            disconnect_lag: 积压超过该时长断开连接
+            silence_rms: 判定为静音的 RMS 能量阈值
+        """
+        self.session_id = session_id
+        self.sample_rate = sample_rate
+        self.thresholds = (
+            (disconnect_lag, SHED_DISCONNECT),
+            (decimate_lag, SHED_DECIMATE),
+            (drop_silence_lag, SHED_DROP_SILENCE),
+        )
+        self.silence_rms = silence_rms
+        self.level = SHED_NONE
+
+        self.received_samples = 0
+        self.decoded_samples = 0
+        self.shed_samples = 0
+        self.shed_chunks = 0
+        self.max_lag_seconds = 0.0
+        self._decimate_toggle = False
+
+    @property
+    def lag_seconds(self) -> float:
+        """已接收但尚未处理的音频时长（秒）"""
+        return (self.received_samples - self.decoded_samples - self.shed_samples) / self.sample_rate
+
+    @property
+    def backlog_bytes(self) -> int:
+        """已接收但尚未处理的音频占用的内存（float32）"""
+        return max(0, self.received_samples - self.decoded_samples - self.shed_samples) * 4
+
+    def on_received(self, num_samples: int) -> Optional[str]:
+        """
+        记录收到的音频
+
+        Returns:
+            降级级别发生变化时返回新级别，否则返回None
+        """
+        self.received_samples += num_samples
+        return self._update_level()
+
+    def on_decoded(self, num_samples: int):
+        """记录已解码的音频"""
+        self.decoded_samples += num_samples
+        self._update_level()
+
+    def should_shed(self, audio_data: np.ndarray, memory_pressure: bool = False) -> bool:
+        """
+        按当前降级级别判断是否丢弃该音频块（丢弃时计入已处理）
+
+        Args:
+            audio_data: 待解码的音频块
+            memory_pressure: 进程是否处于内存压力下，是则至少丢弃静音块
+        """
+        if self.level == SHED_NONE and not memory_pressure:
+            return False
+
+        shed = False
+        if self.level in (SHED_DECIMATE, SHED_DISCONNECT):
+            self._decimate_toggle = not self._decimate_toggle
+            shed = self._decimate_toggle
+        if not shed and len(audio_data):
+            rms = float(np.sqrt(np.mean(np.square(audio_data, dtype=np.float32))))
+            shed = rms < self.silence_rms
+
+        if shed:
+            self.shed_samples += len(audio_data)
+            self.shed_chunks += 1
+            self._update_level()
+        return shed
+
+    def _update_level(self) -> Optional[str]:
+        lag = self.lag_seconds
+        self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+        level = SHED_NONE
+        for threshold, candidate in self.thresholds:
+            if lag >= threshold:
+                level = candidate
+                break
+
+        if level == self.level:
+            return None
+
+        rank, current_rank = SHED_LEVELS.index(level), SHED_LEVELS.index(self.level)
+        if rank < current_rank:
+            current_threshold = next(t for t, candidate in self.thresholds if candidate == self.level)
+            if lag >= current_threshold * RECOVER_RATIO:
+                return None
+
+        if rank > current_rank:
+            logger.warning(f"⚠️ 会话 {self.session_id} 积压 {lag:.2f}s，降级: {self.level} -> {level}")
+        else:
+            logger.info(f"会话 {self.session_id} 积压 {lag:.2f}s，恢复: {self.level} -> {level}")
+        self.level = level
+        return level
+
+    def overload_message(self) -> Dict[str, Any]:
+        """生成发送给客户端的过载消息"""
+        return {
+            "type": "overload",
+            "reason": "lagging",
+            "level": self.level,
+            "lag_ms": round(self.lag_seconds * 1000, 1),
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取积压统计"""
+        return {
+            "level": self.level,
+            "lag_ms": round(self.lag_seconds * 1000, 1),
+            "max_lag_ms": round(self.max_lag_seconds * 1000, 1),
+            "received_seconds": round(self.received_samples / self.sample_rate, 2),
+            "decoded_seconds": round(self.decoded_samples / self.sample_rate, 2),
+            "shed_seconds": round(self.shed_samples / self.sample_rate, 2),
+            "shed_chunks": self.shed_chunks,
+        }
+
+
+class AdmissionController:
+    """会话准入控制：容量内直接接纳，超出时按先来先到排队"""
+
+    def __init__(self, max_sessions: int = 100, queue_size: int = 20, queue_timeout: float = 10.0):
+        """
+        初始化准入控制
+
+        Args:
+            max_sessions: 同时接纳的会话上限
+            queue_size: 排队等待的会话上限
+            queue_timeout: 排队等待超时（秒）
+        """
+        self.max_sessions = max_sessions
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self.active: Dict[str, SessionLoad] = {}
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+        self._reserved = 0  # 已转交给排队会话、但对方尚未恢复运行的名额
+
+        # 统计
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.disconnected = 0
+
+    @property
+    def is_full(self) -> bool:
+        return len(self.active) + self._reserved >= self.max_sessions
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, session_id: str,
+                      on_queued: Optional[Callable[[int], Awaitable[Any]]] = None,
+                      **load_kwargs) -> Optional[SessionLoad]:
+        """
+        申请接纳会话
+
+        Args:
+            session_id: 会话ID
+            on_queued: 确实进入等待队列时调用，参数为排队位置（如通知客户端正在排队）
+            load_kwargs: 传给 SessionLoad 的降级参数
+
+        Returns:
+            接纳后该会话的积压跟踪对象；队列已满或排队超时返回None
+
+        Raises:
+            ValueError: 同一ID的会话已被接纳（排队期间被另一个连接抢先接纳时同样抛出）
+        """
+        if session_id in self.active:
+            raise ValueError(f"会话已存在: {session_id}")
+
+        if self.is_full or self._waiters:
+            if len(self._waiters) >= self.queue_size:
+                self.rejected += 1
+                logger.warning(f"⚠️ 会话 {session_id} 被拒绝: 容量已满且等待队列已满")
+                return None
+
+            future = asyncio.get_running_loop().create_future()
+            entry = (session_id, future)
+            self._waiters.append(entry)
+            self.queued += 1
+            logger.info(f"⏳ 会话 {session_id} 排队等待 (排队数: {len(self._waiters)})")
+            try:
+                if on_queued is not None:
+                    await on_queued(len(self._waiters))
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                # 名额恰好在超时时转交过来则照常接纳
+                if not future.done():
+                    self._waiters.remove(entry)
+                    self.timed_out += 1
+                    logger.warning(f"⚠️ 会话 {session_id} 排队超时")
+                    return None
+            except BaseException:
+                # 排队期间客户端断开或通知失败：放弃位置，已转交的名额继续转交给下一个
+                if future.done():
+                    self._reserved -= 1
+                    self._handoff()
+                else:
+                    self._waiters.remove(entry)
+                raise
+            self._reserved -= 1
+
+            if session_id in self.active:
+                self.rejected += 1
+                self._handoff()
+                raise ValueError(f"会话已存在: {session_id}")
+
+        load = SessionLoad(session_id, **load_kwargs)
+        self.active[session_id] = load
+        self.admitted += 1
+        return load
+
+    def release(self, session_id: str, disconnected: bool = False):
+        """
+        释放会话名额，并转交给排队最久的会话
+
+        Args:
+            session_id: 会话ID
+            disconnected: 是否因积压过高被断开
+        """
+        if self.active.pop(session_id, None) is None:
+            return
+        if disconnected:
+            self.disconnected += 1
+        self._handoff()
+
+    def _handoff(self):
+        """把空出的名额按先来先到转交给排队会话"""
+        while self._waiters and not self.is_full:
+            _, future = self._waiters.popleft()
+            # 名额在排队会话恢复运行时才计入 active，这里先占住，避免被新来的会话抢走
+            self._reserved += 1
+            future.set_result(True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取准入统计与各会话积压"""
+        return {
+            "max_sessions": self.max_sessions,
+            "active": len(self.active),
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "disconnected": self.disconnected,
+            "sessions": {sid: load.get_stats() for sid, load in self.active.items()},
+        }
@@ -0,0 +1,221 @@
+"""
+流式语音识别引擎接口
+增量接收音频，并以事件形式产出部分（partial）和最终（final）识别结果
+"""
+import numpy as np
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Dict, Any
+from loguru import logger
+
+
+@dataclass
+class ASRResult:
+    """语音识别结果事件"""
+    text: str
+    is_final: bool
+    audio_seconds: float  # 产生该结果时已接收的音频时长
+
+
+class ASRStream(ABC):
+    """单次语句的流式识别状态"""
+    
+    @abstractmethod
+    def accept_waveform(self, samples: np.ndarray, sample_rate: int = 16000) -> List[ASRResult]:
+        """
+        输入一块音频并解码
+        
+        Args:
+            samples: 音频数据 (float32)
+            sample_rate: 采样率
+            
+        Returns:
+            本次输入产生的部分识别结果（文本无变化时为空列表）
+        """
+    
+    @abstractmethod
+    def finish(self) -> ASRResult:
+        """输入结束，返回最终识别结果"""
+
+
+class ASREngine(ABC):
+    """流式语音识别引擎（模型在会话间共享，每次语句创建一个流）"""
+    
+    name = "base"
+    
+    @abstractmethod
+    def create_stream(self) -> ASRStream:
+        """创建识别流"""
+    
+    def get_info(self) -> Dict[str, Any]:
+        """获取引擎信息"""
+        return {"engine": self.name}
+
+
+class _SherpaOnlineASRStream(ASRStream):
+    """sherpa-onnx 在线识别流"""
+    
+    def __init__(self, recognizer, sample_rate: int):
+        self.recognizer = recognizer
+        self.sample_rate = sample_rate
+        self.stream = recognizer.create_stream()
+        self.num_samples = 0
+        self.last_text = ""
+    
+    def _decode(self) -> Optional[ASRResult]:
+        while self.recognizer.is_ready(self.stream):
+            self.recognizer.decode_stream(self.stream)
+        text = self.recognizer.get_result(self.stream)
+        if text == self.last_text:
+            return None
+        self.last_text = text
+        return ASRResult(text=text, is_final=False, audio_seconds=self.num_samples / self.sample_rate)
+    
+    def accept_waveform(self, samples: np.ndarray, sample_rate: int = 16000) -> List[ASRResult]:
+        self.stream.accept_waveform(sample_rate, samples)
+        self.num_samples += len(samples)
+        result = self._decode()
+        return [result] if result else []
+    
+    def finish(self) -> ASRResult:
+        # 补充尾部静音，确保最后几帧被解码
+        tail_paddings = np.zeros(int(0.3 * self.sample_rate), dtype=np.float32)
+        self.stream.accept_waveform(self.sample_rate, tail_paddings)
+        self.stream.input_finished()
+        self._decode()
+        return ASRResult(text=self.last_text, is_final=True, audio_seconds=self.num_samples / self.sample_rate)
+
+
+class SherpaOnlineASREngine(ASREngine):
+    """基于 sherpa-onnx OnlineRecognizer（流式 transducer）的识别引擎"""
+    
+    name = "sherpa-onnx"
+    
+    def __init__(self, model_dir: str, num_threads: int = 1, provider: str = "cpu",
+                 sample_rate: int = 16000):
+        """
+        初始化识别引擎
+        
+        Args:
+            model_dir: 流式 transducer 模型目录（包含 tokens.txt 与 encoder/decoder/joiner）
+            num_threads: 推理线程数
+            provider: 推理后端
+            sample_rate: 采样率
+        """
+        import sherpa_onnx
+        
+        self.model_dir = Path(model_dir)
+        self.sample_rate = sample_rate
+        
+        logger.info(f"正在加载ASR模型: {self.model_dir}")
+        self.recognizer = sherpa_onnx.OnlineRecognizer.from_transducer(
+            tokens=str(self.model_dir / "tokens.txt"),
+            encoder=str(self._find_model_file("encoder")),
+            decoder=str(self._find_model_file("decoder")),
+            joiner=str(self._find_model_file("joiner")),
+            num_threads=num_threads,
+            sample_rate=sample_rate,
+            feature_dim=80,
+            decoding_method="greedy_search",
+            provider=provider,
+        )
+        logger.success("✅ ASR模型加载成功！")
+    
+    def _find_model_file(self, part: str) -> Path:
+        """查找模型文件，优先使用非量化版本"""
+        candidates = sorted(self.model_dir.glob(f"{part}*.onnx"))
+        if not candidates:
+            raise FileNotFoundError(f"未找到ASR模型文件: {self.model_dir}/{part}*.onnx")
+        full_precision = [p for p in candidates if ".int8." not in p.name]
+        return (full_precision or candidates)[0]
+    
+    def create_stream(self) -> ASRStream:
+        return _SherpaOnlineASRStream(self.recognizer, self.sample_rate)
+    
+    def get_info(self) -> Dict[str, Any]:
+        return {"engine": self.name, "model_dir": str(self.model_dir), "sample_rate": self.sample_rate}
+
+
+class _FakeASRStream(ASRStream):
+    """确定性假识别流：按已接收的音频时长逐字揭示预设文本"""
+    
+    def __init__(self, text: str, chars_per_second: float, sample_rate: int):
+        self.text = text
+        self.chars_per_second = chars_per_second
+        self.sample_rate = sample_rate
+        self.num_samples = 0
+        self.num_chars = 0
+    
+    def accept_waveform(self, samples: np.ndarray, sample_rate: int = 16000) -> List[ASRResult]:
+        self.num_samples += len(samples)
+        audio_seconds = self.num_samples / sample_rate
+        num_chars = min(len(self.text), int(audio_seconds * self.chars_per_second))
+        if num_chars == self.num_chars:
+            return []
+        self.num_chars = num_chars
+        return [ASRResult(text=self.text[:num_chars], is_final=False, audio_seconds=audio_seconds)]
+    
+    def finish(self) -> ASRResult:
+        return ASRResult(text=self.text, is_final=True, audio_seconds=self.num_samples / self.sample_rate)
+
+
+class FakeASREngine(ASREngine):
+    """确定性的本地假识别引擎，用于测试和演示（ASR_ENGINE=fake 时使用）"""
+    
+    name = "fake"
+    
+    DEFAULT_TRANSCRIPTS = [
+        "今天天气怎么样",
+        "播放音乐",
+        "设置闹钟",
+        "打开灯",
+        "关闭空调"
+    ]
+    
+    def __init__(self, transcripts: List[str] = None, chars_per_second: float = 4.0,
+                 sample_rate: int = 16000):
+        """
+        初始化假识别引擎
+        
+        Args:
+            transcripts: 依次循环返回的识别文本
+            chars_per_second: 每秒音频揭示的字数
+            sample_rate: 采样率
+        """
+        self.transcripts = transcripts or self.DEFAULT_TRANSCRIPTS
+        self.chars_per_second = chars_per_second
+        self.sample_rate = sample_rate
+        self._stream_count = 0
+    
+    def create_stream(self) -> ASRStream:
+        text = self.transcripts[self._stream_count % len(self.transcripts)]
+        self._stream_count += 1
+        return _FakeASRStream(text, self.chars_per_second, self.sample_rate)
+    
+    def get_info(self) -> Dict[str, Any]:
+        return {"engine": self.name, "transcripts": len(self.transcripts)}
+
+
+def create_asr_engine(engine: str = "sherpa", model_dir: Optional[str] = None,
+                      num_threads: int = 1) -> ASREngine:
+    """
+    创建识别引擎（假引擎必须显式选择，不会在模型缺失时自动退回）
+    
+    Args:
+        engine: sherpa 或 fake
+        model_dir: 流式 transducer 模型目录（sherpa 引擎需要）
+        num_threads: 推理线程数
+        
+    Raises:
+        ValueError: 未知的引擎名称
+        RuntimeError: sherpa 引擎的模型目录未配置或不存在
+    """
+    if engine == "fake":
+        logger.warning("⚠️ 使用确定性假识别引擎（ASR_ENGINE=fake）")
+        return FakeASREngine()
+    if engine != "sherpa":
+        raise ValueError(f"未知的ASR引擎: {engine}（可选 sherpa、fake）")
+    if not model_dir or not Path(model_dir).exists():
+        raise RuntimeError(f"ASR模型目录未配置或不存在: {model_dir}（设置 ASR_MODEL_DIR，或用 ASR_ENGINE=fake 选择假引擎）")
+    return SherpaOnlineASREngine(model_dir, num_threads=num_threads)
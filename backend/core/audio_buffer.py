@@ -0,0 +1,258 @@
+"""
+音频缓冲区
+提供预分配的环形缓冲区，以及唤醒后带回看（lookback）的语音捕获缓冲区
+"""
+import asyncio
+import numpy as np
+from typing import AsyncIterator, List, Optional
+from loguru import logger
+
+
+class AudioRingBuffer:
+    """预分配的单声道 float32 环形缓冲区，按绝对样本位置寻址"""
+    
+    def __init__(self, capacity: int):
+        """
+        初始化环形缓冲区
+        
+        Args:
+            capacity: 缓冲区容量（样本数）
+        """
+        if capacity <= 0:
+            raise ValueError(f"缓冲区容量必须为正数: {capacity}")
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        self.write_pos = 0  # 累计写入的样本数
+    
+    @property
+    def nbytes(self) -> int:
+        """预分配的缓冲区内存（字节）"""
+        return self._buffer.nbytes
+    
+    @property
+    def oldest_pos(self) -> int:
+        """缓冲区中仍然保留的最早样本位置"""
+        return max(0, self.write_pos - self.capacity)
+    
+    def write(self, samples: np.ndarray):
+        """写入样本（超出容量时覆盖最早的数据）"""
+        n = len(samples)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            # 只保留最后 capacity 个样本
+            self.write_pos += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._buffer[start:start + first] = samples[:first]
+        if first < n:
+            self._buffer[:n - first] = samples[first:]
+        self.write_pos += n
+    
+    def read(self, start: int, end: int) -> List[np.ndarray]:
+        """
+        读取 [start, end) 范围内的样本
+        
+        Args:
+            start: 起始绝对位置（早于 oldest_pos 时自动截断）
+            end: 结束绝对位置（晚于 write_pos 时自动截断）
+            
+        Returns:
+            缓冲区内存的视图列表（零拷贝，跨越环尾时为两段）。
+            视图在对应区域被新数据覆盖前有效。
+        """
+        start = max(start, self.oldest_pos)
+        end = min(end, self.write_pos)
+        if end <= start:
+            return []
+        
+        offset = start % self.capacity
+        n = end - start
+        first = min(n, self.capacity - offset)
+        views = [self._buffer[offset:offset + first]]
+        if first < n:
+            views.append(self._buffer[:n - first])
+        return views
+    
+    def clear(self):
+        """清空缓冲区（不释放内存）"""
+        self.write_pos = 0
+
+
+class AudioRechunker:
+    """
+    把任意大小的音频块重新切分为模型原生大小的块
+
+    不足一块的余量保存在环形缓冲区中，与后续音频拼成整块；输入中完整的整块直接以切片输出（零拷贝）。
+    首块可以比后续块大，用于覆盖模型首次解码需要的右侧上下文，使每个输出块恰好让流多出一次可解码。
+    """
+    
+    def __init__(self, chunk_size: int, first_chunk_size: Optional[int] = None):
+        """
+        初始化切分器
+        
+        Args:
+            chunk_size: 每块的样本数
+            first_chunk_size: 首块的样本数，为None时与 chunk_size 相同
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"块大小必须为正数: {chunk_size}")
+        self.chunk_size = chunk_size
+        self.first_chunk_size = first_chunk_size or chunk_size
+        # 输出的块与新的余量不会重叠：输出的块在下一次 push 前保持有效
+        self.ring = AudioRingBuffer(2 * max(self.chunk_size, self.first_chunk_size))
+        self._pending_start = 0
+        self._next_size = self.first_chunk_size
+    
+    @property
+    def pending(self) -> int:
+        """缓冲中不足一块的样本数"""
+        return self.ring.write_pos - self._pending_start
+    
+    def push(self, samples: np.ndarray) -> List[np.ndarray]:
+        """
+        写入一块音频，取出所有已凑成的整块
+        
+        Args:
+            samples: 任意长度的音频
+        
+        Returns:
+            按顺序排列的音频片段，总长度为整数个块（可能为空）。
+            片段是输入的切片或缓冲区内存的视图，在下一次 push 前有效。
+        """
+        chunks = []
+        while len(samples):
+            if self.pending == 0 and len(samples) >= self._next_size:
+                # 没有余量时直接切出输入中的整块
+                if self._next_size == self.chunk_size:
+                    take = len(samples) // self.chunk_size * self.chunk_size
+                else:
+                    take = self._next_size
+                chunks.append(samples[:take])
+                samples = samples[take:]
+                self._next_size = self.chunk_size
+                continue
+            
+            # 用输入补齐余量
+            take = min(self._next_size - self.pending, len(samples))
+            self.ring.write(samples[:take])
+            samples = samples[take:]
+            if self.pending == self._next_size:
+                # 跨越环尾时拼成一块，保证每块只需送入一次
+                views = self.ring.read(self._pending_start, self.ring.write_pos)
+                chunks.append(views[0] if len(views) == 1 else np.concatenate(views))
+                self._pending_start = self.ring.write_pos
+                self._next_size = self.chunk_size
+        return chunks
+    
+    def flush(self) -> List[np.ndarray]:
+        """取出不足一块的余量（输入结束时使用）"""
+        chunks = self.ring.read(self._pending_start, self.ring.write_pos)
+        self._pending_start = self.ring.write_pos
+        return chunks
+
+
+class CaptureBuffer:
+    """
+    唤醒后的语音捕获缓冲区
+
+    监听期间持续写入音频，只保留最近的回看窗口；唤醒触发后从回看窗口起点开始，
+    把回看音频和之后的实时音频作为流提供给 ASR，直到端点检测调用 close() 结束本次语句。
+    """
+    
+    def __init__(self, sample_rate: int = 16000, lookback_seconds: float = 1.0,
+                 max_seconds: float = 10.0):
+        """
+        初始化捕获缓冲区
+        
+        Args:
+            sample_rate: 采样率
+            lookback_seconds: 触发前回看的音频时长（秒）
+            max_seconds: 单次捕获的最长时长（秒），超过后自动结束
+        """
+        self.sample_rate = sample_rate
+        self.lookback_samples = int(lookback_seconds * sample_rate)
+        self.max_samples = int(max_seconds * sample_rate)
+        self.ring = AudioRingBuffer(self.lookback_samples + self.max_samples)
+        
+        self._start_pos: Optional[int] = None
+        self._read_pos = 0
+        self._closed = True
+        self._data_event = asyncio.Event()
+    
+    @property
+    def is_capturing(self) -> bool:
+        """是否处于捕获中（已触发且未结束）"""
+        return self._start_pos is not None and not self._closed
+    
+    @property
+    def captured_samples(self) -> int:
+        """本次捕获已写入的样本数（含回看音频）"""
+        if self._start_pos is None:
+            return 0
+        return self.ring.write_pos - self._start_pos
+    
+    def append(self, samples: np.ndarray):
+        """写入一块音频"""
+        self.ring.write(samples)
+        if self.is_capturing:
+            if self.captured_samples >= self.lookback_samples + self.max_samples:
+                logger.info("⏱️ 捕获达到最长时长，结束本次语句")
+                self._closed = True
+            self._data_event.set()
+    
+    def trigger(self):
+        """唤醒触发：从回看窗口起点开始捕获"""
+        self._start_pos = max(self.ring.oldest_pos, self.ring.write_pos - self.lookback_samples)
+        self._read_pos = self._start_pos
+        self._closed = False
+        self._data_event.set()
+        logger.debug(f"🎙️ 开始捕获，回看 {(self.ring.write_pos - self._start_pos) / self.sample_rate:.2f}s")
+    
+    def close(self):
+        """结束本次捕获（端点检测触发）"""
+        self._closed = True
+        self._data_event.set()
+    
+    def reset(self):
+        """停止捕获并回到仅记录回看窗口的状态"""
+        self._start_pos = None
+        self._closed = True
+        self._data_event.set()
+    
+    async def stream(self, block_seconds: float = 0.5) -> AsyncIterator[np.ndarray]:
+        """
+        产出捕获的音频，直到捕获结束且数据读完
+        
+        使用方等待解码（在线程池中进行）期间新音频会继续写入环形缓冲区，直接产出环形缓冲区的视图可能被覆盖。
+        因此音频先复制到本次流预分配的块中再产出，块只在使用方取下一块时才被重写：
+        使用方可以在解码完成前一直持有它，不需要再复制，也不会每块分配内存。
+        
+        Args:
+            block_seconds: 每块最多包含的音频时长（秒）
+        
+        Yields:
+            float32 音频块（预分配数组的切片），在取下一块之前有效
+        """
+        block = np.empty(max(1, int(block_seconds * self.sample_rate)), dtype=np.float32)
+        while self._start_pos is not None:
+            if self._read_pos < self.ring.oldest_pos:
+                logger.warning("⚠️ ASR 消费落后，部分捕获音频已被覆盖")
+                self._read_pos = self.ring.oldest_pos
+            
+            end = min(self.ring.write_pos, self._read_pos + len(block))
+            if self._read_pos < end:
+                n = 0
+                for view in self.ring.read(self._read_pos, end):
+                    block[n:n + len(view)] = view
+                    n += len(view)
+                self._read_pos = end
+                yield block[:n]
+            elif self._closed:
+                break
+            else:
+                self._data_event.clear()
+                await self._data_event.wait()
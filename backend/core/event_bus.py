@@ -0,0 +1,256 @@
+"""
+流水线事件总线
+事件只序列化一次，按订阅者分发到各自的有界队列，由每个订阅者独立的写任务并发发送
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from loguru import logger
+
+from .voice_assistant_pipeline import PipelineEvent
+from .memory import get_memory_budget
+
+
+# 队列满时的处理策略
+DROP_OLDEST = "drop_oldest"  # 丢弃最早的消息
+COALESCE = "coalesce"        # 队列满时同类可合并消息只保留最新一条，仍然满时丢弃最早的消息
+
+# 内存压力下每个订阅者的队列上限收紧为原来的比例
+PRESSURE_QUEUE_RATIO = 0.25
+
+
+def event_to_message(event: PipelineEvent) -> Dict[str, Any]:
+    """将流水线事件转换为发送给客户端的消息"""
+    return {
+        "type": "pipeline_event",
+        "event_type": event.event_type,
+        "data": event.data,
+        "state": event.state.value,
+        "timestamp": event.timestamp
+    }
+
+
+class Subscriber:
+    """事件订阅者：有界消息队列 + 独立写任务"""
+    
+    def __init__(self, subscriber_id: str, send: Callable[[str], Awaitable[None]],
+                 topic: Optional[str], max_queue: int, policy: str, send_timeout: float,
+                 close: Optional[Callable[[], Awaitable[None]]] = None):
+        """
+        初始化订阅者
+        
+        Args:
+            subscriber_id: 订阅者ID
+            send: 发送文本消息的协程函数（如 websocket.send_text）
+            topic: 只接收该会话ID的事件，为None时接收全部事件
+            max_queue: 队列长度上限
+            policy: 队列满时的处理策略
+            send_timeout: 单条消息发送超时（秒）
+            close: 关闭连接的协程函数（如 websocket.close），发送超时后调用
+        """
+        self.subscriber_id = subscriber_id
+        self.topic = topic
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self._send = send
+        self._close = close
+        self._queue: Deque[Tuple[Optional[str], str]] = deque()
+        self.queued_bytes = 0  # 队列中消息的总长度（JSON 默认转义为 ASCII，即字节数）
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        
+        # 统计
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.timeouts = 0
+    
+    def start(self):
+        """启动写任务"""
+        self._task = asyncio.create_task(self._writer(), name=f"event-writer-{self.subscriber_id}")
+    
+    async def stop(self):
+        """停止写任务"""
+        self.closed = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+    
+    def offer(self, text: str, coalesce_key: Optional[str] = None):
+        """放入一条已序列化的消息（不阻塞）"""
+        if self.closed:
+            return
+        
+        # 内存压力下收紧队列上限
+        limit = self.max_queue
+        if get_memory_budget().under_pressure:
+            limit = max(1, int(self.max_queue * PRESSURE_QUEUE_RATIO))
+        
+        # 只在队列已满时合并：跟得上的订阅者按原顺序收到每条消息
+        if self.policy == COALESCE and coalesce_key is not None and len(self._queue) >= limit:
+            for i, (key, _) in enumerate(self._queue):
+                if key == coalesce_key:
+                    self.queued_bytes -= len(self._queue[i][1])
+                    del self._queue[i]
+                    self.coalesced += 1
+                    break
+        
+        # 仍然满时丢弃最早的消息
+        while len(self._queue) >= limit:
+            _, dropped = self._queue.popleft()
+            self.queued_bytes -= len(dropped)
+            self.dropped += 1
+        
+        self._queue.append((coalesce_key, text))
+        self.queued_bytes += len(text)
+        self._ready.set()
+    
+    async def _writer(self):
+        """写任务：逐条发送队列中的消息，发送失败或超时后不再使用该连接"""
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            
+            _, text = self._queue.popleft()
+            self.queued_bytes -= len(text)
+            try:
+                await asyncio.wait_for(self._send(text), timeout=self.send_timeout)
+                self.sent += 1
+            except asyncio.TimeoutError:
+                # 发送在中途被取消，连接上可能只写出了半条消息，不能再继续使用
+                self.timeouts += 1
+                self.closed = True
+                logger.warning(f"⚠️ 订阅者 {self.subscriber_id} 发送超时，关闭连接")
+                await self._close_connection()
+            except Exception as e:
+                logger.error(f"发送消息到订阅者 {self.subscriber_id} 失败: {e}")
+                self.closed = True
+    
+    async def _close_connection(self):
+        if self._close is None:
+            return
+        try:
+            await asyncio.wait_for(self._close(), timeout=self.send_timeout)
+        except Exception as e:
+            logger.debug(f"关闭订阅者 {self.subscriber_id} 的连接失败: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取订阅者统计"""
+        return {
+            "topic": self.topic,
+            "queued": len(self._queue),
+            "queued_bytes": self.queued_bytes,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "closed": self.closed,
+        }
+
+
+class EventBus:
+    """流水线事件总线"""
+    
+    def __init__(self, max_queue: int = 100, policy: str = COALESCE, send_timeout: float = 2.0,
+                 coalesce_events: Tuple[str, ...] = ("asr_partial", "status_update")):
+        """
+        初始化事件总线
+        
+        Args:
+            max_queue: 每个订阅者的队列长度上限
+            policy: 队列满时的处理策略（drop_oldest / coalesce）
+            send_timeout: 单条消息发送超时（秒）
+            coalesce_events: 可合并的事件类型（积压时只保留最新一条）
+        """
+        if policy not in (DROP_OLDEST, COALESCE):
+            raise ValueError(f"未知的队列策略: {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.coalesce_events = set(coalesce_events)
+        self.subscribers: Dict[str, Subscriber] = {}
+        # 按会话ID索引订阅者，发布时只访问匹配的订阅者
+        self._by_topic: Dict[str, Dict[str, Subscriber]] = {}
+        self._wildcard: Dict[str, Subscriber] = {}
+        self.published = 0
+    
+    def subscribe(self, subscriber_id: str, send: Callable[[str], Awaitable[None]],
+                  topic: Optional[str] = None,
+                  close: Optional[Callable[[], Awaitable[None]]] = None) -> Subscriber:
+        """
+        添加订阅者（需在事件循环中调用）
+        
+        Args:
+            subscriber_id: 订阅者ID
+            send: 发送文本消息的协程函数
+            topic: 只接收该会话ID的事件，为None时接收全部事件
+            close: 关闭连接的协程函数，发送超时后调用
+        """
+        subscriber = Subscriber(subscriber_id, send, topic, self.max_queue, self.policy, self.send_timeout,
+                                close)
+        old = self.subscribers.get(subscriber_id)
+        if old is not None:
+            self._unindex(old)
+        self.subscribers[subscriber_id] = subscriber
+        if topic is None:
+            self._wildcard[subscriber_id] = subscriber
+        else:
+            self._by_topic.setdefault(topic, {})[subscriber_id] = subscriber
+        subscriber.start()
+        return subscriber
+    
+    async def unsubscribe(self, subscriber_id: str):
+        """移除订阅者并停止其写任务"""
+        subscriber = self.subscribers.pop(subscriber_id, None)
+        if subscriber:
+            self._unindex(subscriber)
+            await subscriber.stop()
+    
+    def _unindex(self, subscriber: Subscriber):
+        if subscriber.topic is None:
+            self._wildcard.pop(subscriber.subscriber_id, None)
+            return
+        topic_subscribers = self._by_topic.get(subscriber.topic)
+        if topic_subscribers is not None:
+            topic_subscribers.pop(subscriber.subscriber_id, None)
+            if not topic_subscribers:
+                del self._by_topic[subscriber.topic]
+    
+    def publish(self, event: PipelineEvent):
+        """发布流水线事件（可直接作为会话的事件回调）"""
+        coalesce_key = event.event_type if event.event_type in self.coalesce_events else None
+        self.publish_message(event_to_message(event), topic=event.session_id, coalesce_key=coalesce_key)
+    
+    def publish_message(self, message: Dict[str, Any], topic: Optional[str] = None,
+                        coalesce_key: Optional[str] = None):
+        """
+        发布任意消息：只序列化一次，然后放入所有匹配订阅者的队列
+        
+        Args:
+            message: 消息内容
+            topic: 消息所属的会话ID
+            coalesce_key: 合并键，积压时同键消息只保留最新一条
+        """
+        targets = [s for s in self._wildcard.values() if not s.closed]
+        if topic is not None and topic in self._by_topic:
+            targets.extend(s for s in self._by_topic[topic].values() if not s.closed)
+        if not targets:
+            return
+        
+        text = json.dumps(message)
+        for subscriber in targets:
+            subscriber.offer(text, coalesce_key)
+        self.published += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取事件总线统计"""
+        return {
+            "published": self.published,
+            "policy": self.policy,
+            "subscribers": {sid: s.get_stats() for sid, s in self.subscribers.items()},
+        }
@@ -0,0 +1,91 @@
+"""
+多模式串匹配器
+基于 Aho–Corasick 自动机，一次线性扫描即可找出文本中所有模式串的出现位置
+"""
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+@dataclass(frozen=True)
+class PatternMatch:
+    """一次模式串匹配"""
+    start: int
+    end: int  # 不含
+    pattern: str
+    payload: Any
+
+
+class AhoCorasickMatcher:
+    """Aho–Corasick 多模式匹配自动机（构建一次，多次匹配）"""
+    
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Tuple[str, Any]]] = [[]]
+        self._built = False
+    
+    def add(self, pattern: str, payload: Any = None):
+        """
+        添加模式串
+        
+        Args:
+            pattern: 模式串
+            payload: 匹配时一并返回的附加数据
+        """
+        if not pattern:
+            raise ValueError("模式串不能为空")
+        if self._built:
+            raise RuntimeError("自动机已构建，不能再添加模式串")
+        
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = nxt
+        self._outputs[node].append((pattern, payload))
+    
+    def build(self) -> "AhoCorasickMatcher":
+        """按 BFS 顺序计算失配指针并合并输出"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._outputs[child].extend(self._outputs[self._fail[child]])
+        self._built = True
+        return self
+    
+    def iter_matches(self, text: str) -> Iterator[PatternMatch]:
+        """
+        扫描文本，按结束位置顺序产出所有匹配（包括重叠匹配）
+        
+        Args:
+            text: 待匹配文本
+        """
+        if not self._built:
+            raise RuntimeError("自动机尚未构建，请先调用 build()")
+        
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern, payload in outputs[node]:
+                yield PatternMatch(i + 1 - len(pattern), i + 1, pattern, payload)
+    
+    @property
+    def num_states(self) -> int:
+        """自动机状态数"""
+        return len(self._goto)
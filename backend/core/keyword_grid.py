@@ -0,0 +1,293 @@
+"""
+唤醒词参数网格评估
+在带标注的语料（正样本：含某个唤醒词的 WAV/录音；负样本：噪声、无关语音或线上录音）上
+遍历 boosting score、trigger threshold、max_active_paths、num_trailing_blanks 的组合，
+多进程并行解码，统计每个唤醒词的漏检率和每小时误唤醒次数（DET 曲线）以及每组参数的实时率。
+"""
+import itertools
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import sherpa_onnx
+from loguru import logger
+
+from ..config import MODEL_DIR, SAMPLE_RATE
+from keyword_compiler import KeywordCompiler, compile_keywords, format_errors, keyword_text
+from .keyword_spotter import model_files
+from .replay import CLIENT_CHUNK_SAMPLES, TARGET_KWS, find_sources, iter_source
+
+
+# 文件结束时补的静音，让最后一个关键词之后的帧也能被解码（与 process_audio_file 相同）
+TAIL_PADDING_SECONDS = 0.3
+
+
+@dataclass(frozen=True)
+class GridPoint:
+    """一组待评估的参数（boosting/threshold 应用到所有唤醒词）"""
+    max_active_paths: int
+    num_trailing_blanks: int
+    boosting: float
+    threshold: float
+
+    @property
+    def curve(self) -> str:
+        """所属 DET 曲线（同一曲线上只有 threshold 不同）"""
+        return f"paths={self.max_active_paths} blanks={self.num_trailing_blanks} boost={self.boosting:g}"
+
+
+@dataclass(frozen=True)
+class CorpusItem:
+    """语料中的一条音频"""
+    path: str
+    label: Optional[str]  # 包含的唤醒词，负样本为 None
+
+
+def load_manifest(path) -> List[CorpusItem]:
+    """
+    读取正样本清单：每行 `音频路径 唤醒词`（路径相对清单所在目录，# 开头为注释）；
+    只有路径没有唤醒词的行视为负样本
+    """
+    path = Path(path)
+    items = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(maxsplit=1)
+        audio = Path(parts[0])
+        if not audio.is_absolute():
+            audio = path.parent / audio
+        items.append(CorpusItem(str(audio), keyword_text(parts[1]) if len(parts) > 1 else None))
+    return items
+
+
+def load_negatives(paths) -> List[CorpusItem]:
+    """负样本：WAV 文件、含 WAV 的目录或录音（目录）"""
+    return [CorpusItem(str(p), None) for p in find_sources(paths)]
+
+
+def build_grid(max_active_paths, num_trailing_blanks, boosting, thresholds) -> List[GridPoint]:
+    """参数的笛卡尔积"""
+    return [GridPoint(*values) for values in itertools.product(
+        max_active_paths, num_trailing_blanks, boosting, thresholds
+    )]
+
+
+# 工作进程内的语料和唤醒词（进程初始化时加载一次）
+_corpus: List[Tuple[List[np.ndarray], float]] = []
+_keywords: List[str] = []
+_model_dir: Path = MODEL_DIR
+_compiler: Optional[KeywordCompiler] = None
+
+
+def _load_corpus(items: List[CorpusItem], keywords: List[str], model_dir: str):
+    global _corpus, _keywords, _model_dir, _compiler
+    # 先校验唤醒词，拼写错误在读取语料之前就报出来
+    _compiler = KeywordCompiler(Path(model_dir) / "tokens.txt")
+    results, _ = compile_keywords(keywords, _compiler)
+    if any(not r.ok for r in results):
+        raise ValueError(f"唤醒词编译失败:\n{format_errors(results)}")
+
+    chunk_samples = CLIENT_CHUNK_SAMPLES[TARGET_KWS]
+    _corpus = []
+    for item in items:
+        chunks = [audio for _, audio in iter_source(item.path, chunk_samples)]
+        _corpus.append((chunks, sum(len(c) for c in chunks) / SAMPLE_RATE))
+    _keywords = keywords
+    _model_dir = Path(model_dir)
+
+
+def _init_worker(items: List[CorpusItem], keywords: List[str], model_dir: str):
+    logger.remove()
+    _load_corpus(items, keywords, model_dir)
+
+
+def _create_spotter(point: GridPoint, keywords_file: Path):
+    files = model_files(_model_dir)
+    return sherpa_onnx.KeywordSpotter(
+        tokens=str(_model_dir / "tokens.txt"),
+        encoder=str(files["encoder"]),
+        decoder=str(files["decoder"]),
+        joiner=str(files["joiner"]),
+        num_threads=1,  # 并行在进程之间，实时率按单线程计算
+        keywords_file=str(keywords_file),
+        max_active_paths=point.max_active_paths,
+        num_trailing_blanks=point.num_trailing_blanks,
+        keywords_score=point.boosting,
+        keywords_threshold=point.threshold,
+    )
+
+
+def _decode(kws, stream, detections: List[str]):
+    """与 KeywordSpotter.process_audio_chunk 相同：每次解码后检查结果，检测到后重置流"""
+    while kws.is_ready(stream):
+        kws.decode_stream(stream)
+        result = kws.get_result(stream)
+        keyword = result if isinstance(result, str) else getattr(result, "keyword", "")
+        if keyword and keyword.strip():
+            detections.append(keyword.strip())
+            kws.reset_stream(stream)
+
+
+def evaluate_point(point: GridPoint) -> Dict[str, Any]:
+    """
+    在工作进程中用一组参数解码全部语料
+
+    Returns:
+        参数、解码耗时和每条音频检测到的唤醒词列表（顺序与语料一致）
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        keywords_file = Path(tmp) / "keywords.txt"
+        keywords_file.write_text("".join(
+            f"{_compiler.compile(f'{kw} :{point.boosting} #{point.threshold}').line}\n" for kw in _keywords
+        ), encoding="utf-8")
+        kws = _create_spotter(point, keywords_file)
+
+    tail = np.zeros(int(TAIL_PADDING_SECONDS * SAMPLE_RATE), dtype=np.float32)
+    decode_seconds = 0.0
+    detections = []
+    for chunks, _ in _corpus:
+        found = []
+        stream = kws.create_stream()
+        start = time.perf_counter()
+        for audio in chunks:
+            stream.accept_waveform(SAMPLE_RATE, audio)
+            _decode(kws, stream, found)
+        stream.accept_waveform(SAMPLE_RATE, tail)
+        stream.input_finished()
+        _decode(kws, stream, found)
+        decode_seconds += time.perf_counter() - start
+        detections.append(found)
+
+    return {"point": point, "decode_seconds": decode_seconds, "detections": detections}
+
+
+def score(result: Dict[str, Any], items: List[CorpusItem], durations: List[float],
+          keywords: List[str]) -> Dict[str, Any]:
+    """
+    计算一组参数下每个唤醒词的漏检率和误唤醒率
+
+    正样本中检测到自己的唤醒词算命中；其余检测（负样本上、或其他唤醒词的正样本上）都算误唤醒，
+    误唤醒率按不含该唤醒词的音频时长归一化为每小时次数
+    """
+    total_seconds = sum(durations)
+    per_keyword = {}
+    for kw in keywords:
+        positives = hits = false_alarms = 0
+        other_seconds = 0.0
+        for item, seconds, found in zip(items, durations, result["detections"]):
+            count = Counter(found)[kw]
+            if item.label == kw:
+                positives += 1
+                hits += count > 0
+            else:
+                false_alarms += count
+                other_seconds += seconds
+        per_keyword[kw] = {
+            "positives": positives,
+            "hits": hits,
+            "miss_rate": round(1 - hits / positives, 4) if positives else None,
+            "false_alarms": false_alarms,
+            "fa_per_hour": round(false_alarms / (other_seconds / 3600), 3) if other_seconds else None,
+        }
+
+    return {
+        **asdict(result["point"]),
+        "rtf": round(result["decode_seconds"] / total_seconds, 4) if total_seconds else None,
+        "keywords": per_keyword,
+    }
+
+
+def det_curves(scores: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """按唤醒词和曲线（除 threshold 以外的参数）整理 DET 曲线上的点，按 threshold 升序"""
+    curves: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    for s in sorted(scores, key=lambda s: s["threshold"]):
+        curve = GridPoint(s["max_active_paths"], s["num_trailing_blanks"], s["boosting"], s["threshold"]).curve
+        for kw, metrics in s["keywords"].items():
+            curves.setdefault(kw, {}).setdefault(curve, []).append({
+                "threshold": s["threshold"],
+                "miss_rate": metrics["miss_rate"],
+                "fa_per_hour": metrics["fa_per_hour"],
+                "rtf": s["rtf"],
+            })
+    return curves
+
+
+def unscored_false_alarms(scores: List[Dict[str, Any]]) -> List[str]:
+    """没有任何负样本或其他唤醒词音频、无法估计误唤醒率的唤醒词（recommend 不为它们推荐参数）"""
+    keywords = scores[0]["keywords"] if scores else {}
+    return [kw for kw in keywords if all(s["keywords"][kw]["fa_per_hour"] is None for s in scores)]
+
+
+def recommend(scores: List[Dict[str, Any]], max_fa_per_hour: float) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    每个唤醒词在误唤醒率不超过 max_fa_per_hour 的参数中选漏检率最低的一组
+    （并列时取误唤醒更少、实时率更低的）
+
+    没有测得误唤醒率（fa_per_hour 为 None）的参数不参与推荐：没有负样本时最低的阈值漏检率总是最低，
+    但误唤醒多少无从得知。这类唤醒词见 unscored_false_alarms
+
+    Returns:
+        {唤醒词: 参数、指标和可直接写入 CUSTOM_KEYWORDS 的配置行}，没有满足条件的参数时为 None
+    """
+    best = {}
+    keywords = scores[0]["keywords"] if scores else {}
+    for kw in keywords:
+        candidates = [
+            s for s in scores
+            if s["keywords"][kw]["miss_rate"] is not None
+            and s["keywords"][kw]["fa_per_hour"] is not None
+            and s["keywords"][kw]["fa_per_hour"] <= max_fa_per_hour
+        ]
+        if not candidates:
+            best[kw] = None
+            continue
+        s = min(candidates, key=lambda s: (
+            s["keywords"][kw]["miss_rate"], s["keywords"][kw]["fa_per_hour"], s["rtf"] or 0
+        ))
+        best[kw] = {
+            "max_active_paths": s["max_active_paths"],
+            "num_trailing_blanks": s["num_trailing_blanks"],
+            "boosting": s["boosting"],
+            "threshold": s["threshold"],
+            "rtf": s["rtf"],
+            **s["keywords"][kw],
+            "config": f"{kw} :{s['boosting']:g} #{s['threshold']:g}",
+        }
+    return best
+
+
+def evaluate_grid(items: List[CorpusItem], keywords: List[str], grid: List[GridPoint],
+                  workers: int = 1, model_dir=None) -> List[Dict[str, Any]]:
+    """
+    多进程评估参数网格（每个工作进程加载一次语料）
+
+    Args:
+        items: 语料（正样本和负样本）
+        keywords: 参与评估的唤醒词文本
+        grid: 参数组合
+        workers: 并行进程数
+        model_dir: 模型目录，默认使用配置中的目录
+
+    Returns:
+        与 grid 顺序一致的每组参数的评估结果
+    """
+    model_dir = str(model_dir or MODEL_DIR)
+    # 主进程也读取一次语料，用于计算时长
+    _load_corpus(items, keywords, model_dir)
+    durations = [seconds for _, seconds in _corpus]
+    logger.info(f"📊 语料 {len(items)} 条，共 {sum(durations) / 60:.1f} 分钟；参数组合 {len(grid)} 组，{workers} 个进程")
+
+    if workers <= 1:
+        results = [evaluate_point(point) for point in grid]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(items, keywords, model_dir)) as pool:
+            results = list(pool.map(evaluate_point, grid))
+
+    return [score(result, items, durations, keywords) for result in results]
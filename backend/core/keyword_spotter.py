@@ -1,41 +1,229 @@
 """
 关键词检测器封装类
 """
+import time
 import numpy as np
 import sherpa_onnx
+from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, FrozenSet, Tuple
 from loguru import logger
 
-# pypinyin 用于将中文转为拼音（含声母/韵母和声调）
+from ..config import (
+    MODEL_DIR, CUSTOM_KEYWORDS, KEYWORD_SETS, DEFAULT_KEYWORD_SET,
+    KWS_DECODE_CHUNK_LEN, KWS_ENCODER_T, KWS_SUBSAMPLING_FACTOR,
+    KWS_FRAME_SHIFT_SECONDS, KWS_FRAME_LENGTH_SECONDS,
+)
+from .audio_buffer import AudioRechunker
+from keyword_compiler import KeywordCompiler, compile_keywords, format_errors, keyword_text
+from .vad_detector import SileroVAD
+from .thread_budget import get_thread_budget
+
 try:
-    from pypinyin import pinyin, Style
+    import onnx
 except Exception:
-    pinyin = None
-    Style = None
+    onnx = None
 
-from ..config import MODEL_DIR, CUSTOM_KEYWORDS
-from .vad_detector import SileroVAD
+
+@dataclass(frozen=True)
+class StreamingGeometry:
+    """流式 KWS 模型的分块结构（特征帧数），由此推出送入模型的音频块大小和结果时间戳的单位"""
+    decode_chunk_len: int = KWS_DECODE_CHUNK_LEN
+    encoder_t: int = KWS_ENCODER_T
+    subsampling_factor: int = KWS_SUBSAMPLING_FACTOR
+    frame_shift: float = KWS_FRAME_SHIFT_SECONDS
+    frame_length: float = KWS_FRAME_LENGTH_SECONDS
+    
+    @property
+    def decode_chunk_seconds(self) -> float:
+        """每次解码消耗的音频时长（chunk-16 模型为 32 帧 × 10ms = 320ms）"""
+        return self.decode_chunk_len * self.frame_shift
+    
+    @property
+    def first_decode_seconds(self) -> float:
+        """
+        首次解码前需要的音频时长
+        
+        sherpa-onnx 在已有特征帧数大于 T 时才解码，即需要 T + 1 帧；snip_edges=false 时第 i 帧（从0计）
+        以 i × 帧移 + 帧移/2 为中心、两侧各半个窗长，最后一帧 i = T 在 T × 帧移 + (帧移 + 窗长)/2 处凑齐。
+        chunk-16 模型：45 × 10ms + (10 + 25)/2 ms = 467.5ms（7480 个样本）
+        """
+        return self.encoder_t * self.frame_shift + (self.frame_shift + self.frame_length) / 2
+    
+    @property
+    def token_frame_seconds(self) -> float:
+        """输出帧间隔（10ms 帧移 × 4 倍下采样 = 40ms），结果时间戳是 token 所在输出帧的起点"""
+        return self.frame_shift * self.subsampling_factor
+
+
+def read_streaming_geometry(encoder_path: Path) -> StreamingGeometry:
+    """
+    从 encoder 的 ONNX 元数据读取 decode_chunk_len 和 T
+    
+    只解析模型文件，不创建推理会话；未安装 onnx（可选依赖 onnx-metadata）、文件不存在或元数据缺少这两项时
+    使用配置中的值（见 backend/config.py）
+    """
+    geometry = StreamingGeometry()
+    if onnx is None or not Path(encoder_path).exists():
+        return geometry
+    try:
+        model = onnx.load(str(encoder_path), load_external_data=False)
+        meta = {prop.key: prop.value for prop in model.metadata_props}
+        geometry = StreamingGeometry(
+            decode_chunk_len=int(meta["decode_chunk_len"]),
+            encoder_t=int(meta["T"]),
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ 无法从 encoder 元数据读取分块参数，使用配置中的值: {e}")
+        return geometry
+    if (geometry.decode_chunk_len, geometry.encoder_t) != (KWS_DECODE_CHUNK_LEN, KWS_ENCODER_T):
+        logger.warning(
+            f"⚠️ encoder 元数据 decode_chunk_len={geometry.decode_chunk_len} T={geometry.encoder_t} "
+            f"与配置 ({KWS_DECODE_CHUNK_LEN}, {KWS_ENCODER_T}) 不一致，按元数据切分音频"
+        )
+    return geometry
+
+
+def model_files(model_dir: Path) -> Dict[str, Path]:
+    """关键词检测模型的 encoder/decoder/joiner 文件路径"""
+    return {
+        name: Path(model_dir) / f"{name}-epoch-12-avg-2-chunk-16-left-64.onnx"
+        for name in ("encoder", "decoder", "joiner")
+    }
+
+
+@dataclass
+class Detection:
+    """唤醒词检测结果（时间均为该流的音频时间，单位秒）"""
+    keyword: str
+    start_time: float    # 关键词第一个 token 的起点
+    end_time: float      # 关键词最后一个 token 的终点
+    tokens: List[str]
+    detected_at: float   # 产生该结果的解码所需的音频时长（触发检测的音频在流中的位置）
+    decode_ms: float     # 本次调用中产生该结果的解码耗时（从调用开始或上一个结果算起）
+    
+    @property
+    def algorithmic_latency_ms(self) -> float:
+        """关键词结束到产生检测结果之间累积的音频时长（不含网络、排队和解码耗时）"""
+        return max(0.0, (self.detected_at - self.end_time) * 1000)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可发送给客户端的字典"""
+        result = asdict(self)
+        for key in ("start_time", "end_time", "detected_at"):
+            result[key] = round(result[key], 3)
+        result["decode_ms"] = round(self.decode_ms, 2)
+        result["algorithmic_latency_ms"] = round(self.algorithmic_latency_ms, 1)
+        return result
+
+
+@dataclass(frozen=True)
+class KeywordSet:
+    """
+    编译好的唤醒词集合（检测器初始化时编译一次，所有选择该集合的流共用）
+    
+    sherpa-onnx 按流传入的关键词是追加在关键词文件之后的，因此集合内不在关键词文件中的唤醒词
+    随流传入，关键词文件中不属于该集合的唤醒词在检测结果中过滤掉
+    """
+    name: str
+    keywords: Tuple[str, ...]
+    labels: FrozenSet[str]          # 集合内唤醒词的文本（与检测结果的 keyword 对应）
+    extra_keywords: Optional[str]   # 需要随流传入的关键词（音素格式，/ 分隔），没有时为None
+    filtered: bool                  # 检测结果是否需要按 labels 过滤
+
+
+class KWSStream:
+    """单路关键词检测流：包装 sherpa-onnx 流并记录该流的音频时间"""
+    
+    def __init__(self, stream, keyword_set: Optional[KeywordSet] = None,
+                 geometry: StreamingGeometry = StreamingGeometry()):
+        self.stream = stream
+        self.keyword_set = keyword_set
+        self.geometry = geometry
+        self.num_samples = 0
+        self.sample_rate = 16000
+        self.decoded_chunks = 0
+        # 结果时间戳相对于上次重置，记录重置时已解码的音频时长以换算成流的音频时间
+        self.segment_start = 0.0
+        # 按模型原生解码块送入音频，每次送入恰好让流多出整数次解码（按首次收到音频的采样率创建）
+        self.rechunker: Optional[AudioRechunker] = None
+    
+    @property
+    def audio_seconds(self) -> float:
+        """已送入模型的音频时长"""
+        return self.num_samples / self.sample_rate
+    
+    @property
+    def pending_samples(self) -> int:
+        """等待凑成整块、尚未送入模型的样本数"""
+        return self.rechunker.pending if self.rechunker else 0
+    
+    @property
+    def decoded_seconds(self) -> float:
+        """已解码的音频时长"""
+        return self.decoded_chunks * self.geometry.decode_chunk_seconds
+    
+    @property
+    def decoded_input_seconds(self) -> float:
+        """
+        已完成的解码所消耗的输入音频时长
+        
+        首次解码需要 first_decode_seconds 的音频，之后每次解码再需要 decode_chunk_seconds；
+        检测结果由最近一次解码产生，这就是触发检测的音频在流中的位置
+        """
+        if self.decoded_chunks == 0:
+            return 0.0
+        offset = self.geometry.first_decode_seconds - self.geometry.decode_chunk_seconds
+        return min(self.decoded_seconds + offset, self.audio_seconds)
+    
+    def accept_waveform(self, sample_rate: int, samples: np.ndarray):
+        """缓冲音频，把凑成的整块送入模型"""
+        if self.rechunker is None:
+            self.rechunker = AudioRechunker(round(self.geometry.decode_chunk_seconds * sample_rate),
+                                            round(self.geometry.first_decode_seconds * sample_rate))
+            self.sample_rate = sample_rate
+        for chunk in self.rechunker.push(samples):
+            self._feed(chunk)
+    
+    def _feed(self, samples: np.ndarray):
+        self.stream.accept_waveform(self.sample_rate, samples)
+        self.num_samples += len(samples)
+    
+    def input_finished(self):
+        """送入不足一块的余量并结束输入"""
+        if self.rechunker is not None:
+            for chunk in self.rechunker.flush():
+                self._feed(chunk)
+        self.stream.input_finished()
 
 
 class KeywordSpotter:
     """关键词检测器封装类"""
     
-    def __init__(self, model_dir: str = None, keywords: List[str] = None):
+    def __init__(self, model_dir: str = None, keywords: List[str] = None,
+                 keyword_sets: Dict[str, List[str]] = None):
         """
         初始化关键词检测器
         
         Args:
             model_dir: 模型目录路径
-            keywords: 自定义关键词列表
+            keywords: 自定义关键词列表（写入关键词文件，未指定集合的流使用）
+            keyword_sets: 集合名称 -> 关键词列表，流创建时按名称选择
         """
         self.model_dir = Path(model_dir) if model_dir else MODEL_DIR
         self.keywords = keywords or CUSTOM_KEYWORDS
         self.kws = None
         self.keywords_file = None
+        self.keyword_sets: Dict[str, KeywordSet] = {}
+        self.num_threads = get_thread_budget().plan.kws_threads
+        self.provider = "cpu"  # 可改为 "cuda" 如果有 GPU
+        self.compiler = KeywordCompiler(self.model_dir / "tokens.txt")
+        self.geometry = read_streaming_geometry(model_files(self.model_dir)["encoder"])
         
-        # 创建关键词文件
+        # 创建关键词文件并编译各唤醒词集合（在加载模型之前校验，拼写错误不用等到引擎拒绝关键词文件）
         self._create_keywords_file()
+        for name, set_keywords in (KEYWORD_SETS if keyword_sets is None else keyword_sets).items():
+            self.add_keyword_set(name, set_keywords)
         
         # 初始化检测器
         self._initialize_spotter()
@@ -43,66 +231,25 @@ class KeywordSpotter:
         # 初始化VAD检测器
         self.vad = SileroVAD(self.model_dir)
     
-    def _hanzi_to_token_line(self, text: str) -> str:
-        """将中文转换为音素格式，支持boosting score和trigger threshold"""
-        if not pinyin or not Style:
-            return text  # 退化：仍然写原文
-        
-        # 解析boosting score和trigger threshold
-        boosting_score = ""
-        trigger_threshold = ""
-        original_text = text
-        
-        # 提取boosting score (格式: :1.5)
-        if " :" in text:
-            parts = text.split(" :")
-            original_text = parts[0]
-            if len(parts) > 1:
-                remaining = parts[1]
-                if " #" in remaining:
-                    score_parts = remaining.split(" #")
-                    boosting_score = f" :{score_parts[0]}"
-                    if len(score_parts) > 1:
-                        trigger_threshold = f" #{score_parts[1]}"
-                else:
-                    boosting_score = f" :{remaining}"
-        
-        # 获取每个字的声母、韵母（带调）
-        initials = pinyin(original_text, style=Style.INITIALS, strict=False, errors="ignore")
-        finals = pinyin(original_text, style=Style.FINALS_TONE, strict=False, errors="ignore")
-
-        tokens = []
-        for (ini_list, fin_list) in zip(initials, finals):
-            ini = (ini_list[0] or "").strip()
-            fin = (fin_list[0] or "").strip()
-            # 可能遇到非汉字或被忽略内容
-            if not ini and not fin:
-                continue
-            if ini:
-                tokens.append(ini)
-            if fin:
-                tokens.append(fin)
-        
-        token_str = " ".join(tokens)
-        # 在末尾追加中文展示用标签，便于结果显示
-        result = f"{token_str}{boosting_score}{trigger_threshold} @{original_text}" if token_str else original_text
-        return result
-
+    def _compile(self, keywords: List[str]) -> List[str]:
+        """把关键词编译为关键词文件格式，有无法编译的关键词时抛出 ValueError 并列出全部出错的行"""
+        results, _ = compile_keywords(keywords, self.compiler)
+        if any(not r.ok for r in results):
+            raise ValueError(f"关键词编译失败:\n{format_errors(results)}")
+        return [r.line for r in results]
+    
     def _create_keywords_file(self):
         """创建关键词文件"""
         # 创建自定义关键词文件
         self.keywords_file = self.model_dir / "custom_keywords.txt"
         
         # 将中文关键词转换为音素格式
-        converted_lines = [self._hanzi_to_token_line(kw) for kw in self.keywords]
+        converted_lines = self._compile(self.keywords)
         
         with open(self.keywords_file, "w", encoding="utf-8") as f:
             for line in converted_lines:
                 f.write(f"{line}\n")
         
-        if not pinyin:
-            logger.warning("⚠️ 未安装 pypinyin，已按原文写入。建议安装：pip install pypinyin。否则会出现 tokens 无法匹配的错误。")
-        
         logger.info(f"✅ 关键词文件已创建: {self.keywords_file}")
         logger.info(f"关键词列表: {self.keywords}")
         logger.debug(f"转换后的音素格式: {converted_lines}")
@@ -112,19 +259,7 @@ class KeywordSpotter:
         try:
             logger.info(f"正在加载模型: {self.model_dir}")
             
-            self.kws = sherpa_onnx.KeywordSpotter(
-                tokens=str(self.model_dir / "tokens.txt"),
-                encoder=str(self.model_dir / "encoder-epoch-12-avg-2-chunk-16-left-64.onnx"),
-                decoder=str(self.model_dir / "decoder-epoch-12-avg-2-chunk-16-left-64.onnx"),
-                joiner=str(self.model_dir / "joiner-epoch-12-avg-2-chunk-16-left-64.onnx"),
-                num_threads=2,
-                keywords_file=str(self.keywords_file),
-                provider="cpu",  # 可改为 "cuda" 如果有 GPU
-                max_active_paths=4,
-                num_trailing_blanks=1,
-                keywords_score=1.0,
-                keywords_threshold=0.0001,  # 极低阈值，几乎任何音频都会触发
-            )
+            self.kws = self._create_spotter(model_files(self.model_dir))
             
             logger.success("✅ 模型加载成功！")
             
@@ -132,24 +267,118 @@ class KeywordSpotter:
             logger.error(f"❌ 模型加载失败: {e}")
             raise
     
-    def create_stream(self):
-        """创建音频流"""
+    def _create_spotter(self, model_files: Dict[str, Path]):
+        """用给定的模型文件创建 sherpa-onnx 关键词检测器"""
+        return sherpa_onnx.KeywordSpotter(
+            tokens=str(self.model_dir / "tokens.txt"),
+            encoder=str(model_files["encoder"]),
+            decoder=str(model_files["decoder"]),
+            joiner=str(model_files["joiner"]),
+            num_threads=self.num_threads,
+            keywords_file=str(self.keywords_file),
+            provider=self.provider,
+            max_active_paths=4,
+            num_trailing_blanks=1,
+            keywords_score=1.0,
+            keywords_threshold=0.0001,  # 极低阈值，几乎任何音频都会触发
+        )
+    
+    def add_keyword_set(self, name: str, keywords: List[str]) -> KeywordSet:
+        """
+        编译并缓存一个唤醒词集合
+        
+        Args:
+            name: 集合名称
+            keywords: 关键词列表（格式同 CUSTOM_KEYWORDS）
+        
+        Returns:
+            编译好的集合
+        """
+        if not keywords:
+            raise ValueError(f"唤醒词集合 {name} 为空")
+        
+        labels = frozenset(keyword_text(kw) for kw in keywords)
+        file_labels = {keyword_text(kw) for kw in self.keywords}
+        extra = self._compile([kw for kw in keywords if kw not in self.keywords])
+        keyword_set = KeywordSet(
+            name=name,
+            keywords=tuple(keywords),
+            labels=labels,
+            extra_keywords="/".join(extra) if extra else None,
+            filtered=not file_labels <= labels,
+        )
+        
+        self.keyword_sets[name] = keyword_set
+        logger.info(f"✅ 唤醒词集合 {name}: {sorted(labels)}")
+        return keyword_set
+    
+    def get_keyword_set(self, name: Optional[str] = None) -> KeywordSet:
+        """按名称获取唤醒词集合（为None时使用默认集合），不存在时抛出 ValueError"""
+        name = name or DEFAULT_KEYWORD_SET
+        if name not in self.keyword_sets:
+            raise ValueError(f"未知的唤醒词集合: {name}")
+        return self.keyword_sets[name]
+    
+    def create_stream(self, keyword_set: Optional[str] = None) -> KWSStream:
+        """
+        创建音频流
+        
+        Args:
+            keyword_set: 唤醒词集合名称，为None时使用默认集合（未配置默认集合时使用关键词文件）
+        """
         if not self.kws:
             raise RuntimeError("检测器未初始化")
-        return self.kws.create_stream()
+        if keyword_set is None and DEFAULT_KEYWORD_SET not in self.keyword_sets:
+            return KWSStream(self.kws.create_stream(), geometry=self.geometry)
+        
+        compiled = self.get_keyword_set(keyword_set)
+        if compiled.extra_keywords is None:
+            return KWSStream(self.kws.create_stream(), compiled, self.geometry)
+        return KWSStream(self.kws.create_stream(compiled.extra_keywords), compiled, self.geometry)
+    
+    def warm_stream(self, seconds: float = 1.0) -> KWSStream:
+        """创建一个已送入并解码了一段静音的流（流的内存达到稳态，用于测量每路流的内存成本）"""
+        stream = self.create_stream()
+        self.process_audio_chunk(stream, np.zeros(int(seconds * 16000), dtype=np.float32), 16000)
+        return stream
+    
+    def _make_detection(self, stream: KWSStream, keyword: str, decode_ms: float) -> Detection:
+        """从流的结果对象生成检测结果，时间戳换算为流的音频时间"""
+        tokens = list(self.kws.tokens(stream.stream))
+        timestamps = list(self.kws.timestamps(stream.stream))
+        decoded = stream.decoded_seconds
+        
+        if timestamps:
+            start_time = stream.segment_start + timestamps[0]
+            end_time = stream.segment_start + timestamps[-1] + stream.geometry.token_frame_seconds
+        else:
+            start_time = end_time = decoded
+        
+        return Detection(
+            keyword=keyword,
+            start_time=min(start_time, decoded),
+            end_time=min(end_time, decoded),
+            tokens=tokens,
+            detected_at=stream.decoded_input_seconds,
+            decode_ms=decode_ms,
+        )
     
-    def process_audio_chunk(self, stream, audio_data: np.ndarray, sample_rate: int = 16000) -> Optional[str]:
+    def process_audio_chunk(self, stream: KWSStream, audio_data: np.ndarray,
+                            sample_rate: int = 16000) -> List[Detection]:
         """
         处理音频数据块（集成VAD和KWS）
         
+        积压合并后的长音频块里可能有不止一次唤醒，每次检测后重置流并继续解码，不丢结果
+        
         Args:
-            stream: 音频流对象
+            stream: create_stream 创建的音频流
             audio_data: 音频数据 (numpy array)
             sample_rate: 采样率
             
         Returns:
-            检测到的关键词，如果没有检测到则返回None
+            按时间顺序的检测结果，没有检测到时为空列表
         """
+        detections = []
         try:
             # 减少日志频率 - 每50个音频块输出一次
             if hasattr(self, '_kws_count'):
@@ -164,26 +393,44 @@ class KeywordSpotter:
             stream.accept_waveform(sample_rate, audio_data)
             
             # 检测关键词 - 每次decode_stream后都检查结果
-            while self.kws.is_ready(stream):
-                self.kws.decode_stream(stream)
+            decode_ms = 0.0
+            while self.kws.is_ready(stream.stream):
+                decode_start = time.perf_counter()
+                self.kws.decode_stream(stream.stream)
+                decode_ms += (time.perf_counter() - decode_start) * 1000
+                stream.decoded_chunks += 1
                 
                 # 每次解码后都检查结果
-                result = self.kws.get_result(stream)
+                result = self.kws.get_result(stream.stream)
                 keyword = result if isinstance(result, str) else getattr(result, "keyword", "")
                 
                 if keyword and keyword.strip():
-                    logger.info(f"🎯 检测到唤醒词: '{keyword.strip()}'")
+                    keyword_set = stream.keyword_set
+                    if keyword_set is not None and keyword_set.filtered and keyword.strip() not in keyword_set.labels:
+                        # 关键词文件中不属于该流集合的唤醒词：丢弃结果并重置，继续解码
+                        logger.debug(f"忽略集合 {keyword_set.name} 之外的唤醒词: '{keyword.strip()}'")
+                        self.kws.reset_stream(stream.stream)
+                        stream.segment_start = stream.decoded_seconds
+                        continue
+                    detection = self._make_detection(stream, keyword.strip(), decode_ms)
+                    logger.info(
+                        f"🎯 检测到唤醒词: '{detection.keyword}' "
+                        f"[{detection.start_time:.2f}s - {detection.end_time:.2f}s] "
+                        f"算法延迟 {detection.algorithmic_latency_ms:.0f}ms"
+                    )
+                    detections.append(detection)
+                    decode_ms = 0.0
                     # 检测到关键词后重置stream状态，以便下次检测
-                    self.kws.reset_stream(stream)
-                    return keyword.strip()
+                    self.kws.reset_stream(stream.stream)
+                    stream.segment_start = stream.decoded_seconds
             
-            return None
+            return detections
             
         except Exception as e:
             logger.error(f"❌ KWS音频处理错误: {e}")
             import traceback
             logger.error(f"❌ KWS错误详情: {traceback.format_exc()}")
-            return None
+            return detections
     
     def process_audio_file(self, audio_file: str) -> Optional[str]:
         """
@@ -218,10 +465,10 @@ class KeywordSpotter:
             stream.input_finished()
             
             # 检测
-            while self.kws.is_ready(stream):
-                self.kws.decode_stream(stream)
+            while self.kws.is_ready(stream.stream):
+                self.kws.decode_stream(stream.stream)
             
-            result = self.kws.get_result(stream)
+            result = self.kws.get_result(stream.stream)
             
             # 兼容不同版本的返回格式
             keyword = result if isinstance(result, str) else getattr(result, "keyword", "")
@@ -243,7 +490,15 @@ class KeywordSpotter:
             "model_dir": str(self.model_dir),
             "keywords": self.keywords,
             "keywords_file": str(self.keywords_file),
+            "keyword_sets": {name: list(ks.keywords) for name, ks in self.keyword_sets.items()},
             "sample_rate": 16000,
+            "num_threads": self.num_threads,
+            "streaming": {
+                "decode_chunk_len": self.geometry.decode_chunk_len,
+                "T": self.geometry.encoder_t,
+                "decode_chunk_seconds": self.geometry.decode_chunk_seconds,
+                "first_decode_seconds": self.geometry.first_decode_seconds,
+            },
             "threshold": 0.1  # 与初始化时的阈值保持一致
         }
         
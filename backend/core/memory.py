@@ -0,0 +1,217 @@
+"""
+进程内存统计与会话内存预算
+每个会话登记自己的内存组成：启动时测得的单位成本（KWS 流、VAD 等）加上实时跟踪的缓冲区大小
+（音频积压、捕获缓冲区、待发送消息），进程 RSS 接近预算时拒绝新会话并让已有会话丢弃可丢弃的缓冲
+"""
+import gc
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Union
+from loguru import logger
+
+from ..config import MEMORY_BUDGET_BYTES, MEMORY_SHED_RATIO
+
+
+# RSS 读取结果的缓存时长（秒），收包路径上频繁检查内存压力时避免每次都读 /proc
+RSS_CACHE_SECONDS = 0.5
+
+# 会话内存组成：固定字节数，或返回当前字节数的函数
+MemoryComponent = Union[int, Callable[[], int]]
+
+
+def process_rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（RSS，字节），读取 /proc/self/statm；不支持的平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryBudget:
+    """进程级内存预算：会话内存记账、准入判断与内存压力检测"""
+
+    def __init__(self, max_bytes: Optional[int] = None, shed_ratio: float = 0.9):
+        """
+        初始化内存预算
+
+        Args:
+            max_bytes: 进程 RSS 上限（字节），为None时只记账不限制
+            shed_ratio: RSS 超过上限的该比例时视为内存压力，会话开始丢弃可丢弃的缓冲
+        """
+        self.max_bytes = max_bytes
+        self.shed_ratio = shed_ratio
+        self.unit_costs: Dict[str, int] = {}
+        self.sessions: Dict[str, Dict[str, MemoryComponent]] = {}
+        # 已准入但尚未登记的会话预留的内存：它们的内存还没有体现在 RSS 中
+        self.reservations: Dict[str, int] = {}
+
+        self._rss: Optional[int] = None
+        self._rss_at = 0.0
+        self._under_pressure = False
+
+        # 统计
+        self.rejected = 0
+        self.pressure_events = 0
+
+    def measure(self, name: str, factory: Callable[[], Any], count: int = 8) -> Optional[int]:
+        """
+        测量单个对象的内存成本（创建 count 个对象前后的 RSS 差 / count），测量后释放这些对象
+
+        Args:
+            name: 成本名称（如 kws_stream、vad）
+            factory: 创建一个对象的函数，可在返回前让对象进入稳定状态（如送入一段音频）
+            count: 创建的对象数，越多越能摊平内存页粒度带来的误差
+
+        Returns:
+            单个对象的字节数，无法读取 RSS 时返回None
+        """
+        gc.collect()
+        before = process_rss_bytes()
+        objects = [factory() for _ in range(count)]
+        after = process_rss_bytes()
+        del objects
+        gc.collect()
+        if before is None or after is None:
+            return None
+
+        cost = max(0, (after - before) // count)
+        self.unit_costs[name] = cost
+        logger.info(f"📏 内存成本 {name}: {cost / 1024:.1f}KB")
+        return cost
+
+    def unit_cost(self, name: str) -> int:
+        """启动时测得的单位成本（未测量时为0）"""
+        return self.unit_costs.get(name, 0)
+
+    def register(self, session_id: str, **components: MemoryComponent):
+        """
+        登记会话的内存组成（会话的内存已分配，释放准入时的预留并让下次检查重新读取 RSS）
+
+        Args:
+            session_id: 会话ID
+            components: 组成名称 -> 固定字节数，或返回当前字节数的函数（如缓冲区大小）
+        """
+        self.sessions[session_id] = components
+        if self.reservations.pop(session_id, None) is not None:
+            self._rss = None
+
+    def unregister(self, session_id: str):
+        """注销会话并释放未使用的预留"""
+        self.sessions.pop(session_id, None)
+        self.reservations.pop(session_id, None)
+
+    def release(self, session_id: str):
+        """释放准入时的预留（准入后未能建立会话时调用）"""
+        self.reservations.pop(session_id, None)
+
+    @property
+    def reserved_bytes(self) -> int:
+        """已准入但尚未登记的会话预留的字节数"""
+        return sum(self.reservations.values())
+
+    def session_usage(self, session_id: str) -> Dict[str, int]:
+        """会话当前各组成的字节数及合计"""
+        usage = {}
+        for name, component in self.sessions.get(session_id, {}).items():
+            try:
+                usage[name] = int(component() if callable(component) else component)
+            except Exception:
+                usage[name] = 0
+        usage["total"] = sum(usage.values())
+        return usage
+
+    @property
+    def accounted_bytes(self) -> int:
+        """所有会话记账的字节数"""
+        return sum(self.session_usage(sid)["total"] for sid in list(self.sessions))
+
+    @property
+    def session_estimate(self) -> int:
+        """新会话的预计内存：已有会话的平均值，没有会话时为各单位成本之和"""
+        if self.sessions:
+            return self.accounted_bytes // len(self.sessions)
+        return sum(self.unit_costs.values())
+
+    def rss_bytes(self) -> Optional[int]:
+        """当前 RSS（缓存 RSS_CACHE_SECONDS 秒）"""
+        now = time.monotonic()
+        if self._rss is None or now - self._rss_at >= RSS_CACHE_SECONDS:
+            self._rss = process_rss_bytes()
+            self._rss_at = now
+        return self._rss
+
+    @property
+    def under_pressure(self) -> bool:
+        """RSS 是否超过预算的 shed_ratio（未设置预算时始终为False）"""
+        if self.max_bytes is None:
+            return False
+        rss = self.rss_bytes()
+        pressure = rss is not None and rss >= self.max_bytes * self.shed_ratio
+        if pressure and not self._under_pressure:
+            self.pressure_events += 1
+            logger.warning(f"⚠️ 内存压力: RSS {rss / 1024 / 1024:.1f}MB，预算 {self.max_bytes / 1024 / 1024:.1f}MB，开始丢弃缓冲")
+        elif not pressure and self._under_pressure:
+            logger.info("内存压力解除")
+        self._under_pressure = pressure
+        return pressure
+
+    def admit(self, session_id: str) -> bool:
+        """
+        判断能否接纳新会话：当前 RSS 加上其他会话的预留和新会话的预计内存不超过预算，且不处于内存压力下；
+        接纳时为该会话预留预计内存，直到 register() 或 unregister()。同一会话再次调用时替换自己的预留
+
+        Args:
+            session_id: 申请接纳的会话ID
+        """
+        if self.max_bytes is None:
+            return True
+        rss = self.rss_bytes()
+        if rss is None:
+            return True
+        estimate = self.session_estimate
+        reserved = self.reserved_bytes - self.reservations.get(session_id, 0)
+        if self.under_pressure or rss + reserved + estimate > self.max_bytes:
+            self.reservations.pop(session_id, None)
+            self.rejected += 1
+            logger.warning(f"⚠️ 会话 {session_id} 被拒绝: 内存不足 (RSS {rss / 1024 / 1024:.1f}MB，"
+                           f"预留 {reserved / 1024 / 1024:.1f}MB)")
+            return False
+        self.reservations[session_id] = estimate
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取内存预算与各会话的内存记账"""
+        rss = self.rss_bytes()
+        estimate = self.session_estimate
+        sessions = {sid: self.session_usage(sid) for sid in list(self.sessions)}
+        accounted = sum(usage["total"] for usage in sessions.values())
+        headroom = None
+        if self.max_bytes is not None and rss is not None and estimate:
+            headroom = max(0, (self.max_bytes - rss - self.reserved_bytes) // estimate)
+        return {
+            "max_bytes": self.max_bytes,
+            "shed_ratio": self.shed_ratio,
+            "rss_bytes": rss,
+            "accounted_bytes": accounted,
+            "reserved_bytes": self.reserved_bytes,
+            "unaccounted_bytes": rss - accounted if rss is not None else None,
+            "under_pressure": self.under_pressure,
+            "unit_costs": dict(self.unit_costs),
+            "session_estimate_bytes": estimate,
+            "headroom_sessions": headroom,
+            "rejected": self.rejected,
+            "pressure_events": self.pressure_events,
+            "sessions": sessions,
+        }
+
+
+_memory_budget: Optional[MemoryBudget] = None
+
+
+def get_memory_budget() -> MemoryBudget:
+    """获取进程级内存预算（按配置创建）"""
+    global _memory_budget
+    if _memory_budget is None:
+        _memory_budget = MemoryBudget(MEMORY_BUDGET_BYTES, MEMORY_SHED_RATIO)
+    return _memory_budget
@@ -0,0 +1,532 @@
+"""
+会话录音
+按比例抽样会话，把收到的原始音频（int16 PCM）、音频块索引（序号、到达时间、样本偏移、样本数）
+和检测结果写入磁盘，用于离线回放复现线上问题。
+音频路径只把数据放入有界队列，由后台线程写盘；队列满时丢弃并计数，不会阻塞音频处理。
+
+录音目录结构（每个会话一个目录）:
+    meta.json         会话信息（采样率、唤醒词集合、开始/结束时间、丢弃块数）
+    audio.pcm         int16 单声道原始音频，可直接 np.memmap
+    index.bin         INDEX_DTYPE 定长记录，可直接 np.memmap；序号不连续处为被丢弃的块
+    detections.jsonl  每行一条检测结果
+    .writer.lock      写入期间由写盘进程持有的 flock，进程退出后自动释放
+"""
+import json
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock，多个工作进程共用录音目录时无法互斥
+    fcntl = None
+
+from ..config import (
+    RECORDING_ENABLED, RECORDING_DIR, RECORDING_SAMPLING_RATIO,
+    RECORDING_MAX_BYTES, RECORDING_QUEUE_SIZE
+)
+
+
+FORMAT_VERSION = 1
+
+# 音频块索引：序号、相对会话开始的到达时间（秒）、在 audio.pcm 中的样本偏移、样本数
+INDEX_DTYPE = np.dtype([
+    ("seq", "<u4"),
+    ("arrival", "<f8"),
+    ("offset", "<u8"),
+    ("samples", "<u4"),
+])
+
+AUDIO_FILE = "audio.pcm"
+INDEX_FILE = "index.bin"
+DETECTIONS_FILE = "detections.jsonl"
+META_FILE = "meta.json"
+LOCK_FILE = ".recorder.lock"
+WRITER_LOCK_FILE = ".writer.lock"
+
+# float32 与 int16 PCM 之间的换算系数，与前端 (x * 32768 截断到 [-32768, 32767]) 和 backend/main.py (/ 32768) 一致，
+# 客户端发来的音频写盘再读回时逐样本不变
+PCM_SCALE = 32768.0
+
+
+def to_pcm16(samples: np.ndarray) -> np.ndarray:
+    """float32 音频转 int16 PCM（超出范围的样本截断）"""
+    return np.clip(samples * PCM_SCALE, -32768, 32767).astype(np.int16)
+
+
+def from_pcm16(pcm: np.ndarray) -> np.ndarray:
+    """int16 PCM 转 float32 音频（结果在 [-1, 1] 内）"""
+    return np.clip(pcm.astype(np.float32) / PCM_SCALE, -1.0, 1.0)
+
+
+# 本进程写入超过目录上限的这一比例后，重新统计录音目录的实际大小。
+# 预 fork 的工作进程共用同一目录，各自只知道自己写了多少，超出上限的量不超过 进程数 × 上限 / 该值
+USAGE_SYNC_FRACTION = 64
+
+
+class SessionRecording:
+    """单个会话的录音句柄（在事件循环中调用，只入队不写盘）"""
+
+    def __init__(self, recorder: "Recorder", session_id: str, path: Path, sample_rate: int,
+                 keyword_set: Optional[str] = None):
+        self.recorder = recorder
+        self.session_id = session_id
+        self.path = path
+        self.sample_rate = sample_rate
+        self.keyword_set = keyword_set
+        self.seq = 0
+        self.dropped_chunks = 0
+        self._start = time.monotonic()
+
+        # 以下只由写盘线程访问
+        self._files: Dict[str, Any] = {}
+        self._writer_lock = None
+        self._samples_written = 0
+
+    def write_audio(self, samples: np.ndarray):
+        """
+        记录收到的音频块
+
+        Args:
+            samples: int16 或归一化到 [-1, 1] 的 float32 音频；入队后调用方不能再修改该数组
+        """
+        arrival = time.monotonic() - self._start
+        if not self.recorder.submit(("audio", self, self.seq, arrival, samples)):
+            self.dropped_chunks += 1
+        self.seq += 1
+
+    def write_detection(self, detection: Dict[str, Any]):
+        """记录检测结果（关联到最近收到的音频块）"""
+        record = {"seq": self.seq - 1, "arrival": round(time.monotonic() - self._start, 4), **detection}
+        self.recorder.submit(("detection", self, record))
+
+    def close(self):
+        """结束录音"""
+        self.recorder.submit(("close", self))
+
+
+class Recorder:
+    """录音管理：抽样决定是否录音，后台线程统一写盘，并限制录音目录的总大小"""
+
+    def __init__(self, root: Optional[Path] = None, enabled: bool = False, sampling_ratio: float = 1.0,
+                 max_bytes: int = 1 << 30, queue_size: int = 256):
+        """
+        初始化录音管理
+
+        Args:
+            root: 录音根目录
+            enabled: 是否启用录音
+            sampling_ratio: 被录音的会话比例 (0-1)
+            max_bytes: 录音目录的总大小上限（多个工作进程共用），超出时删除最早的已结束录音
+                （含写入进程已退出的未结束录音），仍超出则丢弃新数据
+            queue_size: 待写盘的音频块上限
+        """
+        self.root = Path(root) if root else RECORDING_DIR
+        self.enabled = enabled
+        self.sampling_ratio = sampling_ratio
+        self.max_bytes = max_bytes
+
+        self.queue_size = queue_size
+        self._queue: "queue.Queue[Tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._active: Dict[str, SessionRecording] = {}
+        self._bytes_used = 0
+        self._unsynced_bytes = 0
+        self.sync_bytes = max(1, max_bytes // USAGE_SYNC_FRACTION)
+
+        # 统计
+        self.sessions_recorded = 0
+        self.sessions_skipped = 0
+        self.dropped_chunks = 0
+        self.bytes_written = 0
+        self.evicted_sessions = 0
+        self.recovered_sessions = 0
+        self.rejected_writes = 0
+        self._rejecting = False
+
+    def start_session(self, session_id: str, sample_rate: int = 16000,
+                      keyword_set: Optional[str] = None) -> Optional[SessionRecording]:
+        """
+        开始一个会话的录音
+
+        Args:
+            session_id: 会话ID
+            sample_rate: 采样率
+            keyword_set: 会话使用的唤醒词集合（回放时使用同一集合）
+
+        Returns:
+            录音句柄；未启用或未被抽中时返回None
+        """
+        if not self.enabled:
+            return None
+        if random.random() >= self.sampling_ratio:
+            self.sessions_skipped += 1
+            return None
+
+        self._ensure_started()
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{session_id}"
+        recording = SessionRecording(self, session_id, self.root / name, sample_rate, keyword_set)
+        self.submit(("open", recording))
+        self.sessions_recorded += 1
+        logger.info(f"🎙️ 会话 {session_id} 开始录音: {recording.path}")
+        return recording
+
+    def submit(self, message: Tuple) -> bool:
+        """
+        把消息交给写盘线程（不阻塞）
+
+        只有音频消息受队列上限约束，超出时直接丢弃；打开/关闭/检测消息总是入队，保证文件正确创建和关闭
+
+        Returns:
+            消息是否入队
+        """
+        if message[0] == "audio" and self._queue.qsize() >= self.queue_size:
+            self.dropped_chunks += 1
+            return False
+        self._queue.put_nowait(message)
+        return True
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.root.mkdir(parents=True, exist_ok=True)
+                with self._dir_lock():
+                    self._recover_abandoned()
+                self._bytes_used = self._disk_usage(self.root)
+                self._thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """关闭所有录音并停止写盘线程"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        for recording in list(self._active.values()):
+            recording.close()
+        self._queue.put(("stop",))
+        self._thread.join(timeout)
+
+    # ---- 以下在写盘线程中运行 ----
+
+    def _run(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                # 空闲时把缓冲写入磁盘，进程异常退出时也能保留大部分数据
+                self._flush_all()
+                continue
+
+            kind = message[0]
+            if kind == "stop":
+                self._flush_all()
+                return
+            try:
+                getattr(self, f"_handle_{kind}")(*message[1:])
+            except Exception as e:
+                logger.error(f"❌ 录音写入失败 ({kind}): {e}")
+
+    def _handle_open(self, recording: SessionRecording):
+        # 在目录锁内创建目录并取得写入锁，其他进程不会把刚创建的录音当成遗留录音删除
+        with self._dir_lock():
+            recording.path.mkdir(parents=True, exist_ok=True)
+            recording._writer_lock = self._acquire_writer_lock(recording.path)
+        recording._files = {
+            "audio": open(recording.path / AUDIO_FILE, "wb"),
+            "index": open(recording.path / INDEX_FILE, "wb"),
+            "detections": open(recording.path / DETECTIONS_FILE, "w", encoding="utf-8"),
+        }
+        self._active[recording.session_id] = recording
+        self._write_meta(recording, closed=False)
+
+    def _handle_audio(self, recording: SessionRecording, seq: int, arrival: float, samples: np.ndarray):
+        if not recording._files:
+            return
+        if samples.dtype != np.int16:
+            samples = to_pcm16(samples)
+
+        nbytes = samples.nbytes + INDEX_DTYPE.itemsize
+        if not self._reserve(nbytes, recording):
+            recording.dropped_chunks += 1
+            return
+
+        entry = np.array([(seq, arrival, recording._samples_written, len(samples))], dtype=INDEX_DTYPE)
+        recording._files["audio"].write(samples.astype("<i2", copy=False).tobytes())
+        recording._files["index"].write(entry.tobytes())
+        recording._samples_written += len(samples)
+
+    def _handle_detection(self, recording: SessionRecording, record: Dict[str, Any]):
+        if not recording._files:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        if self._reserve(len(line.encode("utf-8")), recording):
+            recording._files["detections"].write(line)
+
+    def _handle_close(self, recording: SessionRecording):
+        if not recording._files:
+            return
+        for f in recording._files.values():
+            f.close()
+        recording._files = {}
+        self._active.pop(recording.session_id, None)
+        self._write_meta(recording, closed=True)
+        if recording._writer_lock is not None:
+            recording._writer_lock.close()  # 关闭文件即释放 flock
+            recording._writer_lock = None
+        logger.info(
+            f"🎙️ 会话 {recording.session_id} 录音结束: "
+            f"{recording._samples_written / recording.sample_rate:.1f}s，丢弃 {recording.dropped_chunks} 块"
+        )
+
+    def _write_meta(self, recording: SessionRecording, closed: bool):
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "session_id": recording.session_id,
+            "sample_rate": recording.sample_rate,
+            "keyword_set": recording.keyword_set,
+            "index_dtype": INDEX_DTYPE.descr,
+            "started_at": datetime.fromtimestamp(time.time() - (time.monotonic() - recording._start)).isoformat(),
+            "closed_at": datetime.now().isoformat() if closed else None,
+            "chunks": recording.seq,
+            "samples": recording._samples_written,
+            "dropped_chunks": recording.dropped_chunks,
+        }
+        path = recording.path / META_FILE
+        old_size = path.stat().st_size if path.exists() else 0
+        path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        self._bytes_used += path.stat().st_size - old_size
+
+    def _reserve(self, nbytes: int, recording: SessionRecording) -> bool:
+        """
+        为即将写入的数据预留磁盘额度
+
+        其他工作进程也在往同一目录写，本进程的计数只是估计：即将超出上限或本进程已写入较多时，
+        在目录锁内按磁盘实际大小重新核算，仍超出则先删除最早的已结束录音
+        """
+        if (self._bytes_used + nbytes > self.max_bytes
+                or self._unsynced_bytes + nbytes > self.sync_bytes):
+            with self._dir_lock():
+                self._bytes_used = self._disk_usage(self.root)
+                self._unsynced_bytes = 0
+                if self._bytes_used + nbytes > self.max_bytes:
+                    self._evict(nbytes)
+        if self._bytes_used + nbytes > self.max_bytes:
+            self.rejected_writes += 1
+            if not self._rejecting:
+                self._rejecting = True
+                logger.warning(
+                    f"⚠️ 录音目录已达上限 {self.max_bytes / 1024 / 1024:.1f}MB 且没有可删除的已结束录音，"
+                    f"丢弃新的录音数据（会话 {recording.session_id}）"
+                )
+            return False
+        if self._rejecting:
+            self._rejecting = False
+            logger.info("录音目录有了空间，恢复写入")
+        self._bytes_used += nbytes
+        self._unsynced_bytes += nbytes
+        self.bytes_written += nbytes
+        return True
+
+    def _evict(self, nbytes: int):
+        # 只删除已结束的录音（有 closed_at，或写入进程已退出），按最后写入时间从早到晚删除
+        closed = [p for p in self.root.iterdir() if p.is_dir() and self._is_closed(p)]
+        for path in sorted(closed, key=self._last_modified):
+            if self._bytes_used + nbytes <= self.max_bytes:
+                break
+            size = self._disk_usage(path)
+            shutil.rmtree(path, ignore_errors=True)
+            self._bytes_used -= size
+            self.evicted_sessions += 1
+            logger.info(f"🗑️ 录音超出磁盘上限，已删除: {path.name}")
+
+    def _recover_abandoned(self):
+        """
+        把写入进程已经退出的未结束录音标记为已结束（崩溃、SIGKILL、工作进程重启后遗留）
+
+        标记后这些录音可以回放，也会和其他已结束录音一样在超出上限时被删除
+        """
+        for path in self.root.iterdir():
+            if not path.is_dir() or self._read_meta(path, "closed_at") is not None or self._is_locked(path):
+                continue
+            meta_path = path / META_FILE
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue  # 没有 meta.json 的目录无法回放，超出上限时直接删除
+            meta["closed_at"] = datetime.fromtimestamp(self._last_modified(path)).isoformat()
+            meta["abandoned"] = True
+            meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+            self.recovered_sessions += 1
+            logger.info(f"🎙️ 遗留的未结束录音已标记为结束: {path.name}")
+
+    @staticmethod
+    def _read_meta(path: Path, key: str) -> Any:
+        try:
+            return json.loads((path / META_FILE).read_text(encoding="utf-8")).get(key)
+        except (OSError, ValueError):
+            # 还没写 meta.json，或正被其他进程改写
+            return None
+
+    def _is_closed(self, path: Path) -> bool:
+        """录音已结束：meta.json 有 closed_at，或者没有存活的进程持有它的写入锁"""
+        if self._read_meta(path, "closed_at") is not None:
+            return True
+        # 没有 flock 时无法判断写入进程是否存活，只认 closed_at
+        return fcntl is not None and not self._is_locked(path)
+
+    @staticmethod
+    def _acquire_writer_lock(path: Path):
+        """取得录音的写入锁，返回需要保持打开的锁文件（不支持 flock 时为None）"""
+        if fcntl is None:
+            return None
+        f = open(path / WRITER_LOCK_FILE, "a")
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return f
+
+    @staticmethod
+    def _is_locked(path: Path) -> bool:
+        """是否有存活的进程（包括本进程）持有该录音的写入锁"""
+        if fcntl is None:
+            return True
+        try:
+            with open(path / WRITER_LOCK_FILE, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(f, fcntl.LOCK_UN)
+        except BlockingIOError:
+            return True
+        except OSError:
+            # 目录已被其他进程删除
+            return False
+        return False
+
+    @staticmethod
+    def _last_modified(path: Path) -> float:
+        """录音目录中最后写入的文件的修改时间"""
+        latest = 0.0
+        for child in path.iterdir():
+            try:
+                latest = max(latest, child.stat().st_mtime)
+            except OSError:
+                pass
+        return latest
+
+    @staticmethod
+    def _disk_usage(path: Path) -> int:
+        """目录下所有文件的总大小（其他进程同时删除的文件跳过）"""
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.stat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    @contextmanager
+    def _dir_lock(self):
+        """录音目录的跨进程锁，核算大小和删除录音时持有"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.root / LOCK_FILE, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _flush_all(self):
+        for recording in self._active.values():
+            for f in recording._files.values():
+                f.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取录音统计"""
+        return {
+            "enabled": self.enabled,
+            "root": str(self.root),
+            "sampling_ratio": self.sampling_ratio,
+            "active_sessions": len(self._active),
+            "sessions_recorded": self.sessions_recorded,
+            "sessions_skipped": self.sessions_skipped,
+            "queued": self._queue.qsize(),
+            "dropped_chunks": self.dropped_chunks,
+            "bytes_written": self.bytes_written,
+            "bytes_used": self._bytes_used,
+            "max_bytes": self.max_bytes,
+            "evicted_sessions": self.evicted_sessions,
+            "recovered_sessions": self.recovered_sessions,
+            "rejected_writes": self.rejected_writes,
+        }
+
+
+class Recording:
+    """读取一个会话录音（音频和索引均为内存映射，不整体读入内存）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / META_FILE).read_text(encoding="utf-8"))
+        self.sample_rate = self.meta["sample_rate"]
+        self.audio = self._memmap(AUDIO_FILE, np.int16)
+        self.index = self._memmap(INDEX_FILE, INDEX_DTYPE)
+
+    def _memmap(self, name: str, dtype) -> np.ndarray:
+        path = self.path / name
+        # 空文件无法映射
+        if not path.exists() or path.stat().st_size < np.dtype(dtype).itemsize:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    @property
+    def duration(self) -> float:
+        """录音时长（秒）"""
+        return len(self.audio) / self.sample_rate
+
+    def detections(self) -> List[Dict[str, Any]]:
+        """读取录音时的检测结果"""
+        path = self.path / DETECTIONS_FILE
+        if not path.exists():
+            return []
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def chunks(self) -> Iterator[Tuple[int, float, np.ndarray]]:
+        """
+        按到达顺序遍历音频块
+
+        Yields:
+            (序号, 到达时间, int16 音频视图)
+        """
+        for seq, arrival, offset, samples in self.index:
+            yield int(seq), float(arrival), self.audio[offset:offset + samples]
+
+
+def list_recordings(root=None) -> List[Path]:
+    """列出录音目录下的所有会话录音（按开始时间排序）"""
+    root = Path(root) if root else RECORDING_DIR
+    if not root.exists():
+        return []
+    return sorted(p for p in root.iterdir() if (p / META_FILE).exists())
+
+
+_default_recorder: Optional[Recorder] = None
+
+
+def get_recorder() -> Recorder:
+    """获取进程内共享的录音管理"""
+    global _default_recorder
+    if _default_recorder is None:
+        _default_recorder = Recorder(
+            RECORDING_DIR, RECORDING_ENABLED, RECORDING_SAMPLING_RATIO,
+            RECORDING_MAX_BYTES, RECORDING_QUEUE_SIZE
+        )
+    return _default_recorder
@@ -0,0 +1,304 @@
+"""
+会话回放
+把录音（recorder 写出的会话目录）或 WAV 文件按线上的分块和到达时间送入 KeywordSpotter 或流水线会话，
+可以按实时节奏回放，也可以在虚拟时钟上尽快回放：事件循环空闲时直接跳到下一个定时器，
+流水线里基于 asyncio.sleep 的阶段不再占用真实时间；等待解码线程时虚拟时钟随真实时间前进，
+因此事件相对音频的时间关系与线上一致。多个会话可以用多进程并行回放。
+"""
+import asyncio
+import selectors
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+
+from ..config import SAMPLE_RATE, COALESCE_MAX_SECONDS
+from .admission import drain_backlog
+from .recorder import Recording, META_FILE, from_pcm16
+from .thread_budget import get_thread_budget
+
+
+# 回放目标
+TARGET_KWS = "kws"            # 与 backend/main.py 相同：每个连接一个 KWS 流，按顺序解码
+TARGET_PIPELINE = "pipeline"  # 与 voice_assistant_api.py 相同：每个连接一个流水线会话
+TARGETS = (TARGET_KWS, TARGET_PIPELINE)
+
+# 各目标的网页客户端每次发送的样本数（16kHz），回放 WAV 时按此切块
+CLIENT_CHUNK_SAMPLES = {TARGET_KWS: 4096, TARGET_PIPELINE: 1024}
+
+
+class _VirtualSelector:
+    """包装事件循环的 selector：空闲时不真实等待，而是把虚拟时钟推进到下一个定时器"""
+
+    def __init__(self, selector: selectors.BaseSelector):
+        self._selector = selector
+        self.loop: Optional["VirtualClockEventLoop"] = None
+
+    def select(self, timeout: Optional[float] = None):
+        loop = self.loop
+        if loop.in_flight or timeout is None:
+            # 有线程池任务在执行（或没有任何定时器）：真实等待，虚拟时钟随真实时间前进
+            start = time.perf_counter()
+            events = self._selector.select(timeout)
+            loop.advance(time.perf_counter() - start)
+            return events
+
+        events = self._selector.select(0)
+        if not events and timeout > 0:
+            loop.advance(timeout)
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """虚拟时钟事件循环：loop.time() 返回虚拟时间，asyncio.sleep 不占用真实时间"""
+
+    def __init__(self):
+        selector = _VirtualSelector(selectors.DefaultSelector())
+        super().__init__(selector)
+        selector.loop = self
+        self._virtual_time = time.monotonic()
+        self.in_flight = 0
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        """推进虚拟时钟"""
+        self._virtual_time += seconds
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.in_flight += 1
+
+        def _done(_):
+            self.in_flight -= 1
+
+        future.add_done_callback(_done)
+        return future
+
+
+def iter_source(path, chunk_samples: int) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    读取回放源
+
+    Args:
+        path: 录音目录或 16-bit 单声道 WAV 文件
+        chunk_samples: WAV 的切块大小（录音按原始分块）
+
+    Yields:
+        (相对开始的到达时间（秒）, float32 音频块)
+    """
+    path = Path(path)
+    if (path / META_FILE).exists():
+        for _, arrival, pcm in Recording(path).chunks():
+            yield arrival, from_pcm16(pcm)
+        return
+
+    with wave.open(str(path)) as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2 or f.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"仅支持 {SAMPLE_RATE}Hz 16-bit 单声道 WAV: {path}")
+        pcm = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+    # 客户端采集满一块才发送，所以每块的到达时间是它的结束时间
+    for start in range(0, len(pcm), chunk_samples):
+        chunk = pcm[start:start + chunk_samples]
+        yield (start + len(chunk)) / SAMPLE_RATE, from_pcm16(chunk)
+
+
+def expected_detections(path) -> List[Dict[str, Any]]:
+    """录音时的检测结果（WAV 没有）"""
+    path = Path(path)
+    return Recording(path).detections() if (path / META_FILE).exists() else []
+
+
+def recorded_keyword_set(path) -> Optional[str]:
+    """录音时会话使用的唤醒词集合（WAV 和未记录集合的录音返回None，即默认集合）"""
+    path = Path(path)
+    return Recording(path).meta.get("keyword_set") if (path / META_FILE).exists() else None
+
+
+def find_sources(paths) -> List[Path]:
+    """把命令行给出的路径展开为回放源：录音目录、录音根目录（含多个录音）、WAV 文件或含 WAV 的目录"""
+    sources = []
+    for path in map(Path, paths):
+        if (path / META_FILE).exists() or path.suffix == ".wav":
+            sources.append(path)
+        elif path.is_dir():
+            sources.extend(sorted(p.parent for p in path.glob(f"*/{META_FILE}")))
+            sources.extend(sorted(path.glob("*.wav")))
+    return sources
+
+
+# 工作进程内共享的模型（进程初始化时加载一次）
+_spotter = None
+_pipeline = None
+
+
+def _load_models(target: str):
+    global _spotter, _pipeline
+    if target == TARGET_KWS and _spotter is None:
+        from .keyword_spotter import KeywordSpotter
+        _spotter = KeywordSpotter()
+    elif target == TARGET_PIPELINE and _pipeline is None:
+        from .voice_assistant_pipeline import VoiceAssistantPipeline
+        _pipeline = VoiceAssistantPipeline()
+
+
+async def _feed(source: Iterator[Tuple[float, np.ndarray]], submit, realtime_start: float):
+    """按到达时间送入音频块（虚拟时钟下等待不占用真实时间）"""
+    loop = asyncio.get_running_loop()
+    audio_samples = 0
+    for arrival, audio in source:
+        delay = realtime_start + arrival - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        audio_samples += len(audio)
+        await submit(audio)
+    return audio_samples
+
+
+async def _replay_kws(source, session_id: str,
+                      keyword_set: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+    """与 backend/main.py 的连接处理相同：收包入队，解码任务按顺序在线程池中解码（积压的音频块合并解码）"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    stream = _spotter.create_stream(keyword_set)
+    queue: asyncio.Queue = asyncio.Queue()
+    detections = []
+
+    async def decode():
+        while True:
+            items = drain_backlog(queue, await queue.get(), int(COALESCE_MAX_SECONDS * SAMPLE_RATE))
+            audio = np.concatenate([item[0] for item in items])
+            try:
+                results = await get_thread_budget().run_decode(
+                    _spotter.process_audio_chunk, stream, audio, SAMPLE_RATE
+                )
+                emitted_at = round(loop.time() - start, 4)
+                detections.extend({**detection.to_dict(), "emitted_at": emitted_at} for detection in results)
+            finally:
+                for _ in items:
+                    queue.task_done()
+
+    async def submit(audio):
+        queue.put_nowait((audio,))
+
+    decode_task = asyncio.create_task(decode(), name=f"replay-decode-{session_id}")
+    try:
+        audio_samples = await _feed(source, submit, start)
+        await queue.join()
+    finally:
+        decode_task.cancel()
+        await asyncio.gather(decode_task, return_exceptions=True)
+    return audio_samples, detections
+
+
+async def _replay_pipeline(source, session_id: str, drain_seconds: float,
+                           keyword_set: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+    """与 voice_assistant_api.py 相同：每个连接一个流水线会话，记录会话发出的全部事件"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    events = []
+
+    session = await _pipeline.create_session(session_id, keyword_set=keyword_set)
+    session.add_event_callback(lambda event: events.append({
+        "event_type": event.event_type,
+        "state": event.state.value,
+        "emitted_at": round(loop.time() - start, 4),
+        "data": event.data,
+    }))
+    await session.start()
+    try:
+        audio_samples = await _feed(source, session.process_audio_chunk, start)
+        # 音频结束后留出时间让唤醒后的识别、执行和播报阶段跑完（虚拟时钟下不占用真实时间）
+        await asyncio.sleep(drain_seconds)
+    finally:
+        await _pipeline.close_session(session_id)
+    return audio_samples, events
+
+
+def replay_session(path, target: str = TARGET_KWS, realtime: bool = False,
+                   chunk_samples: Optional[int] = None, drain_seconds: float = 10.0,
+                   keyword_set: Optional[str] = None) -> Dict[str, Any]:
+    """
+    回放一个会话（可在工作进程中调用）
+
+    Args:
+        path: 录音目录或 WAV 文件
+        target: 回放目标，kws 或 pipeline
+        realtime: 是否按实时节奏回放；否则使用虚拟时钟尽快回放
+        chunk_samples: WAV 切块大小，默认使用目标客户端的分块
+        drain_seconds: 流水线目标在音频结束后等待的（虚拟）时长
+        keyword_set: 使用的唤醒词集合，默认使用录音时的集合
+
+    Returns:
+        回放结果：音频时长、真实耗时、实时率、检测结果/事件以及录音时的检测结果
+    """
+    if target not in TARGETS:
+        raise ValueError(f"未知的回放目标: {target}")
+    _load_models(target)
+
+    path = Path(path)
+    source = iter_source(path, chunk_samples or CLIENT_CHUNK_SAMPLES[target])
+    session_id = f"replay-{path.stem}"
+    keyword_set = keyword_set or recorded_keyword_set(path)
+    if target == TARGET_KWS:
+        coro = _replay_kws(source, session_id, keyword_set)
+    else:
+        coro = _replay_pipeline(source, session_id, drain_seconds, keyword_set)
+
+    loop = asyncio.new_event_loop() if realtime else VirtualClockEventLoop()
+    wall_start = time.perf_counter()
+    virtual_start = loop.time()
+    try:
+        audio_samples, results = loop.run_until_complete(coro)
+        loop.run_until_complete(loop.shutdown_default_executor())
+        virtual_seconds = loop.time() - virtual_start
+    finally:
+        loop.close()
+    wall_seconds = time.perf_counter() - wall_start
+
+    audio_seconds = audio_samples / SAMPLE_RATE
+    return {
+        "source": str(path),
+        "target": target,
+        "keyword_set": keyword_set,
+        "mode": "realtime" if realtime else "virtual",
+        "audio_seconds": round(audio_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "virtual_seconds": round(virtual_seconds, 3),
+        "rtf": round(wall_seconds / audio_seconds, 4) if audio_seconds else None,
+        "results": results,
+        "expected": expected_detections(path),
+    }
+
+
+def replay_many(paths, target: str = TARGET_KWS, realtime: bool = False, workers: int = 1,
+                **kwargs) -> List[Dict[str, Any]]:
+    """
+    多进程并行回放多个会话（每个工作进程加载一次模型）
+
+    Returns:
+        与 paths 顺序一致的回放结果；单个会话失败时结果中包含 error
+    """
+    paths = [str(p) for p in paths]
+    if workers <= 1:
+        return [_replay_or_error(p, target, realtime, kwargs) for p in paths]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_models, initargs=(target,)) as pool:
+        futures = [pool.submit(_replay_or_error, p, target, realtime, kwargs) for p in paths]
+        return [f.result() for f in futures]
+
+
+def _replay_or_error(path: str, target: str, realtime: bool, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return replay_session(path, target, realtime, **kwargs)
+    except Exception as e:
+        logger.error(f"❌ 回放失败 {path}: {e}")
+        return {"source": path, "target": target, "error": str(e)}
@@ -0,0 +1,155 @@
+"""
+心跳与空闲会话回收
+服务端定期发送 JSON ping，客户端回复 pong；超过心跳超时未回复（半开连接）或长时间没有音频的会话被回收，
+回收时关闭连接并取消会话的处理任务，由处理任务的清理逻辑释放音频流和缓冲区
+"""
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+from loguru import logger
+
+
+# 回收原因
+REAP_UNRESPONSIVE = "unresponsive"  # 心跳超时
+REAP_IDLE = "idle"                  # 长时间没有音频
+
+
+@dataclass
+class SessionActivity:
+    """单个会话的活动时间"""
+    session_id: str
+    send: Callable[[str], Awaitable[None]]
+    close: Callable[[int, str], Awaitable[None]]
+    task: Optional[asyncio.Task]
+    last_message: float = field(default_factory=time.monotonic)
+    last_audio: float = field(default_factory=time.monotonic)
+    last_ping: float = 0.0
+    reap_reason: Optional[str] = None
+
+    def on_message(self):
+        """收到任意消息（包括 pong）"""
+        self.last_message = time.monotonic()
+
+    def on_audio(self):
+        """收到音频数据"""
+        self.last_audio = self.last_message = time.monotonic()
+
+
+class SessionReaper:
+    """心跳发送与空闲会话回收"""
+
+    def __init__(self, heartbeat_interval: float = 30.0, pong_timeout: float = 10.0,
+                 idle_audio_timeout: float = 120.0, close_timeout: float = 1.0):
+        """
+        初始化回收器
+
+        Args:
+            heartbeat_interval: ping 发送间隔（秒）
+            pong_timeout: ping 之后等待任意消息的时间，超过即视为连接失效
+            idle_audio_timeout: 多久没有音频视为空闲（秒）
+            close_timeout: 回收时关闭连接的超时（半开连接上发送关闭帧可能卡住）
+        """
+        self.heartbeat_interval = heartbeat_interval
+        self.pong_timeout = pong_timeout
+        self.idle_audio_timeout = idle_audio_timeout
+        self.close_timeout = close_timeout
+
+        self.sessions: Dict[str, SessionActivity] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.pings_sent = 0
+        self.reaped = {REAP_UNRESPONSIVE: 0, REAP_IDLE: 0}
+
+    def register(self, session_id: str, send: Callable[[str], Awaitable[None]],
+                 close: Callable[[int, str], Awaitable[None]],
+                 task: Optional[asyncio.Task] = None) -> SessionActivity:
+        """
+        登记会话
+
+        Args:
+            session_id: 会话ID
+            send: 发送文本消息的协程函数（如 websocket.send_text）
+            close: 关闭连接的协程函数，参数为 (code, reason)
+            task: 会话的处理任务，回收时取消；为None时使用当前任务
+        """
+        activity = SessionActivity(session_id, send, close, task or asyncio.current_task())
+        self.sessions[session_id] = activity
+        return activity
+
+    def unregister(self, session_id: str):
+        """注销会话"""
+        self.sessions.pop(session_id, None)
+
+    def start(self):
+        """启动回收任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="session-reaper")
+
+    async def stop(self):
+        """停止回收任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        # 检查间隔取各超时中最小值的一半，保证超时判定误差不超过半个间隔
+        tick = min(self.heartbeat_interval, self.pong_timeout, self.idle_audio_timeout) / 2
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"❌ 会话回收检查出错: {e}")
+
+    async def check(self):
+        """检查一次所有会话：回收失效/空闲会话，给到期的会话发送 ping"""
+        now = time.monotonic()
+        for activity in list(self.sessions.values()):
+            waiting_pong = activity.last_ping > activity.last_message
+            if waiting_pong and now - activity.last_ping >= self.pong_timeout:
+                await self._reap(activity, REAP_UNRESPONSIVE)
+            elif now - activity.last_audio >= self.idle_audio_timeout:
+                await self._reap(activity, REAP_IDLE)
+            elif not waiting_pong and now - max(activity.last_ping, activity.last_message) >= self.heartbeat_interval:
+                await self._ping(activity, now)
+
+    async def _ping(self, activity: SessionActivity, now: float):
+        activity.last_ping = now
+        self.pings_sent += 1
+        try:
+            await asyncio.wait_for(
+                activity.send(json.dumps({"type": "ping", "timestamp": time.time() * 1000})),
+                self.close_timeout
+            )
+        except Exception as e:
+            logger.debug(f"会话 {activity.session_id} 发送心跳失败: {e}")
+
+    async def _reap(self, activity: SessionActivity, reason: str):
+        """关闭连接并取消处理任务，由处理任务的 finally 释放资源"""
+        self.sessions.pop(activity.session_id, None)
+        activity.reap_reason = reason
+        self.reaped[reason] += 1
+        logger.warning(f"🧹 回收会话 {activity.session_id}: {reason}")
+
+        try:
+            await asyncio.wait_for(activity.close(1001, f"会话已回收: {reason}"), self.close_timeout)
+        except Exception as e:
+            logger.debug(f"会话 {activity.session_id} 关闭连接失败: {e}")
+
+        if activity.task and not activity.task.done():
+            activity.task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取回收统计"""
+        return {
+            "tracked_sessions": len(self.sessions),
+            "heartbeat_interval": self.heartbeat_interval,
+            "pong_timeout": self.pong_timeout,
+            "idle_audio_timeout": self.idle_audio_timeout,
+            "pings_sent": self.pings_sent,
+            "reaped": dict(self.reaped),
+            "reaped_total": sum(self.reaped.values()),
+        }
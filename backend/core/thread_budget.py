@@ -0,0 +1,108 @@
+"""
+进程级 CPU 线程预算
+根据 CPU 核数和预期并发分配每个推理会话的 intra-op 线程数，并限制同时进行的解码数量，
+保证 "并发解码数 × 每次解码线程数" 不超过可用核数，避免线程超额订阅拖慢尾延迟
+"""
+import asyncio
+import os
+import time
+from dataclasses import asdict
+from typing import Optional, Dict, Any, Callable
+from loguru import logger
+
+from thread_plan import ThreadPlan, make_plan
+
+from ..config import THREAD_BUDGET_CPUS, THREAD_BUDGET_RESERVED_CORES, EXPECTED_CONCURRENCY
+
+
+class ThreadBudget:
+    """进程级 CPU 线程预算"""
+
+    def __init__(self, cpu_count: Optional[int] = None, expected_concurrency: int = 1,
+                 reserved_cores: int = 1, max_intra_op_threads: Optional[int] = None):
+        """
+        初始化线程预算
+
+        Args:
+            cpu_count: 可用 CPU 核数，为None时使用 os.cpu_count()
+            expected_concurrency: 预期同时活跃的音频流数量
+            reserved_cores: 预留给事件循环和网络 IO 的核数
+            max_intra_op_threads: 单次解码线程数上限（预 fork 模式下为1，见 backend/prefork.py）
+        """
+        self.plan: ThreadPlan = make_plan(cpu_count or os.cpu_count() or 1, expected_concurrency,
+                                          reserved_cores, max_intra_op_threads)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_decodes = 0
+        self.waited_decodes = 0
+        self.total_wait_ms = 0.0
+
+        logger.info(
+            f"🧮 线程预算: {self.plan.usable_cores}/{self.plan.cpu_count} 核可用，"
+            f"最多 {self.plan.max_concurrent_decodes} 个并发解码，每个 {self.plan.kws_threads} 线程"
+        )
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 延迟创建，绑定到实际运行的事件循环（回放时同一进程会依次使用多个事件循环）
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.plan.max_concurrent_decodes)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def run_decode(self, func: Callable, *args, **kwargs):
+        """
+        在线程池中执行一次解码，受并发解码上限约束
+
+        Args:
+            func: 解码函数（会阻塞的同步调用）
+
+        Returns:
+            解码函数的返回值
+        """
+        semaphore = self.semaphore
+        wait_start = time.perf_counter()
+        if semaphore.locked():
+            self.waited_decodes += 1
+
+        async with semaphore:
+            self.total_wait_ms += (time.perf_counter() - wait_start) * 1000
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            finally:
+                self.in_flight -= 1
+                self.total_decodes += 1
+
+    def get_info(self) -> Dict[str, Any]:
+        """获取线程分配方案和解码统计"""
+        return {
+            "plan": asdict(self.plan),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_decodes": self.total_decodes,
+            "waited_decodes": self.waited_decodes,
+            "avg_wait_ms": round(self.total_wait_ms / self.total_decodes, 3) if self.total_decodes else 0.0,
+        }
+
+
+_default_budget: Optional[ThreadBudget] = None
+
+
+def get_thread_budget() -> ThreadBudget:
+    """获取进程内共享的线程预算"""
+    global _default_budget
+    if _default_budget is None:
+        _default_budget = ThreadBudget(THREAD_BUDGET_CPUS, EXPECTED_CONCURRENCY, THREAD_BUDGET_RESERVED_CORES)
+    return _default_budget
+
+
+def set_thread_budget(budget: ThreadBudget):
+    """替换进程内共享的线程预算（需在加载模型之前调用，模型按预算中的线程数创建）"""
+    global _default_budget
+    _default_budget = budget
@@ -0,0 +1,200 @@
+"""
+合成语音缓存
+按 (文本, 音色, 语速) 缓存合成的 PCM 音频，内存中按字节预算做 LRU 淘汰，可选磁盘持久化（同样有字节上限）
+读写有磁盘 I/O，调用方可在线程中调用（如 asyncio.to_thread），内部状态由锁保护
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+from loguru import logger
+
+
+CacheKey = Tuple[str, str, float]
+
+
+class TTSCache:
+    """合成语音缓存"""
+    
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, cache_dir: Optional[str] = None,
+                 disk_max_bytes: int = 256 * 1024 * 1024):
+        """
+        初始化缓存
+        
+        Args:
+            max_bytes: 内存缓存的字节预算
+            cache_dir: 磁盘缓存目录，为None时只使用内存
+            disk_max_bytes: 磁盘缓存目录的总大小上限，超出时删除最久未使用的文件
+        """
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        
+        self._entries: "OrderedDict[CacheKey, np.ndarray]" = OrderedDict()
+        self.current_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        
+        # _lock 保护内存缓存和统计，_disk_lock 串行化磁盘淘汰；磁盘读写本身不持锁
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._scan_disk())
+    
+    @staticmethod
+    def make_key(text: str, voice: str, rate: float) -> CacheKey:
+        """生成缓存键"""
+        return (text, voice, float(rate))
+    
+    def _disk_path(self, key: CacheKey) -> Path:
+        text, voice, rate = key
+        digest = hashlib.sha1(f"{voice}|{rate}|{text}".encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{digest}.pcm"
+    
+    def get(self, text: str, voice: str, rate: float) -> Optional[np.ndarray]:
+        """
+        查询缓存
+        
+        Returns:
+            int16 PCM 音频，未命中时返回None
+        """
+        key = self.make_key(text, voice, rate)
+        with self._lock:
+            pcm = self._entries.get(key)
+            if pcm is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return pcm
+        
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                pcm = np.fromfile(path, dtype=np.int16)
+                # 更新修改时间，磁盘淘汰按最近使用顺序进行
+                os.utime(path)
+            except OSError:
+                # 不存在或刚被其他进程淘汰
+                pcm = None
+            if pcm is not None:
+                with self._lock:
+                    self._insert(key, pcm)
+                    self.disk_hits += 1
+                return pcm
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, text: str, voice: str, rate: float, pcm: np.ndarray):
+        """写入缓存（同时写入磁盘缓存目录）"""
+        key = self.make_key(text, voice, rate)
+        pcm = np.ascontiguousarray(pcm, dtype=np.int16)
+        with self._lock:
+            self._insert(key, pcm)
+        
+        if self.cache_dir and pcm.nbytes <= self.disk_max_bytes:
+            self._write_disk(key, pcm)
+    
+    def _write_disk(self, key: CacheKey, pcm: np.ndarray):
+        """写入磁盘缓存，超出上限时删除最久未使用的文件"""
+        path = self._disk_path(key)
+        # 每次写入使用独立的临时文件，多个进程/线程同时写同一条目时互不覆盖
+        tmp = tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False)
+        try:
+            with tmp:
+                pcm.tofile(tmp)
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp.name, path)
+        except OSError as e:
+            logger.warning(f"TTS磁盘缓存写入失败: {e}")
+            try:
+                os.unlink(tmp.name)
+            except OSError:
+                pass
+            return
+        
+        with self._disk_lock:
+            self.disk_bytes += pcm.nbytes - old_size
+            if self.disk_bytes > self.disk_max_bytes:
+                self._evict_disk(keep=path)
+    
+    def _scan_disk(self) -> List[Tuple[Path, int, float]]:
+        """列出磁盘缓存文件 (路径, 大小, 修改时间)"""
+        files = []
+        for path in self.cache_dir.glob("*.pcm"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((path, st.st_size, st.st_mtime))
+        return files
+    
+    def _evict_disk(self, keep: Path):
+        # 调用方持有 _disk_lock；重新扫描目录：其他进程可能共用同一缓存目录
+        files = self._scan_disk()
+        self.disk_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if self.disk_bytes <= self.disk_max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self.disk_bytes -= size
+            self.disk_evictions += 1
+        logger.debug(f"🗑️ TTS磁盘缓存超出上限，淘汰后 {self.disk_bytes / 1024 / 1024:.1f}MB")
+    
+    def _insert(self, key: CacheKey, pcm: np.ndarray):
+        """插入内存缓存并按字节预算淘汰最久未使用的条目（调用方持有 _lock）"""
+        if pcm.nbytes > self.max_bytes:
+            return
+        
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= old.nbytes
+        
+        self._entries[key] = pcm
+        self.current_bytes += pcm.nbytes
+        
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+    
+    def contains(self, text: str, voice: str, rate: float) -> bool:
+        """是否已缓存（内存或磁盘），不计入命中统计"""
+        key = self.make_key(text, voice, rate)
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.cache_dir) and self._disk_path(key).exists()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            entries, current_bytes = len(self._entries), self.current_bytes
+        return {
+            "entries": entries,
+            "bytes": current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_bytes": self.disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+            "disk_evictions": self.disk_evictions,
+            "cache_dir": str(self.cache_dir) if self.cache_dir else None,
+        }
@@ -8,6 +8,7 @@ from typing import Optional
 from loguru import logger
 
 from ..config import MODEL_DIR
+from .thread_budget import get_thread_budget
 
 
 class SileroVAD:
@@ -23,6 +24,7 @@ class SileroVAD:
         self.model_dir = Path(model_dir) if model_dir else MODEL_DIR
         self.vad = None
         self.sample_rate = 16000
+        self.num_threads = get_thread_budget().plan.vad_threads
         self.last_speech_state = None  # 记录上次的语音状态
         
         # 初始化VAD检测器
@@ -33,25 +35,7 @@ class SileroVAD:
         try:
             logger.info("正在加载Silero VAD模型...")
             
-            # 使用Sherpa-ONNX的Silero VAD v4 - 降低阈值使其更敏感
-            silero_config = sherpa_onnx.SileroVadModelConfig(
-                model=f"{self.model_dir}/silero_vad.onnx",
-                threshold=0.1,  # 大幅降低阈值，更容易检测到语音
-                min_silence_duration=0.1,  # 减少最小静音时间
-                min_speech_duration=0.05,  # 减少最小语音时间
-                window_size=512,  # 窗口大小
-                max_speech_duration=30.0   # 最大语音持续时间（秒）
-            )
-            
-            vad_config = sherpa_onnx.VadModelConfig(
-                silero_vad=silero_config,
-                sample_rate=16000,
-                num_threads=1,
-                provider='cpu',
-                debug=False
-            )
-            
-            self.vad = sherpa_onnx.VoiceActivityDetector(vad_config)
+            self.vad = self._create_vad(self.model_dir / "silero_vad.onnx")
             
             logger.success("✅ Silero VAD模型加载成功！")
             
@@ -61,6 +45,28 @@ class SileroVAD:
             logger.warning("使用简单的能量检测作为VAD fallback")
             self.vad = None
     
+    def _create_vad(self, model_path: Path):
+        """用给定的模型文件创建 sherpa-onnx VAD"""
+        # 使用Sherpa-ONNX的Silero VAD v4 - 降低阈值使其更敏感
+        silero_config = sherpa_onnx.SileroVadModelConfig(
+            model=str(model_path),
+            threshold=0.1,  # 大幅降低阈值，更容易检测到语音
+            min_silence_duration=0.1,  # 减少最小静音时间
+            min_speech_duration=0.05,  # 减少最小语音时间
+            window_size=512,  # 窗口大小
+            max_speech_duration=30.0   # 最大语音持续时间（秒）
+        )
+        
+        vad_config = sherpa_onnx.VadModelConfig(
+            silero_vad=silero_config,
+            sample_rate=16000,
+            num_threads=self.num_threads,
+            provider='cpu',
+            debug=False
+        )
+        
+        return sherpa_onnx.VoiceActivityDetector(vad_config)
+    
     def process_audio_chunk(self, audio_data: np.ndarray, sample_rate: int = 16000) -> bool:
         """
         处理音频数据块，检测是否有语音活动
@@ -81,6 +87,10 @@ class SileroVAD:
                 # 输入音频数据到VAD检测器
                 self.vad.accept_waveform(samples)
                 
+                # 这里只用到是否有语音，丢弃检测器内部排队的语音段，否则长时间运行时语音段会一直累积
+                while not self.vad.empty():
+                    self.vad.pop()
+                
                 # 检查是否检测到语音
                 is_speech = self.vad.is_speech_detected()
                 
@@ -136,6 +146,7 @@ class SileroVAD:
             "model_type": "Silero VAD v4" if self.vad else "Simple Energy VAD",
             "model_dir": str(self.model_dir),
             "sample_rate": self.sample_rate,
+            "num_threads": self.num_threads,
             "threshold": 0.5 if self.vad else 0.01,
             "min_silence_duration_ms": 500 if self.vad else None,
             "min_speech_duration_ms": 250 if self.vad else None,
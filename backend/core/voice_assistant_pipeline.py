@@ -1,19 +1,54 @@
 """
 语音助手流水线管理器
 实现完整的语音处理流程：VAD -> KWS -> ASR -> 意图识别 -> 执行指令 -> TTS
+
+模型在进程内由 VoiceAssistantPipeline 统一加载并共享，每个客户端对应一个
+PipelineSession，只持有自己的流状态（KWS流、VAD状态、阶段任务）。
 """
 import asyncio
 import numpy as np
 from enum import Enum
-from typing import Optional, Dict, Any, Callable, List
+from functools import lru_cache
+from typing import Optional, Dict, Any, Callable, List, AsyncIterator, Tuple
 from dataclasses import dataclass
 from loguru import logger
 import time
 
+from ..config import (
+    ASR_ENGINE,
+    ASR_MODEL_DIR,
+    SAMPLE_RATE,
+    COALESCE_MAX_SECONDS,
+    CAPTURE_LOOKBACK_SECONDS,
+    CAPTURE_MAX_SECONDS,
+    ENDPOINT_SILENCE_SECONDS,
+    ENDPOINT_NO_SPEECH_SECONDS,
+    TTS_VOICE,
+    TTS_RATE,
+    TTS_CACHE_MAX_BYTES,
+    TTS_CACHE_DIR,
+    TTS_CACHE_DISK_MAX_BYTES,
+)
+from .admission import SessionLoad, drain_backlog
+from .asr_engine import ASREngine, ASRResult, create_asr_engine
+from .audio_buffer import CaptureBuffer
+from .intent_matcher import AhoCorasickMatcher
+from .tts_cache import TTSCache
+from .thread_budget import get_thread_budget
 from .vad_detector import SileroVAD
+from .memory import get_memory_budget
 from .keyword_spotter import KeywordSpotter
 
 
+# 固定回复文本（指令处理和启动预合成共用）
+WEATHER_RESPONSE = "今天天气晴朗，温度25度"
+MUSIC_RESPONSE = "正在播放音乐"
+ALARM_RESPONSE = "闹钟已设置"
+GENERAL_RESPONSE = "我明白了，有什么可以帮助您的吗？"
+SMART_HOME_RESPONSE = "{device}已控制"
+DEFAULT_DEVICE = "设备"  # 未识别出设备时的名称
+
+
 class PipelineState(Enum):
     """流水线状态"""
     IDLE = "idle"                    # 空闲状态
@@ -32,48 +67,99 @@ class PipelineEvent:
     data: Any
     timestamp: float
     state: PipelineState
+    session_id: Optional[str] = None
 
 
 class ASRModule:
-    """语音识别模块（占位符实现）"""
+    """语音识别模块（基于可插拔的流式识别引擎）"""
     
-    def __init__(self):
-        self.is_processing = False
-        self.current_text = ""
+    def __init__(self, engine: ASREngine = None):
+        """
+        初始化语音识别模块
+        
+        按配置创建引擎失败时模块标记为不可用（状态接口中可见），唤醒后的识别阶段直接失败并回到监听
+        
+        Args:
+            engine: 流式识别引擎，为None时按配置创建
+        """
+        self.error: Optional[str] = None
+        if engine is None:
+            try:
+                engine = create_asr_engine(ASR_ENGINE, ASR_MODEL_DIR, get_thread_budget().plan.asr_threads)
+            except Exception as e:
+                logger.error(f"❌ ASR引擎不可用: {e}")
+                self.error = str(e)
+        self.engine = engine
+        self.active_streams = 0
     
-    async def start_recognition(self) -> str:
-        """开始语音识别"""
-        logger.info("🎤 开始语音识别...")
-        self.is_processing = True
-        self.current_text = ""
-        
-        # 模拟语音识别过程
-        await asyncio.sleep(2.0)  # 模拟识别时间
-        
-        # 模拟识别结果
-        sample_texts = [
-            "今天天气怎么样",
-            "播放音乐",
-            "设置闹钟",
-            "打开灯",
-            "关闭空调"
-        ]
-        self.current_text = np.random.choice(sample_texts)
+    @property
+    def is_available(self) -> bool:
+        """识别引擎是否可用"""
+        return self.engine is not None
+    
+    @property
+    def is_processing(self) -> bool:
+        """是否有正在进行的识别"""
+        return self.active_streams > 0
+    
+    async def start_recognition(self, audio_stream: AsyncIterator[np.ndarray],
+                                sample_rate: int = 16000,
+                                on_partial: Optional[Callable[[ASRResult], None]] = None) -> str:
+        """
+        开始语音识别
         
-        logger.info(f"🎤 语音识别结果: {self.current_text}")
-        self.is_processing = False
-        return self.current_text
+        Args:
+            audio_stream: 捕获音频流，端点检测结束语句后流终止
+            sample_rate: 采样率
+            on_partial: 部分识别结果回调
+            
+        Returns:
+            最终识别文本
+        """
+        if self.engine is None:
+            raise RuntimeError(f"ASR引擎不可用: {self.error}")
+        
+        logger.info("🎤 开始语音识别...")
+        self.active_streams += 1
+        try:
+            asr_stream = self.engine.create_stream()
+            budget = get_thread_budget()
+            
+            # 增量送入捕获的音频，识别结果随音频到达逐步产出
+            # 解码在线程池中进行，受进程级并发解码上限约束；捕获流的块在取下一块前有效，解码完成前不会被重写
+            async for chunk in audio_stream:
+                results = await budget.run_decode(asr_stream.accept_waveform, chunk, sample_rate)
+                for result in results:
+                    if on_partial:
+                        on_partial(result)
+            
+            final = await budget.run_decode(asr_stream.finish)
+            logger.info(f"🎤 语音识别结果: {final.text} (音频 {final.audio_seconds:.2f}s)")
+            return final.text
+        finally:
+            self.active_streams -= 1
     
-    def stop_recognition(self):
-        """停止语音识别"""
-        self.is_processing = False
-        logger.info("🎤 语音识别已停止")
+    def get_info(self) -> Dict[str, Any]:
+        """获取识别模块信息"""
+        if self.engine is None:
+            return {"available": False, "error": self.error, "active_streams": self.active_streams}
+        info = self.engine.get_info()
+        info["available"] = True
+        info["active_streams"] = self.active_streams
+        return info
 
 
 class IntentModule:
-    """意图识别模块（占位符实现）"""
+    """意图识别模块（基于编译后的多模式匹配）"""
     
-    def __init__(self):
+    def __init__(self, cache_size: int = 1024):
+        """
+        初始化意图识别模块
+        
+        Args:
+            cache_size: 识别结果LRU缓存的条目数
+        """
+        # 意图关键词，字典顺序即优先级（越靠前越优先）
         self.intent_patterns = {
             "weather": ["天气", "温度", "下雨", "晴天"],
             "music": ["播放", "音乐", "歌曲", "听歌"],
@@ -81,48 +167,77 @@ class IntentModule:
             "smart_home": ["开灯", "关灯", "空调", "风扇"],
             "general": ["你好", "谢谢", "再见"]
         }
+        # 实体模式串
+        self.entity_patterns = {
+            "time": ["点", "时"],
+            "device": ["灯", "空调", "风扇", "电视"]
+        }
+        
+        self._matcher = self._compile_patterns()
+        self._match = lru_cache(maxsize=cache_size)(self._match_text)
+    
+    def _compile_patterns(self) -> AhoCorasickMatcher:
+        """将意图与实体模式串编译为一个自动机"""
+        matcher = AhoCorasickMatcher()
+        for priority, (intent_type, keywords) in enumerate(self.intent_patterns.items()):
+            for keyword in keywords:
+                matcher.add(keyword, ("intent", intent_type, priority))
+        for entity_type, values in self.entity_patterns.items():
+            for value in values:
+                matcher.add(value, ("entity", entity_type, 0))
+        return matcher.build()
+    
+    def _match_text(self, text: str) -> Tuple[str, float, Tuple[Tuple[str, str, int, int], ...]]:
+        """单次扫描得到意图和实体位置（结果不可变，可安全缓存）"""
+        best = None  # (priority, start, intent)
+        spans = []
+        for match in self._matcher.iter_matches(text):
+            kind, label, priority = match.payload
+            if kind == "intent":
+                candidate = (priority, match.start, label)
+                if best is None or candidate < best:
+                    best = candidate
+            else:
+                spans.append((label, match.pattern, match.start, match.end))
+        
+        if best is None:
+            return "general", 0.5, tuple(spans)
+        return best[2], 0.9, tuple(spans)
     
     async def recognize_intent(self, text: str) -> Dict[str, Any]:
         """识别意图"""
         logger.info(f"🧠 意图识别: {text}")
         
-        # 简单的关键词匹配
-        intent = "general"
-        confidence = 0.5
-        
-        for intent_type, keywords in self.intent_patterns.items():
-            for keyword in keywords:
-                if keyword in text:
-                    intent = intent_type
-                    confidence = 0.9
-                    break
+        intent, confidence, spans = self._match(text)
         
         result = {
             "intent": intent,
             "confidence": confidence,
             "text": text,
-            "entities": self._extract_entities(text)
+            "entities": self._extract_entities(spans),
+            "entity_spans": [
+                {"type": entity_type, "value": value, "start": start, "end": end}
+                for entity_type, value, start, end in spans
+            ]
         }
         
         logger.info(f"🧠 意图识别结果: {result}")
         return result
     
-    def _extract_entities(self, text: str) -> Dict[str, str]:
-        """提取实体"""
+    def _extract_entities(self, spans: Tuple[Tuple[str, str, int, int], ...]) -> Dict[str, str]:
+        """由实体位置生成实体字典（每种实体取最先出现的一个）"""
         entities = {}
-        
-        # 简单的时间提取
-        if "点" in text or "时" in text:
-            entities["time"] = "提取的时间"
-        
-        # 简单的设备提取
-        devices = ["灯", "空调", "风扇", "电视"]
-        for device in devices:
-            if device in text:
-                entities["device"] = device
-                break
-        
+        for entity_type, value, _, _ in spans:
+            if entity_type in entities:
+                continue
+            # 简单的时间提取
+            entities[entity_type] = "提取的时间" if entity_type == "time" else value
         return entities
+    
+    def get_cache_info(self) -> Dict[str, int]:
+        """获取识别缓存统计"""
+        info = self._match.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
 
 
 class CommandExecutor:
@@ -137,6 +252,17 @@ class CommandExecutor:
             "general": self._handle_general
         }
     
+    def get_canned_responses(self, devices: List[str]) -> List[str]:
+        """
+        获取所有固定回复文本（用于预合成）
+        
+        Args:
+            devices: 智能家居可控制的设备列表
+        """
+        return [WEATHER_RESPONSE, MUSIC_RESPONSE, ALARM_RESPONSE, GENERAL_RESPONSE] + [
+            SMART_HOME_RESPONSE.format(device=device) for device in [DEFAULT_DEVICE] + list(devices)
+        ]
+    
     async def execute_command(self, intent_result: Dict[str, Any]) -> Dict[str, Any]:
         """执行指令"""
         intent = intent_result["intent"]
@@ -155,7 +281,7 @@ class CommandExecutor:
         await asyncio.sleep(1.0)  # 模拟API调用
         return {
             "success": True,
-            "response": "今天天气晴朗，温度25度",
+            "response": WEATHER_RESPONSE,
             "action": "weather_query"
         }
     
@@ -164,7 +290,7 @@ class CommandExecutor:
         await asyncio.sleep(0.5)
         return {
             "success": True,
-            "response": "正在播放音乐",
+            "response": MUSIC_RESPONSE,
             "action": "play_music"
         }
     
@@ -173,17 +299,17 @@ class CommandExecutor:
         await asyncio.sleep(0.5)
         return {
             "success": True,
-            "response": "闹钟已设置",
+            "response": ALARM_RESPONSE,
             "action": "set_alarm"
         }
     
     async def _handle_smart_home(self, intent_result: Dict[str, Any]) -> Dict[str, Any]:
         """处理智能家居控制"""
         await asyncio.sleep(0.5)
-        device = intent_result.get("entities", {}).get("device", "设备")
+        device = intent_result.get("entities", {}).get("device", DEFAULT_DEVICE)
         return {
             "success": True,
-            "response": f"{device}已控制",
+            "response": SMART_HOME_RESPONSE.format(device=device),
             "action": "smart_home_control"
         }
     
@@ -192,66 +318,134 @@ class CommandExecutor:
         await asyncio.sleep(0.3)
         return {
             "success": True,
-            "response": "我明白了，有什么可以帮助您的吗？",
+            "response": GENERAL_RESPONSE,
             "action": "general_chat"
         }
 
 
 class TTSModule:
-    """语音合成模块（占位符实现）"""
+    """语音合成模块（占位符合成 + 合成结果缓存）"""
     
-    def __init__(self):
-        self.is_speaking = False
+    def __init__(self, voice: str = TTS_VOICE, rate: float = TTS_RATE,
+                 sample_rate: int = 16000, cache: TTSCache = None):
+        """
+        初始化语音合成模块
+        
+        Args:
+            voice: 音色
+            rate: 语速
+            sample_rate: 输出采样率
+            cache: 合成语音缓存，为None时按配置创建
+        """
+        self.voice = voice
+        self.rate = rate
+        self.sample_rate = sample_rate
+        self.cache = cache or TTSCache(TTS_CACHE_MAX_BYTES, TTS_CACHE_DIR, TTS_CACHE_DISK_MAX_BYTES)
+    
+    async def _synthesize(self, text: str) -> np.ndarray:
+        """合成语音（占位符实现）"""
+        # 模拟TTS处理时间
+        await asyncio.sleep(len(text) * 0.1)  # 根据文本长度模拟时间
+        
+        # 生成与文本长度相称的提示音作为占位音频
+        duration = len(text) * 0.25 / self.rate
+        t = np.arange(int(duration * self.sample_rate), dtype=np.float32) / self.sample_rate
+        return (np.sin(2 * np.pi * 440.0 * t) * 3000).astype(np.int16)
+    
+    async def synthesize(self, text: str) -> np.ndarray:
+        """合成语音（优先使用缓存，缓存的磁盘读写放在线程中，不阻塞事件循环）"""
+        pcm = await asyncio.to_thread(self.cache.get, text, self.voice, self.rate)
+        if pcm is None:
+            pcm = await self._synthesize(text)
+            await asyncio.to_thread(self.cache.put, text, self.voice, self.rate, pcm)
+        return pcm
     
     async def speak(self, text: str) -> bool:
-        """语音合成"""
+        """语音合成（模块由所有会话共享，播放状态记录在各自的会话上）"""
         logger.info(f"🔊 语音合成: {text}")
-        self.is_speaking = True
         
-        # 模拟TTS处理时间
-        await asyncio.sleep(len(text) * 0.1)  # 根据文本长度模拟时间
+        # 缓存命中时无需合成，直接开始播放
+        pcm = await self.synthesize(text)
         
-        logger.info(f"🔊 语音播放完成")
-        self.is_speaking = False
+        logger.info(f"🔊 语音播放完成 ({len(pcm) / self.sample_rate:.2f}s)")
         return True
     
-    def stop_speaking(self):
-        """停止语音播放"""
-        self.is_speaking = False
-        logger.info("🔊 语音播放已停止")
+    async def prewarm(self, texts: List[str]):
+        """预合成固定回复"""
+        missing = [
+            text for text in texts
+            if not await asyncio.to_thread(self.cache.contains, text, self.voice, self.rate)
+        ]
+        for text in missing:
+            await self.synthesize(text)
+        logger.info(f"🔊 固定回复预合成完成: 新合成 {len(missing)} 条, 共 {len(texts)} 条")
+    
+    def get_info(self) -> Dict[str, Any]:
+        """获取合成模块信息"""
+        return {
+            "voice": self.voice,
+            "rate": self.rate,
+            "cache": self.cache.get_stats(),
+        }
 
 
-class VoiceAssistantPipeline:
-    """语音助手流水线管理器"""
+class PipelineSession:
+    """
+    单个客户端的语音助手会话
+
+    只持有每个客户端独立的状态（KWS流、VAD状态、阶段任务），
+    模型由所属的 VoiceAssistantPipeline 共享。会话的生命周期运行在
+    一个监督任务中：监督任务顺序消费音频，唤醒后的 ASR -> 意图 -> 执行 -> TTS
+    阶段在独立的阶段任务中运行，不会阻塞音频接收。
+    """
     
-    def __init__(self, model_dir: str = None):
+    def __init__(self, pipeline: "VoiceAssistantPipeline", session_id: str, vad: SileroVAD,
+                 audio_queue_size: int = 100, load: Optional[SessionLoad] = None,
+                 keyword_set: Optional[str] = None):
         """
-        初始化语音助手流水线
+        初始化会话
         
         Args:
-            model_dir: 模型目录路径
+            pipeline: 提供共享模型的流水线
+            session_id: 会话ID（通常为客户端ID）
+            vad: 会话独占的VAD（由流水线在事件循环外创建或从空闲池取出）
+            audio_queue_size: 待处理音频块队列长度
+            load: 准入控制分配的积压跟踪对象，为None时使用默认降级参数
+            keyword_set: 唤醒词集合名称，为None时使用默认集合
         """
-        self.model_dir = model_dir
+        self.pipeline = pipeline
+        self.session_id = session_id
+        self.keyword_set = keyword_set
         
-        # 初始化各个模块
-        self.vad = SileroVAD(model_dir)
-        self.kws = KeywordSpotter(model_dir)
-        self.asr = ASRModule()
-        self.intent = IntentModule()
-        self.executor = CommandExecutor()
-        self.tts = TTSModule()
+        # 积压跟踪（已接收 - 已处理的音频时长），积压过高时按降级策略丢弃音频块
+        self.load = load or SessionLoad(session_id, SAMPLE_RATE)
         
-        # 流水线状态
+        # 会话状态
         self.state = PipelineState.IDLE
         self.is_running = False
+        self.is_speaking = False
+        
+        # 每个会话独立的流状态
+        # 注意：sherpa-onnx 的 VAD 将模型与状态绑定在同一对象中，因此 VAD 按会话独占
+        self.kws_stream = None
+        self.vad = vad
+        self._vad_lock = asyncio.Lock()  # VAD推理在线程中进行，阶段任务重置VAD时须等推理结束
+        
+        # 唤醒后的语音捕获缓冲区（含唤醒前回看音频）与端点检测状态
+        self.capture = CaptureBuffer(SAMPLE_RATE, CAPTURE_LOOKBACK_SECONDS, CAPTURE_MAX_SECONDS)
+        self._heard_speech = False
+        self._silence_samples = 0
         
         # 事件回调
         self.event_callbacks: List[Callable[[PipelineEvent], None]] = []
         
-        # 音频流
-        self.kws_stream = None
-        
-        logger.info("🎯 语音助手流水线初始化完成")
+        # 监督任务与阶段任务
+        self._audio_queue: asyncio.Queue = asyncio.Queue(maxsize=audio_queue_size)
+        self._supervisor_task: Optional[asyncio.Task] = None
+        self._stage_task: Optional[asyncio.Task] = None
+        self._reset_task: Optional[asyncio.Task] = None
+        self._audio_count = 0
+        self.created_at = time.time()
     
     def add_event_callback(self, callback: Callable[[PipelineEvent], None]):
         """添加事件回调"""
@@ -263,7 +457,8 @@ class VoiceAssistantPipeline:
             event_type=event_type,
             data=data,
             timestamp=time.time(),
-            state=self.state
+            state=self.state,
+            session_id=self.session_id
         )
         
         for callback in self.event_callbacks:
@@ -272,109 +467,199 @@ class VoiceAssistantPipeline:
             except Exception as e:
                 logger.error(f"事件回调错误: {e}")
     
-    async def start_pipeline(self):
-        """启动流水线"""
+    async def start(self):
+        """启动会话（创建监督任务后立即返回）"""
         if self.is_running:
-            logger.warning("流水线已在运行中")
+            logger.warning(f"会话 {self.session_id} 已在运行中")
             return
         
         self.is_running = True
         self.state = PipelineState.LISTENING
-        self.kws_stream = self.kws.create_stream()
+        self.kws_stream = self.pipeline.kws.create_stream(self.keyword_set)
+        self._supervisor_task = asyncio.create_task(
+            self._supervise(), name=f"pipeline-session-{self.session_id}"
+        )
         
-        logger.info("🎯 语音助手流水线启动")
+        logger.info(f"🎯 会话 {self.session_id} 启动")
         self._emit_event("pipeline_started", {"state": self.state.value})
-        
-        # 开始监听循环
-        await self._listening_loop()
     
-    async def stop_pipeline(self):
-        """停止流水线"""
+    async def stop(self):
+        """停止会话并释放流状态"""
+        if not self.is_running:
+            return
+        
         self.is_running = False
-        self.state = PipelineState.IDLE
         
-        # 停止各个模块
-        self.asr.stop_recognition()
-        self.tts.stop_speaking()
+        tasks = [t for t in (self._stage_task, self._reset_task, self._supervisor_task) if t and not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._stage_task = None
+        self._reset_task = None
+        self._supervisor_task = None
+        
+        self.state = PipelineState.IDLE
+        self.is_speaking = False
+        self.kws_stream = None
+        self.vad.reset()
+        self.capture.reset()
         
-        logger.info("🎯 语音助手流水线停止")
+        logger.info(f"🎯 会话 {self.session_id} 停止")
         self._emit_event("pipeline_stopped", {"state": self.state.value})
     
     async def process_audio_chunk(self, audio_data: np.ndarray, sample_rate: int = 16000):
-        """处理音频数据块"""
+        """提交音频数据块，由监督任务按顺序处理"""
         if not self.is_running:
-            logger.warning("⚠️ 流水线未运行，忽略音频数据")
+            logger.warning(f"⚠️ 会话 {self.session_id} 未运行，忽略音频数据")
             return
         
-        try:
+        level = self.load.on_received(len(audio_data))
+        if level is not None:
+            self._emit_event("overload", self.load.overload_message())
+        
+        # 积压过高时按降级策略直接丢弃；只在监听阶段降级，唤醒后的音频是 ASR 输入，不能丢
+        if self.state == PipelineState.LISTENING and self.load.should_shed(audio_data, get_memory_budget().under_pressure):
+            return
+        
+        await self._audio_queue.put((audio_data, sample_rate))
+    
+    async def _supervise(self):
+        """监督任务：顺序处理音频，监听阶段解码落后时把排队的音频块合并为一次处理，出错时重置到监听状态"""
+        while self.is_running:
+            audio_data, sample_rate = await self._audio_queue.get()
             if self.state == PipelineState.LISTENING:
-                await self._handle_listening_state(audio_data, sample_rate)
-            elif self.state == PipelineState.SPEECH_RECOGNITION:
-                # 在语音识别状态下，可以继续收集音频数据
-                logger.debug("语音识别状态，继续收集音频数据")
-            else:
-                logger.debug(f"当前状态: {self.state.value}，忽略音频数据")
-            
-        except Exception as e:
-            logger.error(f"❌ 音频处理错误: {e}")
-            import traceback
-            logger.error(f"❌ 错误详情: {traceback.format_exc()}")
+                items = drain_backlog(self._audio_queue, (audio_data, sample_rate),
+                                      int(COALESCE_MAX_SECONDS * sample_rate))
+                if len(items) > 1:
+                    audio_data = np.concatenate([item[0] for item in items])
+            try:
+                await self._dispatch_audio(audio_data, sample_rate)
+            except Exception as e:
+                logger.error(f"❌ 会话 {self.session_id} 音频处理错误: {e}")
+                import traceback
+                logger.error(f"❌ 错误详情: {traceback.format_exc()}")
+                try:
+                    # 先停掉仍在运行的阶段任务，否则它稍后会把状态改回识别/执行等阶段
+                    await self._cancel_stage_task()
+                    await self._reset_to_listening()
+                except Exception as reset_error:
+                    logger.error(f"❌ 重置会话失败: {reset_error}")
+            finally:
+                self.load.on_decoded(len(audio_data))
+    
+    async def _dispatch_audio(self, audio_data: np.ndarray, sample_rate: int):
+        """根据当前状态分发音频数据"""
+        # 所有音频都写入捕获缓冲区：监听时作为回看窗口，唤醒后作为 ASR 输入
+        self.capture.append(audio_data)
+        
+        if self.state == PipelineState.LISTENING:
+            await self._handle_listening_state(audio_data, sample_rate)
+        elif self.capture.is_capturing:
+            await self._update_endpoint(audio_data, sample_rate)
+        else:
+            logger.debug(f"当前状态: {self.state.value}，忽略音频数据")
+    
+    async def _detect_speech(self, audio_data: np.ndarray, sample_rate: int) -> bool:
+        """VAD推理与KWS解码一样在线程池中进行，受进程级并发解码上限约束"""
+        async with self._vad_lock:
+            decode = asyncio.ensure_future(
+                get_thread_budget().run_decode(self.vad.process_audio_chunk, audio_data, sample_rate)
+            )
             try:
-                await self._reset_to_listening()
-            except Exception as reset_error:
-                logger.error(f"❌ 重置流水线失败: {reset_error}")
+                return await asyncio.shield(decode)
+            except asyncio.CancelledError:
+                # 取消不会中断线程中的推理，等它结束后再释放VAD，避免会话关闭后VAD仍在被使用
+                await asyncio.gather(decode, return_exceptions=True)
+                raise
+    
+    async def _update_endpoint(self, audio_data: np.ndarray, sample_rate: int):
+        """基于VAD的端点检测：语音后持续静音或一直无语音时结束捕获"""
+        if await self._detect_speech(audio_data, sample_rate):
+            self._heard_speech = True
+            self._silence_samples = 0
+            return
+        
+        self._silence_samples += len(audio_data)
+        silence_seconds = self._silence_samples / sample_rate
+        if self._heard_speech and silence_seconds >= ENDPOINT_SILENCE_SECONDS:
+            logger.info(f"🔚 会话 {self.session_id} 检测到句尾")
+            self.capture.close()
+        elif not self._heard_speech and silence_seconds >= ENDPOINT_NO_SPEECH_SECONDS:
+            logger.info(f"🔚 会话 {self.session_id} 唤醒后未检测到语音")
+            self.capture.close()
     
     async def _handle_listening_state(self, audio_data: np.ndarray, sample_rate: int):
         """处理监听状态"""
         # 减少日志频率 - 每20个音频块输出一次
-        if hasattr(self, '_audio_count'):
-            self._audio_count += 1
-        else:
-            self._audio_count = 1
-            
-        if self._audio_count % 20 == 0:
+        self._audio_count += 1
+        verbose = self._audio_count % 20 == 0
+        
+        if verbose:
             logger.info(f"🔄 处理音频块: {len(audio_data)} 样本, 范围: [{audio_data.min():.3f}, {audio_data.max():.3f}]")
         
-        # 重新启用VAD检测
-        has_speech = self.vad.process_audio_chunk(audio_data, sample_rate)
+        has_speech = await self._detect_speech(audio_data, sample_rate)
         
-        if self._audio_count % 20 == 0:
+        if verbose:
             logger.info(f"🎤 VAD检测结果: {has_speech}")
         
-        if has_speech:
-            if self._audio_count % 20 == 0:
-                logger.info("🎯 检测到语音活动，进行关键词检测...")
-            keyword = self.kws.process_audio_chunk(self.kws_stream, audio_data, sample_rate)
+        # 即使没有VAD检测到语音，也进行关键词检测（降低VAD依赖）
+        # 解码在线程池中进行，受进程级并发解码上限约束
+        detections = await get_thread_budget().run_decode(
+            self.pipeline.kws.process_audio_chunk, self.kws_stream, audio_data, sample_rate
+        )
+        
+        if detections:
+            # 第一次唤醒就进入识别阶段，同一音频块中之后的结果不再处理
+            detection = detections[0]
+            logger.info(f"🎯 会话 {self.session_id} 检测到唤醒词{'' if has_speech else '（无VAD）'}: {detection.keyword}")
+            self.state = PipelineState.WAKE_WORD_DETECTED
+            self._emit_event("wake_word_detected", detection.to_dict())
             
-            if keyword:
-                logger.info(f"🎯 检测到唤醒词: {keyword}")
-                self.state = PipelineState.WAKE_WORD_DETECTED
-                self._emit_event("wake_word_detected", {"keyword": keyword})
-                
-                # 进入语音识别阶段
-                await self._enter_speech_recognition()
-            elif self._audio_count % 20 == 0:
-                logger.info("🎯 KWS检测结果: None")
-        else:
-            if self._audio_count % 20 == 0:
-                logger.info("🔇 未检测到语音活动")
-            # 即使没有VAD检测到语音，也进行关键词检测（降低VAD依赖）
-            keyword = self.kws.process_audio_chunk(self.kws_stream, audio_data, sample_rate)
-            if keyword:
-                logger.info(f"🎯 检测到唤醒词（无VAD）: {keyword}")
-                self.state = PipelineState.WAKE_WORD_DETECTED
-                self._emit_event("wake_word_detected", {"keyword": keyword})
-                
-                # 进入语音识别阶段
-                await self._enter_speech_recognition()
+            # 立即开始捕获，唤醒词后紧接着说出的指令不会丢失
+            self.capture.trigger()
+            self._heard_speech = has_speech
+            self._silence_samples = 0
+            
+            # 进入语音识别阶段（在阶段任务中运行，不阻塞音频接收）
+            self._start_stage_task(self._enter_speech_recognition())
+        elif verbose:
+            logger.info("🎯 KWS检测结果: None")
+    
+    def _start_stage_task(self, coro):
+        """启动唤醒后的阶段任务"""
+        self._stage_task = asyncio.create_task(
+            coro, name=f"pipeline-stage-{self.session_id}"
+        )
+        self._stage_task.add_done_callback(self._on_stage_done)
+    
+    def _on_stage_done(self, task: asyncio.Task):
+        """阶段任务结束回调：异常时恢复到监听状态（保留重置任务的引用，避免被垃圾回收）"""
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None and self.is_running:
+            logger.error(f"❌ 会话 {self.session_id} 阶段任务错误: {error}")
+            self._reset_task = asyncio.create_task(
+                self._reset_to_listening(), name=f"pipeline-reset-{self.session_id}"
+            )
+    
+    async def _cancel_stage_task(self):
+        """取消并等待仍在运行的阶段任务"""
+        task, self._stage_task = self._stage_task, None
+        if task and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
     
     async def _enter_speech_recognition(self):
         """进入语音识别阶段"""
         self.state = PipelineState.SPEECH_RECOGNITION
         self._emit_event("speech_recognition_started", {})
         
-        # 开始语音识别
-        recognized_text = await self.asr.start_recognition()
+        # 开始语音识别（消费捕获缓冲区直到端点检测结束语句，部分结果实时转发）
+        recognized_text = await self.pipeline.asr.start_recognition(
+            self.capture.stream(), SAMPLE_RATE, on_partial=self._on_asr_partial
+        )
+        self._emit_event("asr_final", {"text": recognized_text})
         
         if recognized_text:
             # 进入意图识别阶段
@@ -383,13 +668,17 @@ class VoiceAssistantPipeline:
             # 识别失败，返回监听状态
             await self._reset_to_listening()
     
+    def _on_asr_partial(self, result: ASRResult):
+        """转发部分识别结果"""
+        self._emit_event("asr_partial", {"text": result.text, "audio_seconds": result.audio_seconds})
+    
     async def _enter_intent_processing(self, text: str):
         """进入意图处理阶段"""
         self.state = PipelineState.INTENT_PROCESSING
         self._emit_event("intent_processing_started", {"text": text})
         
         # 识别意图
-        intent_result = await self.intent.recognize_intent(text)
+        intent_result = await self.pipeline.intent.recognize_intent(text)
         
         # 进入指令执行阶段
         await self._enter_command_execution(intent_result)
@@ -400,7 +689,7 @@ class VoiceAssistantPipeline:
         self._emit_event("command_execution_started", intent_result)
         
         # 执行指令
-        execution_result = await self.executor.execute_command(intent_result)
+        execution_result = await self.pipeline.executor.execute_command(intent_result)
         
         # 进入语音合成阶段
         await self._enter_tts(execution_result)
@@ -412,7 +701,11 @@ class VoiceAssistantPipeline:
         
         # 语音合成
         response_text = execution_result.get("response", "处理完成")
-        await self.tts.speak(response_text)
+        self.is_speaking = True
+        try:
+            await self.pipeline.tts.speak(response_text)
+        finally:
+            self.is_speaking = False
         
         # 返回监听状态
         await self._reset_to_listening()
@@ -420,26 +713,135 @@ class VoiceAssistantPipeline:
     async def _reset_to_listening(self):
         """重置到监听状态"""
         self.state = PipelineState.LISTENING
-        self.kws_stream = self.kws.create_stream()  # 重新创建流
-        self.vad.reset()  # 重置VAD状态
+        self.is_speaking = False
+        self.kws_stream = self.pipeline.kws.create_stream(self.keyword_set)  # 重新创建流
+        async with self._vad_lock:
+            self.vad.reset()  # 重置VAD状态
+        self.capture.reset()  # 停止捕获，恢复回看记录
         
         self._emit_event("returned_to_listening", {})
-        logger.info("🔄 返回监听状态")
+        logger.info(f"🔄 会话 {self.session_id} 返回监听状态")
     
-    async def _listening_loop(self):
-        """监听循环（用于演示）"""
-        while self.is_running:
-            await asyncio.sleep(0.1)  # 避免CPU占用过高
+    def get_status(self) -> Dict[str, Any]:
+        """获取会话状态"""
+        return {
+            "session_id": self.session_id,
+            "state": self.state.value,
+            "keyword_set": self.keyword_set,
+            "is_running": self.is_running,
+            "is_speaking": self.is_speaking,
+            "queued_chunks": self._audio_queue.qsize(),
+            "load": self.load.get_stats(),
+            "capturing": self.capture.is_capturing,
+            "created_at": self.created_at,
+        }
+
+
+class VoiceAssistantPipeline:
+    """
+    语音助手流水线管理器
+
+    进程级共享的模型容器：KWS 模型与 ASR/意图/执行/TTS 模块只加载一次，
+    每个客户端通过 create_session() 获得独立的 PipelineSession。
+    """
+    
+    def __init__(self, model_dir: str = None, max_idle_vads: int = 4):
+        """
+        初始化语音助手流水线
+        
+        Args:
+            model_dir: 模型目录路径
+            max_idle_vads: 会话关闭后保留以供复用的空闲VAD数量
+        """
+        self.model_dir = model_dir
+        self.max_idle_vads = max_idle_vads
+        
+        # 初始化共享模块
+        self.kws = KeywordSpotter(model_dir)
+        self.asr = ASRModule()
+        self.intent = IntentModule()
+        self.executor = CommandExecutor()
+        self.tts = TTSModule()
+        
+        # 活跃会话
+        self.sessions: Dict[str, PipelineSession] = {}
+        
+        # 空闲VAD池：关闭的会话归还VAD，新会话优先复用，避免每个连接都重新加载模型
+        self._idle_vads: List[SileroVAD] = []
+        
+        logger.info("🎯 语音助手流水线初始化完成")
+    
+    async def create_session(self, session_id: str, load: Optional[SessionLoad] = None,
+                             keyword_set: Optional[str] = None) -> PipelineSession:
+        """
+        创建客户端会话（VAD从空闲池取出，池为空时在线程中加载，不阻塞事件循环）
+        
+        Args:
+            session_id: 会话ID
+            load: 准入控制分配的积压跟踪对象
+            keyword_set: 唤醒词集合名称，为None时使用默认集合
+            
+        Returns:
+            新建的会话（需调用 start() 启动）
+        """
+        if session_id in self.sessions:
+            raise ValueError(f"会话已存在: {session_id}")
+        if keyword_set is not None:
+            self.kws.get_keyword_set(keyword_set)  # 未知集合时抛出 ValueError
+        
+        vad = await self._acquire_vad()
+        # 加载VAD期间同一ID的会话可能已被创建
+        if session_id in self.sessions:
+            self._release_vad(vad)
+            raise ValueError(f"会话已存在: {session_id}")
+        
+        session = PipelineSession(self, session_id, vad, load=load, keyword_set=keyword_set)
+        self.sessions[session_id] = session
+        logger.info(f"🆕 创建会话: {session_id} (当前会话数: {len(self.sessions)})")
+        return session
+    
+    async def close_session(self, session_id: str):
+        """停止并移除会话"""
+        session = self.sessions.pop(session_id, None)
+        if session:
+            await session.stop()
+            self._release_vad(session.vad)
+            logger.info(f"🗑️ 关闭会话: {session_id} (当前会话数: {len(self.sessions)})")
+    
+    async def _acquire_vad(self) -> SileroVAD:
+        """取一个空闲VAD，没有时在线程中加载新的"""
+        if self._idle_vads:
+            return self._idle_vads.pop()
+        return await asyncio.to_thread(SileroVAD, self.model_dir)
+    
+    def _release_vad(self, vad: SileroVAD):
+        """重置VAD状态后放回空闲池，池满时丢弃"""
+        if len(self._idle_vads) < self.max_idle_vads:
+            vad.reset()
+            self._idle_vads.append(vad)
+    
+    async def prewarm(self):
+        """启动时预合成固定回复，常见回复的首次播放无需等待合成"""
+        canned = self.executor.get_canned_responses(self.intent.entity_patterns["device"])
+        await self.tts.prewarm(canned)
+    
+    async def close_all_sessions(self):
+        """停止所有会话"""
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
     
     def get_pipeline_status(self) -> Dict[str, Any]:
         """获取流水线状态"""
         return {
-            "state": self.state.value,
-            "is_running": self.is_running,
+            "active_sessions": len(self.sessions),
+            "idle_vads": len(self._idle_vads),
+            "sessions": {sid: s.get_status() for sid, s in self.sessions.items()},
             "modules": {
-                "vad": self.vad.get_model_info(),
+                "vad": self.kws.vad.get_model_info(),
                 "kws": self.kws.get_model_info(),
-                "asr": {"is_processing": self.asr.is_processing},
-                "tts": {"is_speaking": self.tts.is_speaking}
-            }
+                "asr": self.asr.get_info(),
+                "intent": {"cache": self.intent.get_cache_info()},
+                "tts": self.tts.get_info()
+            },
+            "threads": get_thread_budget().get_info()
         }
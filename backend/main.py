@@ -2,18 +2,29 @@
 FastAPI WebSocket 服务器
 """
 import asyncio
+import itertools
 import json
 import numpy as np
 import time
-from typing import Dict, Set
+from typing import Dict, Optional, Set
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 from loguru import logger
 import uvicorn
 
-from .config import HOST, PORT, DEBUG, SAMPLE_RATE, CHUNK_SIZE
+from .config import (
+    HOST, PORT, DEBUG, SERVER_WORKERS, SAMPLE_RATE, CHUNK_SIZE, COALESCE_MAX_SECONDS,
+    WS_MAX_CONNECTIONS, WS_HEARTBEAT_INTERVAL, WS_PONG_TIMEOUT, WS_IDLE_AUDIO_TIMEOUT,
+    ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT,
+    SHED_DROP_SILENCE_LAG, SHED_DECIMATE_LAG, SHED_DISCONNECT_LAG, SHED_SILENCE_RMS
+)
 from .core import KeywordSpotter
+from .core.admission import AdmissionController, SessionLoad, SHED_DISCONNECT, drain_backlog
+from .core.session_reaper import SessionReaper
+from .core.memory import get_memory_budget
+from .core.recorder import get_recorder
+from .core.thread_budget import get_thread_budget
 
 
 class ConnectionManager:
@@ -21,32 +32,90 @@ class ConnectionManager:
     
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
-        self.spotter_instances: Dict[str, KeywordSpotter] = {}
+        self.admission = AdmissionController(WS_MAX_CONNECTIONS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
     
-    async def connect(self, websocket: WebSocket, client_id: str):
-        """建立连接"""
+    async def connect(self, websocket: WebSocket, client_id: str) -> Optional[SessionLoad]:
+        """
+        建立连接（超过容量时排队，排不上时以 1013 关闭）
+        
+        Returns:
+            接纳后该连接的积压跟踪对象，连接失败时返回None
+        """
         await websocket.accept()
-        self.active_connections[client_id] = websocket
         
-        # 为每个连接创建独立的关键词检测器实例
-        try:
-            spotter = KeywordSpotter()
-            spotter.reset_vad()  # 重置VAD状态
-            self.spotter_instances[client_id] = spotter
-            logger.info(f"客户端 {client_id} 连接成功，检测器初始化完成")
-        except Exception as e:
-            logger.error(f"客户端 {client_id} 检测器初始化失败: {e}")
+        # 所有连接共享一个关键词检测器，每个连接只创建自己的音频流
+        if spotter is None:
+            logger.error(f"客户端 {client_id} 连接失败: 检测器未初始化")
             await websocket.close(code=1011, reason="检测器初始化失败")
-            return False
+            return None
+        
+        async def reject_memory():
+            """内存不足时拒绝连接"""
+            await websocket.send_text(json.dumps({
+                "type": "overload",
+                "reason": "memory",
+                "message": "服务器内存不足，请稍后重试"
+            }))
+            await websocket.close(code=1013, reason="服务器内存不足")
+        
+        # 预计超出进程内存预算时直接拒绝，不进入排队；接纳时预留该连接的预计内存
+        memory_budget = get_memory_budget()
+        if not memory_budget.admit(client_id):
+            await reject_memory()
+            return None
         
-        return True
+        queued = False
+        
+        async def notify_queued(position: int):
+            """只在确实进入等待队列时通知客户端（队列已满会直接拒绝，不发送）"""
+            nonlocal queued
+            queued = True
+            await websocket.send_text(json.dumps({
+                "type": "overload",
+                "reason": "queued",
+                "position": position,
+                "message": "服务器繁忙，正在排队"
+            }))
+        
+        load = None
+        try:
+            load = await self.admission.acquire(
+                client_id,
+                on_queued=notify_queued,
+                sample_rate=SAMPLE_RATE,
+                drop_silence_lag=SHED_DROP_SILENCE_LAG,
+                decimate_lag=SHED_DECIMATE_LAG,
+                disconnect_lag=SHED_DISCONNECT_LAG,
+                silence_rms=SHED_SILENCE_RMS
+            )
+        finally:
+            # 未被接纳（含排队期间断开）时释放内存预留
+            if load is None:
+                memory_budget.release(client_id)
+        if load is None:
+            await websocket.send_text(json.dumps({
+                "type": "overload",
+                "reason": "capacity",
+                "message": "服务器繁忙，请稍后重试"
+            }))
+            await websocket.close(code=1013, reason="服务器繁忙")
+            return None
+        
+        # 排队期间其他连接可能已占用内存，接纳后按当前 RSS 和预留重新检查
+        if queued and not memory_budget.admit(client_id):
+            self.admission.release(client_id)
+            await reject_memory()
+            return None
+        
+        self.active_connections[client_id] = websocket
+        logger.info(f"客户端 {client_id} 连接成功")
+        return load
     
-    def disconnect(self, client_id: str):
-        """断开连接"""
+    def disconnect(self, client_id: str, shed: bool = False):
+        """断开连接并释放准入名额"""
         if client_id in self.active_connections:
             del self.active_connections[client_id]
-        if client_id in self.spotter_instances:
-            del self.spotter_instances[client_id]
+        self.admission.release(client_id, disconnected=shed)
         logger.info(f"客户端 {client_id} 断开连接")
     
     async def send_message(self, client_id: str, message: dict):
@@ -69,9 +138,39 @@ app = FastAPI(
 # 连接管理器
 manager = ConnectionManager()
 
+# 进程内共享的关键词检测器（启动时加载一次）
+spotter: Optional[KeywordSpotter] = None
+
 # 音频流存储
 audio_streams: Dict[str, any] = {}
 
+# 连接ID计数器
+client_ids = itertools.count()
+
+# 心跳与空闲会话回收
+reaper = SessionReaper(WS_HEARTBEAT_INTERVAL, WS_PONG_TIMEOUT, WS_IDLE_AUDIO_TIMEOUT)
+
+
+@app.on_event("startup")
+async def startup_event():
+    """启动时加载共享的关键词检测器（预 fork 模式下已由父进程加载）、测量每路流的内存成本并启动会话回收"""
+    global spotter
+    reaper.start()
+    if spotter is None:
+        try:
+            spotter = await asyncio.to_thread(KeywordSpotter)
+        except Exception as e:
+            logger.error(f"❌ 关键词检测器初始化失败: {e}")
+            return
+    await asyncio.to_thread(get_memory_budget().measure, "kws_stream", spotter.warm_stream)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时停止会话回收并写完未落盘的录音"""
+    await reaper.stop()
+    await asyncio.to_thread(get_recorder().stop)
+
 
 @app.get("/")
 async def root():
@@ -143,10 +242,19 @@ async def root():
                 
                 ws.onmessage = function(event) {
                     const data = JSON.parse(event.data);
-                    if (data.type === 'keyword_detected') {
-                        const latency = data.latency_ms ? ` (延迟: ${data.latency_ms.toFixed(1)}ms)` : '';
-                        log(`🎯 检测到唤醒词: ${data.keyword}${latency}`);
+                    if (data.type === 'ping') {
+                        ws.send(JSON.stringify({ type: 'pong', timestamp: data.timestamp }));
+                    } else if (data.type === 'keyword_detected') {
+                        // 往返延迟用本地时钟计算：服务端回传触发检测的音频块的发送时间
+                        const roundTrip = data.frontend_timestamp ? Date.now() - data.frontend_timestamp : null;
+                        const detail = `音频 ${data.start_time.toFixed(2)}s-${data.end_time.toFixed(2)}s, ` +
+                            `算法延迟 ${data.algorithmic_latency_ms.toFixed(0)}ms, 服务端 ${data.server_ms.toFixed(1)}ms` +
+                            (roundTrip !== null ? `, 往返 ${roundTrip}ms` : '');
+                        log(`🎯 检测到唤醒词: ${data.keyword} (${detail})`);
                         updateStatus(`检测到: ${data.keyword}`, 'detected');
+                    } else if (data.type === 'overload') {
+                        const detail = data.reason === 'lagging' ? `处理积压 ${data.lag_ms}ms，降级: ${data.level}` : data.message;
+                        log(`⚠️ 服务器过载: ${detail}`);
                     } else if (data.type === 'error') {
                         log(`❌ 错误: ${data.message}`);
                     }
@@ -227,6 +335,9 @@ async def get_status():
     return {
         "status": "running",
         "active_connections": len(manager.active_connections),
+        "waiting_connections": manager.admission.waiting,
+        "reaped_sessions": reaper.get_stats()["reaped_total"],
+        "max_connections": WS_MAX_CONNECTIONS,
         "sample_rate": SAMPLE_RATE,
         "chunk_size": CHUNK_SIZE
     }
@@ -235,73 +346,139 @@ async def get_status():
 @app.get("/api/model-info")
 async def get_model_info():
     """获取模型信息"""
+    if spotter is None:
+        raise HTTPException(status_code=503, detail="检测器未初始化")
     try:
-        spotter = KeywordSpotter()
         return spotter.get_model_info()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取模型信息失败: {e}")
 
 
+@app.get("/api/admin/threads")
+async def get_thread_plan():
+    """获取CPU线程分配方案和并发解码统计"""
+    return get_thread_budget().get_info()
+
+
+@app.get("/api/admin/reaper")
+async def get_reaper_stats():
+    """获取心跳与空闲会话回收统计"""
+    return reaper.get_stats()
+
+
+@app.get("/api/admin/admission")
+async def get_admission_stats():
+    """获取准入统计和各连接的处理积压"""
+    return manager.admission.get_stats()
+
+
+@app.get("/api/admin/memory")
+async def get_memory_stats():
+    """获取进程内存预算和各连接的内存记账"""
+    return get_memory_budget().get_stats()
+
+
+@app.get("/api/admin/recorder")
+async def get_recorder_stats():
+    """获取会话录音统计"""
+    return get_recorder().get_stats()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket端点"""
-    client_id = f"client_{len(manager.active_connections)}"
+    """WebSocket端点：接收任务只负责收包入队，解码任务按顺序解码"""
+    client_id = f"client_{next(client_ids)}"
     
     # 建立连接
-    if not await manager.connect(websocket, client_id):
+    load = await manager.connect(websocket, client_id)
+    if load is None:
         return
     
+    decode_task = None
+    activity = None
+    recording = None
+    shed = False
     try:
-        # 初始化音频流
-        spotter = manager.spotter_instances[client_id]
-        audio_stream = spotter.create_stream()
+        # 初始化音频流（连接参数 keyword_set 选择唤醒词集合，所有集合共用同一个模型）
+        keyword_set = websocket.query_params.get("keyword_set")
+        try:
+            audio_stream = spotter.create_stream(keyword_set)
+        except ValueError as e:
+            logger.warning(f"⚠️ 客户端 {client_id} 连接失败: {e}")
+            await manager.send_message(client_id, {"type": "error", "message": str(e)})
+            await websocket.close(code=1008, reason="未知的唤醒词集合")
+            return
         audio_streams[client_id] = audio_stream
         
+        # 内存记账：流的稳态成本（启动时测得）+ 待解码音频积压
+        memory_budget = get_memory_budget()
+        memory_budget.register(
+            client_id,
+            kws_stream=memory_budget.unit_cost("kws_stream"),
+            audio_queue=lambda: load.backlog_bytes,
+        )
+        
+        # 按抽样比例录音（未启用时为None）
+        keyword_set = audio_stream.keyword_set.name if audio_stream.keyword_set else None
+        recording = get_recorder().start_session(client_id, SAMPLE_RATE, keyword_set=keyword_set)
+        
         # 发送连接成功消息
         await manager.send_message(client_id, {
             "type": "connected",
             "client_id": client_id,
+            "keyword_set": keyword_set,
             "message": "连接成功"
         })
         
+        # 登记心跳与空闲检测，失效或空闲时由回收器关闭连接并取消本任务
+        activity = reaper.register(
+            client_id,
+            websocket.send_text,
+            lambda code, reason: websocket.close(code=code, reason=reason)
+        )
+        
+        audio_queue: asyncio.Queue = asyncio.Queue()
+        decode_task = asyncio.create_task(
+            decode_audio(client_id, audio_stream, audio_queue, load, recording),
+            name=f"decode-{client_id}"
+        )
+        
         # 处理音频数据
         logger.info(f"🎤 客户端 {client_id} 开始接收音频数据")
-        chunk_count = 0
         while True:
             try:
                 # 接收JSON格式的音频数据
                 message = await websocket.receive_text()
                 data = json.loads(message)
-                chunk_count += 1
+                
+                # 心跳回复
+                if data.get("type") == "pong":
+                    activity.on_message()
+                    continue
+                activity.on_audio()
                 
                 # 解析时间戳和音频数据
                 frontend_timestamp = data['timestamp']
                 audio_array = data['audioData']
                 
                 # 将音频数据转换为numpy数组
-                audio_data = np.array(audio_array, dtype=np.int16)
-                audio_data = audio_data.astype(np.float32) / 32768.0
+                pcm = np.array(audio_array, dtype=np.int16)
+                if recording is not None:
+                    recording.write_audio(pcm)
+                audio_data = pcm.astype(np.float32) / 32768.0
                 
-                # 处理音频数据
-                keyword = spotter.process_audio_chunk(audio_stream, audio_data, SAMPLE_RATE)
+                # 记录接收的音频时长，积压过高或内存压力下按降级策略直接丢弃，积压级别变化时通知客户端
+                level = load.on_received(len(audio_data))
+                if not load.should_shed(audio_data, memory_budget.under_pressure):
+                    audio_queue.put_nowait((audio_data, frontend_timestamp, time.perf_counter()))
+                if level is not None:
+                    await manager.send_message(client_id, load.overload_message())
                 
-                if keyword:
-                    # 计算延迟时间
-                    backend_timestamp = time.time() * 1000  # 转换为毫秒
-                    latency_ms = backend_timestamp - frontend_timestamp
-                    
-                    logger.info(f"🎯 客户端 {client_id} 检测到唤醒词: {keyword} (延迟: {latency_ms:.1f}ms)")
-                    
-                    # 发送检测结果
-                    await manager.send_message(client_id, {
-                        "type": "keyword_detected",
-                        "keyword": keyword,
-                        "timestamp": asyncio.get_event_loop().time(),
-                        "latency_ms": latency_ms,
-                        "frontend_timestamp": frontend_timestamp,
-                        "backend_timestamp": backend_timestamp
-                    })
-                # 只在检测到唤醒词时才打印日志，减少噪音
+                if load.level == SHED_DISCONNECT:
+                    logger.warning(f"⚠️ 客户端 {client_id} 处理积压过高，断开连接")
+                    shed = True
+                    await websocket.close(code=1013, reason="处理积压过高")
+                    break
                 
             except WebSocketDisconnect:
                 logger.info(f"🔌 客户端 {client_id} WebSocket断开连接")
@@ -313,17 +490,85 @@ async def websocket_endpoint(websocket: WebSocket):
                     "message": f"处理音频数据错误: {e}"
                 })
     
+    except asyncio.CancelledError:
+        # 被回收器取消时正常结束，其他取消照常传播
+        if activity is None or activity.reap_reason is None:
+            raise
+        logger.info(f"🧹 客户端 {client_id} 已回收: {activity.reap_reason}")
     except Exception as e:
         logger.error(f"WebSocket连接错误 {client_id}: {e}")
     finally:
-        # 清理资源
-        manager.disconnect(client_id)
+        # 清理资源（同步清理放在前面，等待解码任务时本任务再被取消也不会漏掉）
+        if activity is not None:
+            reaper.unregister(client_id)
+        manager.disconnect(client_id, shed=shed)
+        get_memory_budget().unregister(client_id)
+        if recording is not None:
+            recording.close()
         if client_id in audio_streams:
             del audio_streams[client_id]
+        if decode_task and not decode_task.done():
+            decode_task.cancel()
+            await asyncio.gather(decode_task, return_exceptions=True)
+
+
+async def decode_audio(client_id: str, audio_stream, audio_queue: asyncio.Queue, load: SessionLoad,
+                       recording=None):
+    """解码任务：按顺序解码连接的音频，解码落后时把排队的音频块合并为一次解码"""
+    max_samples = int(COALESCE_MAX_SECONDS * SAMPLE_RATE)
+    while True:
+        items = drain_backlog(audio_queue, await audio_queue.get(), max_samples)
+        audio_data = items[0][0] if len(items) == 1 else np.concatenate([item[0] for item in items])
+        # 本批第一个样本在流中的位置（流里可能还缓冲着上一批不足一块的余量）
+        batch_start = audio_stream.num_samples + audio_stream.pending_samples
+        try:
+            # 在线程池中解码，受进程级并发解码上限约束
+            detections = await get_thread_budget().run_decode(
+                spotter.process_audio_chunk, audio_stream, audio_data, SAMPLE_RATE
+            )
+        except Exception as e:
+            logger.error(f"❌ 解码音频数据错误 {client_id}: {e}")
+            detections = []
+        finally:
+            load.on_decoded(len(audio_data))
+        
+        # 合并解码的积压里可能有多次唤醒，逐个发送
+        for detection in detections:
+            # 找到触发检测的音频块（产生该结果的解码所需的最后一个样本所在的块）
+            offset = round(detection.detected_at * SAMPLE_RATE) - batch_start
+            for item in items:
+                _, frontend_timestamp, received_at = item
+                offset -= len(item[0])
+                if offset <= 0:
+                    break
+            
+            # 服务端耗时：从收到触发检测的音频块到发出结果（排队 + 解码），不依赖客户端时钟
+            server_ms = (time.perf_counter() - received_at) * 1000
+            
+            logger.info(
+                f"🎯 客户端 {client_id} 检测到唤醒词: {detection.keyword} "
+                f"(算法延迟: {detection.algorithmic_latency_ms:.0f}ms, 服务端: {server_ms:.1f}ms)"
+            )
+            
+            # 发送检测结果，回传音频块的前端时间戳供客户端用本地时钟计算往返延迟
+            await manager.send_message(client_id, {
+                "type": "keyword_detected",
+                **detection.to_dict(),
+                "server_ms": round(server_ms, 2),
+                "timestamp": asyncio.get_event_loop().time(),
+                "frontend_timestamp": frontend_timestamp,
+            })
+            if recording is not None:
+                recording.write_detection(detection.to_dict())
 
 
 def run_server():
-    """运行服务器"""
+    """运行服务器（SERVER_WORKERS 大于1且非调试模式时使用预 fork 多进程模式）"""
+    if SERVER_WORKERS > 1 and not DEBUG:
+        from .prefork import run_prefork
+        run_prefork(SERVER_WORKERS, HOST, PORT)
+        return
+    
     logger.info(f"🚀 启动服务器: http://{HOST}:{PORT}")
     logger.info(f"📊 调试模式: {DEBUG}")
     
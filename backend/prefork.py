@@ -0,0 +1,195 @@
+"""
+预 fork 多进程服务
+父进程加载一次 KWS/VAD 模型并生成关键词文件，冻结 GC 后 fork 出多个工作进程，
+工作进程以写时复制的方式共享模型内存页，共同监听同一个 socket，各自运行事件循环和解码线程池。
+
+onnxruntime 的线程池线程不会被 fork 复制，父进程中以多线程创建的推理会话在子进程中调用会卡死，
+因此预 fork 模式下单次解码固定为 1 个线程，多核靠工作进程数 × 每个进程的并发解码数吃满。
+
+用法:
+    python -m backend.prefork --workers 4
+    SERVER_WORKERS=4 python -m backend.main
+"""
+import argparse
+import gc
+import itertools
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+# 父进程 import numpy 之前限制 BLAS/OpenMP 线程池，工作进程不继承无主的线程池
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import uvicorn
+from loguru import logger
+
+from .config import (
+    HOST, PORT, THREAD_BUDGET_CPUS, THREAD_BUDGET_RESERVED_CORES, EXPECTED_CONCURRENCY
+)
+from .core.thread_budget import ThreadBudget, set_thread_budget
+
+
+# 工作进程启动后多久内退出视为启动失败，连续失败时延迟重启
+MIN_WORKER_UPTIME = 5.0
+RESTART_BACKOFF = 1.0
+
+
+def worker_thread_budget(workers: int) -> ThreadBudget:
+    """
+    每个工作进程的线程预算：可用核数和预期并发按工作进程数平分，单次解码固定 1 个线程
+
+    预留核数从总核数中扣除一次，而不是每个工作进程各预留一份
+    """
+    cpu_count = THREAD_BUDGET_CPUS or os.cpu_count() or 1
+    usable = max(1, cpu_count - THREAD_BUDGET_RESERVED_CORES)
+    return ThreadBudget(
+        cpu_count=max(1, usable // workers),
+        expected_concurrency=max(1, -(-EXPECTED_CONCURRENCY // workers)),
+        reserved_cores=0,
+        max_intra_op_threads=1,
+    )
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """在父进程中创建监听 socket，由所有工作进程共享"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """预 fork 服务：父进程加载模型并监督工作进程，工作进程异常退出时重新 fork"""
+
+    def __init__(self, workers: int, host: str = HOST, port: int = PORT):
+        """
+        初始化预 fork 服务
+
+        Args:
+            workers: 工作进程数
+            host: 监听地址
+            port: 监听端口
+        """
+        self.workers = max(1, workers)
+        self.host = host
+        self.port = port
+        self.children: Dict[int, int] = {}  # pid -> 工作进程序号
+        self.started_at: Dict[int, float] = {}
+        self.stopping = False
+        self.sock = None
+
+    def preload(self):
+        """加载共享模型（在 fork 之前调用）"""
+        # 加载期间关闭 GC，避免加载产生的对象被分散到各代后在子进程中因 GC 扫描而触发写时复制
+        gc.disable()
+
+        set_thread_budget(worker_thread_budget(self.workers))
+
+        from . import main as server
+        from .core import KeywordSpotter
+
+        start_time = time.perf_counter()
+        server.spotter = KeywordSpotter()
+        logger.success(f"✅ 父进程模型加载完成，耗时 {(time.perf_counter() - start_time) * 1000:.0f}ms")
+
+        # 把目前所有对象移到永久代，工作进程的 GC 不再扫描（也就不再写）这些对象所在的内存页
+        gc.collect()
+        gc.freeze()
+        logger.info(f"🧊 已冻结 {gc.get_freeze_count()} 个对象")
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(index)  # 不返回
+        self.children[pid] = index
+        self.started_at[pid] = time.monotonic()
+        logger.info(f"👷 工作进程 {index} 已启动 (pid {pid})")
+
+    def _run_worker(self, index: int):
+        """工作进程入口：恢复默认信号处理、重新开启 GC，在共享 socket 上运行 uvicorn"""
+        status = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            gc.enable()
+
+            from . import main as server
+            # 各工作进程的连接ID互不重复（录音目录、日志按连接ID区分）
+            server.client_ids = (f"w{index}_{n}" for n in itertools.count())
+
+            config = uvicorn.Config(server.app, log_level="info")
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException as e:
+            logger.error(f"❌ 工作进程 {index} 异常退出: {e}")
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _on_signal(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"🛑 收到信号 {signum}，停止 {len(self.children)} 个工作进程")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """加载模型、fork 工作进程并监督，直到收到 SIGINT/SIGTERM 且所有工作进程退出"""
+        self.sock = bind_socket(self.host, self.port)
+        self.preload()
+
+        logger.info(f"🚀 预 fork 服务: http://{self.host}:{self.port}，{self.workers} 个工作进程")
+        for index in range(self.workers):
+            self._spawn(index)
+
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            started_at = self.started_at.pop(pid, time.monotonic())
+            if index is None or self.stopping:
+                continue
+
+            logger.warning(f"⚠️ 工作进程 {index} (pid {pid}) 退出，状态 {status}，重新启动")
+            if time.monotonic() - started_at < MIN_WORKER_UPTIME:
+                time.sleep(RESTART_BACKOFF)
+            if not self.stopping:
+                self._spawn(index)
+
+        self.sock.close()
+        logger.info("预 fork 服务已停止")
+
+
+def run_prefork(workers: int, host: str = HOST, port: int = PORT):
+    """以预 fork 多进程模式运行 backend.main 的服务"""
+    if not hasattr(os, "fork"):
+        raise RuntimeError("当前平台不支持 fork，无法使用预 fork 模式")
+    PreforkServer(workers, host, port).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预 fork 多进程唤醒词检测服务")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument("--host", default=HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=PORT, help="监听端口")
+    args = parser.parse_args()
+    run_prefork(args.workers, args.host, args.port)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
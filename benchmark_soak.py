@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+长时间误唤醒与内存浸泡测试
+以最快速度把数小时的负样本音频（合成噪声或录音/WAV 循环播放）送入 KeywordSpotter 和 SileroVAD，
+每路流各自持有 KWS 流和 VAD 状态（与流水线会话相同），定期采样进程 RSS，
+输出每小时误唤醒次数、吞吐、每路流的内存以及 RSS 随音频时长的增长斜率。
+
+用法:
+    python benchmark_soak.py --hours 2 --streams 4
+    python benchmark_soak.py --hours 24 --streams 1 --source recordings/ noise/ --output soak.json
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+SAMPLE_RATE = 16000
+MB = 1024 * 1024
+# 保留明细的误唤醒条数上限（避免测试本身的内存随误唤醒增长）
+MAX_DETECTION_DETAILS = 1000
+
+
+def synthetic_negatives(seed, chunk_samples, segment_seconds=30.0):
+    """
+    无限生成合成负样本音频块：每段随机选择一种噪声（白噪声、布朗噪声、电源嗡嗡声、
+    幅度调制噪声（类似嘈杂人声）、近乎静音），电平随机
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(chunk_samples) / SAMPLE_RATE
+    chunks_per_segment = max(1, int(segment_seconds * SAMPLE_RATE / chunk_samples))
+    brown_state = 0.0
+    offset = 0
+    while True:
+        kind = rng.integers(5)
+        level = 10 ** rng.uniform(-2.5, -0.7)
+        for _ in range(chunks_per_segment):
+            if kind == 0:
+                audio = rng.standard_normal(chunk_samples)
+            elif kind == 1:
+                steps = np.cumsum(rng.standard_normal(chunk_samples)) * 0.02 + brown_state
+                brown_state = steps[-1] * 0.999
+                audio = steps
+            elif kind == 2:
+                phase = 2 * np.pi * 50 * (t + offset / SAMPLE_RATE)
+                audio = np.sin(phase) + 0.5 * np.sin(3 * phase) + 0.1 * rng.standard_normal(chunk_samples)
+            elif kind == 3:
+                envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * (t + offset / SAMPLE_RATE))
+                audio = envelope * rng.standard_normal(chunk_samples)
+            else:
+                audio = 0.01 * rng.standard_normal(chunk_samples)
+            offset += chunk_samples
+            yield np.clip(audio * level, -1.0, 1.0).astype(np.float32)
+
+
+def recorded_negatives(sources, chunk_samples, start):
+    """循环播放录音/WAV（每路流从不同的文件开始）"""
+    from backend.core.replay import iter_source
+    for path in itertools.islice(itertools.cycle(sources), start, None):
+        for _, audio in iter_source(path, chunk_samples):
+            yield audio
+
+
+def growth_slope(samples, warmup_fraction):
+    """进程 RSS（MB）对每路流音频时长（小时）的最小二乘斜率（所有流合计的增长），跳过预热阶段"""
+    points = [s for s in samples if s["rss_mb"] is not None]
+    points = points[int(len(points) * warmup_fraction):]
+    if len(points) < 3:
+        return None
+    x = np.array([p["audio_hours_per_stream"] for p in points])
+    y = np.array([p["rss_mb"] for p in points])
+    if np.ptp(x) == 0:
+        return None
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长时间误唤醒与内存浸泡测试")
+    parser.add_argument("--hours", type=float, default=1.0, help="每路流送入的音频时长（小时）")
+    parser.add_argument("--streams", type=int, default=4, help="同时运行的流数")
+    parser.add_argument("--source", nargs="*", default=[], help="负样本录音/WAV（目录），默认使用合成噪声")
+    parser.add_argument("--chunk-samples", type=int, default=4096, help="每次送入的样本数（与网页客户端一致）")
+    parser.add_argument("--sample-every", type=float, default=300.0, help="每路流每送入多少秒音频采样一次内存")
+    parser.add_argument("--warmup", type=float, default=0.1, help="计算增长斜率时跳过的前置采样比例")
+    parser.add_argument("--no-vad", action="store_true", help="不运行 VAD")
+    parser.add_argument("--seed", type=int, default=0, help="合成噪声的随机种子")
+    parser.add_argument("--output", help="把完整结果（含内存采样）写入 JSON 文件")
+    args = parser.parse_args()
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    from backend.core.keyword_spotter import KeywordSpotter
+    from backend.core.vad_detector import SileroVAD
+    from backend.core.memory import process_rss_bytes
+    from backend.core.replay import find_sources
+
+    def rss_mb():
+        rss = process_rss_bytes()
+        return rss / MB if rss is not None else None
+
+    spotter = KeywordSpotter()
+    rss_models = rss_mb()
+
+    streams = [spotter.create_stream() for _ in range(args.streams)]
+    vads = [] if args.no_vad else [SileroVAD() for _ in range(args.streams)]
+    rss_streams = rss_mb()
+
+    sources = find_sources(args.source)
+    if args.source and not sources:
+        print("没有找到可用的负样本录音或 WAV 文件")
+        return 1
+    generators = [
+        recorded_negatives(sources, args.chunk_samples, i) if sources
+        else synthetic_negatives(args.seed + i, args.chunk_samples)
+        for i in range(args.streams)
+    ]
+
+    chunk_seconds = args.chunk_samples / SAMPLE_RATE
+    total_rounds = int(args.hours * 3600 / chunk_seconds)
+    sample_rounds = max(1, int(args.sample_every / chunk_seconds))
+
+    print(f"浸泡测试: {args.streams} 路流 × {args.hours:g} 小时音频，"
+          f"{'录音' if sources else '合成噪声'}，{'不含' if args.no_vad else '含'} VAD")
+    if rss_models is not None:
+        print(f"RSS: 加载模型后 {rss_models:.1f}MB，创建流后 {rss_streams:.1f}MB "
+              f"（每路流约 {(rss_streams - rss_models) / args.streams:.2f}MB）")
+
+    false_alarms = Counter()
+    detections = []
+    samples = []
+    kws_seconds = vad_seconds = 0.0
+    wall_start = time.perf_counter()
+    for round_index in range(1, total_rounds + 1):
+        for i, stream in enumerate(streams):
+            audio = next(generators[i])
+            if vads:
+                start = time.perf_counter()
+                vads[i].process_audio_chunk(audio, SAMPLE_RATE)
+                vad_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            results = spotter.process_audio_chunk(stream, audio, SAMPLE_RATE)
+            kws_seconds += time.perf_counter() - start
+            for detection in results:
+                false_alarms[detection.keyword] += 1
+                if len(detections) < MAX_DETECTION_DETAILS:
+                    detections.append({"stream": i, "audio_time": round(stream.audio_seconds, 2), **detection.to_dict()})
+
+        if round_index % sample_rounds == 0 or round_index == total_rounds:
+            audio_hours = round_index * chunk_seconds / 3600
+            rss = rss_mb()
+            sample = {
+                "audio_hours_per_stream": round(audio_hours, 4),
+                "wall_seconds": round(time.perf_counter() - wall_start, 2),
+                "rss_mb": round(rss, 2) if rss is not None else None,
+                "per_stream_mb": round((rss - rss_models) / args.streams, 3) if rss is not None else None,
+                "false_alarms": sum(false_alarms.values()),
+            }
+            samples.append(sample)
+            print(f"  音频 {audio_hours:6.2f}h/流  RSS {sample['rss_mb']}MB  "
+                  f"每路流 {sample['per_stream_mb']}MB  误唤醒 {sample['false_alarms']}", flush=True)
+
+    wall_seconds = time.perf_counter() - wall_start
+    audio_hours = total_rounds * chunk_seconds / 3600 * args.streams
+    # 所有流同时前进，进程 RSS 的斜率是全部流合计的增长，按流数折算成每路流
+    slope = growth_slope(samples, args.warmup)
+    if slope is not None:
+        slope /= args.streams
+    summary = {
+        "streams": args.streams,
+        "audio_hours": round(audio_hours, 3),
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_x_realtime": round(audio_hours * 3600 / wall_seconds, 1) if wall_seconds else None,
+        "kws_rtf": round(kws_seconds / (audio_hours * 3600), 5) if audio_hours else None,
+        "vad_rtf": round(vad_seconds / (audio_hours * 3600), 5) if audio_hours and vads else None,
+        "false_alarms": sum(false_alarms.values()),
+        "false_alarms_per_hour": round(sum(false_alarms.values()) / audio_hours, 3) if audio_hours else None,
+        "false_alarms_by_keyword": dict(false_alarms),
+        "rss_models_mb": round(rss_models, 2) if rss_models is not None else None,
+        "rss_streams_mb": round(rss_streams, 2) if rss_streams is not None else None,
+        "rss_final_mb": samples[-1]["rss_mb"] if samples else None,
+        "rss_growth_mb_per_stream_hour": round(slope, 4) if slope is not None else None,
+    }
+
+    print(f"\n音频 {summary['audio_hours']}h，耗时 {summary['wall_seconds']}s，"
+          f"吞吐 {summary['throughput_x_realtime']}x 实时（KWS RTF {summary['kws_rtf']}，VAD RTF {summary['vad_rtf']}）")
+    print(f"误唤醒 {summary['false_alarms']} 次，{summary['false_alarms_per_hour']} 次/小时")
+    for keyword, count in false_alarms.most_common():
+        print(f"  {keyword}: {count}")
+    if slope is None:
+        print("内存增长斜率: 采样点不足")
+    else:
+        print(f"内存增长斜率: 每路流 {slope:+.3f}MB / 音频小时（预热后）")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(
+            {"summary": summary, "samples": samples, "detections": detections}, ensure_ascii=False, indent=2,
+        ), encoding="utf-8")
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,8 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 from loguru import logger
 
+from backend.config import EVENT_QUEUE_SIZE, EVENT_OVERFLOW_POLICY, EVENT_SEND_TIMEOUT
+from backend.core.event_bus import EventBus
 from backend.core.voice_assistant_pipeline import VoiceAssistantPipeline, PipelineEvent
 
 
@@ -23,8 +25,8 @@ class DebugVoiceAssistantAPI:
         self.active_connections: Dict[str, WebSocket] = {}
         self.audio_chunk_count = 0
         
-        # 设置流水线事件处理
-        self.pipeline.add_event_callback(self.on_pipeline_event)
+        # 事件总线：事件只序列化一次，每个客户端由独立的写任务发送
+        self.event_bus = EventBus(EVENT_QUEUE_SIZE, EVENT_OVERFLOW_POLICY, EVENT_SEND_TIMEOUT)
         
         # 设置路由
         self.setup_routes()
@@ -32,6 +34,11 @@ class DebugVoiceAssistantAPI:
     def setup_routes(self):
         """设置路由"""
         
+        @self.app.on_event("startup")
+        async def startup_event():
+            """预合成固定回复"""
+            await self.pipeline.prewarm()
+        
         @self.app.get("/")
         async def get_homepage():
             """返回调试页面"""
@@ -41,8 +48,19 @@ class DebugVoiceAssistantAPI:
         async def websocket_endpoint(websocket: WebSocket, client_id: str):
             """WebSocket端点"""
             await websocket.accept()
+            
+            if client_id in self.pipeline.sessions:
+                await websocket.close(code=1008, reason="客户端ID已存在")
+                return
+            
             self.active_connections[client_id] = websocket
             
+            # 为客户端创建独立会话（共享模型）
+            session = await self.pipeline.create_session(client_id)
+            self.event_bus.subscribe(client_id, websocket.send_text, topic=client_id)
+            session.add_event_callback(self.on_pipeline_event)
+            session.add_event_callback(self.event_bus.publish)
+            
             logger.info(f"🔗 客户端 {client_id} 已连接")
             
             try:
@@ -53,9 +71,9 @@ class DebugVoiceAssistantAPI:
                     "client_id": client_id
                 }))
                 
-                # 启动流水线
-                await self.pipeline.start_pipeline()
-                logger.info("🚀 流水线已启动")
+                # 启动会话
+                await session.start()
+                logger.info(f"🚀 会话 {client_id} 已启动")
                 
                 while True:
                     try:
@@ -66,6 +84,8 @@ class DebugVoiceAssistantAPI:
                             data = await websocket.receive_bytes()
                             self.audio_chunk_count += 1
                             logger.info(f"📥 收到音频数据: {len(data)} 字节")
+                        except WebSocketDisconnect:
+                            raise
                         except Exception as receive_error:
                             logger.error(f"❌ 接收字节数据失败: {receive_error}")
                             # 尝试接收文本数据
@@ -73,6 +93,8 @@ class DebugVoiceAssistantAPI:
                                 text_data = await websocket.receive_text()
                                 logger.info(f"📥 收到文本数据: {text_data}")
                                 continue
+                            except WebSocketDisconnect:
+                                raise
                             except Exception as text_error:
                                 logger.error(f"❌ 接收文本数据也失败: {text_error}")
                                 import traceback
@@ -96,35 +118,35 @@ class DebugVoiceAssistantAPI:
                         
                         # 处理音频数据
                         try:
-                            await self.pipeline.process_audio_chunk(audio_data)
+                            await session.process_audio_chunk(audio_data)
                         except Exception as pipeline_error:
                             logger.error(f"❌ 流水线处理错误: {pipeline_error}")
                             import traceback
                             logger.error(f"❌ 流水线错误详情: {traceback.format_exc()}")
                             # 继续处理，不中断连接
                         
-                        # 每10个音频块发送一次状态更新
+                        # 每10个音频块发送一次状态更新（积压时只保留最新一条）
                         if self.audio_chunk_count % 10 == 0:
-                            try:
-                                await websocket.send_text(json.dumps({
-                                    "type": "status_update",
-                                    "audio_chunks_processed": self.audio_chunk_count,
-                                    "pipeline_state": self.pipeline.state.value
-                                }))
-                            except Exception as send_error:
-                                logger.error(f"❌ 发送状态更新失败: {send_error}")
+                            self.event_bus.publish_message({
+                                "type": "status_update",
+                                "audio_chunks_processed": self.audio_chunk_count,
+                                "pipeline_state": session.state.value
+                            }, topic=client_id, coalesce_key="status_update")
                         
+                    except WebSocketDisconnect:
+                        raise
                     except Exception as e:
                         logger.error(f"❌ 处理音频数据时出错: {e}")
                         # 继续处理，不中断连接
                     
             except WebSocketDisconnect:
                 logger.info(f"🔌 客户端 {client_id} 断开连接")
-                await self.pipeline.stop_pipeline()
             except Exception as e:
                 logger.error(f"❌ WebSocket错误: {e}")
                 await websocket.close()
             finally:
+                await self.pipeline.close_session(client_id)
+                await self.event_bus.unsubscribe(client_id)
                 if client_id in self.active_connections:
                     del self.active_connections[client_id]
         
@@ -135,42 +157,13 @@ class DebugVoiceAssistantAPI:
                 "pipeline_status": self.pipeline.get_pipeline_status(),
                 "active_connections": len(self.active_connections),
                 "audio_chunks_processed": self.audio_chunk_count,
-                "connections": list(self.active_connections.keys())
+                "connections": list(self.active_connections.keys()),
+                "event_bus": self.event_bus.get_stats()
             }
     
     def on_pipeline_event(self, event: PipelineEvent):
-        """处理流水线事件"""
-        logger.info(f"📢 流水线事件: {event.event_type} - 状态: {event.state.value}")
-        
-        # 向所有连接的客户端广播事件
-        message = {
-            "type": "pipeline_event",
-            "event_type": event.event_type,
-            "data": event.data,
-            "state": event.state.value,
-            "timestamp": event.timestamp
-        }
-        
-        # 异步发送消息
-        asyncio.create_task(self.broadcast_message(message))
-    
-    async def broadcast_message(self, message: Dict[str, Any]):
-        """广播消息给所有连接的客户端"""
-        if not self.active_connections:
-            return
-        
-        disconnected_clients = []
-        
-        for client_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"❌ 发送消息到客户端 {client_id} 失败: {e}")
-                disconnected_clients.append(client_id)
-        
-        # 清理断开的连接
-        for client_id in disconnected_clients:
-            del self.active_connections[client_id]
+        """记录流水线事件（发送由事件总线完成）"""
+        logger.info(f"📢 会话 {event.session_id} 流水线事件: {event.event_type} - 状态: {event.state.value}")
     
     def get_debug_html(self) -> str:
         """获取调试页面HTML"""
@@ -384,6 +377,10 @@ class DebugVoiceAssistantAPI:
                     // 显示具体信息
                     if (data.event_type === 'wake_word_detected') {
                         log(`🎯 检测到唤醒词: ${data.data.keyword}`, 'success');
+                    } else if (data.event_type === 'asr_partial') {
+                        log(`🎤 识别中: ${data.data.text}`, 'info');
+                    } else if (data.event_type === 'asr_final') {
+                        log(`🎤 识别完成: ${data.data.text}`, 'success');
                     } else if (data.event_type === 'intent_processing_started') {
                         log(`🧠 识别文本: ${data.data.text}`, 'info');
                     } else if (data.event_type === 'tts_started') {
@@ -20,11 +20,16 @@ class PipelineDemo:
     
     def __init__(self):
         self.pipeline = VoiceAssistantPipeline()
+        self.session = None
+    
+    async def setup(self):
+        """创建演示会话（VAD在线程中加载）"""
+        self.session = await self.pipeline.create_session("demo")
         self.setup_event_handlers()
     
     def setup_event_handlers(self):
         """设置事件处理器"""
-        self.pipeline.add_event_callback(self.on_pipeline_event)
+        self.session.add_event_callback(self.on_pipeline_event)
     
     def on_pipeline_event(self, event: PipelineEvent):
         """处理流水线事件"""
@@ -50,18 +55,18 @@ class PipelineDemo:
         # 模拟静音
         await asyncio.sleep(2.0)
         silence = np.zeros(1600, dtype=np.float32)  # 100ms静音
-        await self.pipeline.process_audio_chunk(silence)
+        await self.session.process_audio_chunk(silence)
         
         # 模拟唤醒词音频
         logger.info("🎤 模拟唤醒词音频...")
         wake_word_audio = np.random.normal(0, 0.1, 8000).astype(np.float32)  # 500ms音频
-        await self.pipeline.process_audio_chunk(wake_word_audio)
+        await self.session.process_audio_chunk(wake_word_audio)
         
         # 模拟语音音频
         await asyncio.sleep(1.0)
         logger.info("🎤 模拟语音音频...")
         speech_audio = np.random.normal(0, 0.15, 16000).astype(np.float32)  # 1s音频
-        await self.pipeline.process_audio_chunk(speech_audio)
+        await self.session.process_audio_chunk(speech_audio)
         
         # 等待处理完成
         await asyncio.sleep(5.0)
@@ -71,33 +76,31 @@ class PipelineDemo:
         logger.info("🚀 启动语音助手流水线演示")
         
         try:
-            # 启动流水线
-            pipeline_task = asyncio.create_task(self.pipeline.start_pipeline())
+            # 预合成固定回复
+            await self.pipeline.prewarm()
             
-            # 等待流水线启动
-            await asyncio.sleep(1.0)
+            # 启动会话（监督任务在后台运行）
+            await self.session.start()
             
             # 模拟音频输入
             await self.simulate_audio_input()
             
-            # 停止流水线
-            await self.pipeline.stop_pipeline()
-            
-            # 等待流水线任务完成
-            await pipeline_task
+            # 停止会话
+            await self.pipeline.close_session(self.session.session_id)
             
             logger.success("✅ 演示完成")
             
         except Exception as e:
             logger.error(f"❌ 演示出错: {e}")
-            await self.pipeline.stop_pipeline()
+            await self.pipeline.close_session(self.session.session_id)
     
     def print_pipeline_status(self):
         """打印流水线状态"""
         status = self.pipeline.get_pipeline_status()
         logger.info("📊 流水线状态:")
-        logger.info(f"  状态: {status['state']}")
-        logger.info(f"  运行中: {status['is_running']}")
+        logger.info(f"  会话状态: {self.session.state.value}")
+        logger.info(f"  运行中: {self.session.is_running}")
+        logger.info(f"  活跃会话数: {status['active_sessions']}")
         logger.info(f"  模块状态:")
         for module, info in status['modules'].items():
             logger.info(f"    {module}: {info}")
@@ -106,6 +109,7 @@ class PipelineDemo:
 async def main():
     """主函数"""
     demo = PipelineDemo()
+    await demo.setup()
     
     # 打印初始状态
     demo.print_pipeline_status()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+唤醒词参数网格评估工具
+在带标注的语料上遍历 boosting score、trigger threshold、max_active_paths、num_trailing_blanks，
+多进程并行解码，输出每个唤醒词的 DET 曲线（漏检率 / 每小时误唤醒）、每组参数的实时率，
+并为每个唤醒词推荐误唤醒率不超过上限时漏检率最低的配置。
+
+正样本清单每行 `音频路径 唤醒词`（路径相对清单所在目录），例如:
+    0.wav 你好小立
+    1.wav 小立同学
+
+用法:
+    python evaluate_keywords.py --manifest positives.txt --negatives noise/ recordings/ --workers 8
+    python evaluate_keywords.py --manifest positives.txt --negatives noise/ \\
+        --boosting 1.0,1.5,2.0 --thresholds 0.1,0.2,0.3 --max-active-paths 4,8 --output grid.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def print_curves(curves):
+    """打印每个唤醒词的 DET 曲线"""
+    for kw, kw_curves in curves.items():
+        print(f"\n== {kw} ==")
+        for curve, points in kw_curves.items():
+            print(f"  {curve}")
+            for p in points:
+                miss = "-" if p["miss_rate"] is None else f"{p['miss_rate'] * 100:5.1f}%"
+                fa = "-" if p["fa_per_hour"] is None else f"{p['fa_per_hour']:8.2f}"
+                print(f"    #{p['threshold']:<6g} 漏检 {miss:>6}  误唤醒/小时 {fa:>8}  RTF {p['rtf']:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="唤醒词参数网格评估")
+    parser.add_argument("--manifest", action="append", default=[], help="正样本清单（可多次指定）")
+    parser.add_argument("--negatives", nargs="*", default=[], help="负样本：WAV 文件、含 WAV 的目录或录音目录")
+    parser.add_argument("--keywords", help="参与评估的唤醒词，逗号分隔；默认为配置中的唤醒词加上清单中出现的唤醒词")
+    parser.add_argument("--boosting", default="0.5,1.0,1.5,2.0,3.0", help="boosting score 取值")
+    parser.add_argument("--thresholds", default="0.05,0.1,0.15,0.2,0.25,0.3,0.4,0.5", help="trigger threshold 取值")
+    parser.add_argument("--max-active-paths", default="4", help="max_active_paths 取值")
+    parser.add_argument("--trailing-blanks", default="1", help="num_trailing_blanks 取值")
+    parser.add_argument("--max-fa-per-hour", type=float, default=1.0, help="推荐配置允许的每小时误唤醒上限")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument("--model-dir", help="模型目录，默认使用配置中的目录")
+    parser.add_argument("--output", help="把完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+
+    from backend.config import CUSTOM_KEYWORDS
+    from backend.core.keyword_grid import (
+        build_grid, det_curves, evaluate_grid, keyword_text, load_manifest, load_negatives, recommend,
+        unscored_false_alarms,
+    )
+
+    items = [item for manifest in args.manifest for item in load_manifest(manifest)]
+    items += load_negatives(args.negatives)
+    if not any(item.label for item in items):
+        print("没有正样本，请用 --manifest 指定正样本清单")
+        return 1
+
+    if args.keywords:
+        keywords = [keyword_text(kw) for kw in args.keywords.split(",") if kw.strip()]
+    else:
+        keywords = [keyword_text(kw) for kw in CUSTOM_KEYWORDS]
+        keywords += sorted({item.label for item in items if item.label} - set(keywords))
+
+    grid = build_grid(
+        parse_list(args.max_active_paths, int), parse_list(args.trailing_blanks, int),
+        parse_list(args.boosting, float), parse_list(args.thresholds, float),
+    )
+    workers = max(1, min(args.workers, len(grid)))
+
+    start_time = time.perf_counter()
+    scores = evaluate_grid(items, keywords, grid, workers, args.model_dir)
+    elapsed = time.perf_counter() - start_time
+
+    curves = det_curves(scores)
+    print_curves(curves)
+
+    best = recommend(scores, args.max_fa_per_hour)
+    unscored = unscored_false_alarms(scores)
+    print(f"\n推荐配置（误唤醒 ≤ {args.max_fa_per_hour:g}/小时 时漏检率最低）:")
+    for kw, choice in best.items():
+        if kw in unscored:
+            print(f"  {kw}: 没有负样本或其他唤醒词的音频，无法估计误唤醒率，不推荐参数（用 --negatives 提供负样本）")
+        elif choice is None:
+            print(f"  {kw}: 没有满足条件的参数")
+        else:
+            print(f"  \"{choice['config']}\",  # 漏检 {choice['miss_rate'] * 100:.1f}% "
+                  f"误唤醒 {choice['fa_per_hour']:.2f}/小时 "
+                  f"(max_active_paths={choice['max_active_paths']}, num_trailing_blanks={choice['num_trailing_blanks']})")
+    print(f"\n共 {len(grid)} 组参数，总耗时 {elapsed:.1f}s")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(
+            {"keywords": keywords, "scores": scores, "det_curves": curves, "recommended": best,
+             "unscored_false_alarms": unscored},
+            ensure_ascii=False, indent=2,
+        ), encoding="utf-8")
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+关键词编译器（backend 与 xiaoli 共用，只依赖标准库）
+"""
+from .compiler import (
+    TOKENS_TYPES,
+    CompiledKeyword,
+    CompileReport,
+    KeywordCompiler,
+    compile_file,
+    compile_keywords,
+    format_errors,
+    keyword_text,
+    parse_keyword,
+)
+
+__all__ = [
+    "TOKENS_TYPES",
+    "CompiledKeyword",
+    "CompileReport",
+    "KeywordCompiler",
+    "compile_file",
+    "compile_keywords",
+    "format_errors",
+    "keyword_text",
+    "parse_keyword",
+]
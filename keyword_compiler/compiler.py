@@ -0,0 +1,354 @@
+"""
+关键词编译器
+把唤醒词短语（可带 :boosting_score #trigger_threshold @显示文本）转换为 sherpa-onnx 关键词文件的一行 token 格式，
+并用 tokens.txt 的词表逐个校验 token，在引擎加载关键词文件之前报告出错的行。
+
+backend（KeywordSpotter、参数网格评估）和 xiaoli（KWSEngine、scripts/text2token.py）共用本模块，
+因此这里只依赖标准库，pypinyin / sentencepiece 在用到时才导入。大批量短语可以多进程编译；
+编译文件时在输出旁写一个缓存文件，记录每行的编译结果，再次编译时只处理新增或变化的行。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# 支持的建模单元（与 sherpa-onnx text2token 一致）
+TOKENS_TYPES = ("ppinyin", "fpinyin", "cjkchar", "bpe", "cjkchar+bpe")
+
+# 转换规则变化时递增，旧缓存随之失效
+COMPILER_VERSION = 1
+CACHE_SUFFIX = ".cache.json"
+
+# 少于该行数时不启动进程池（进程启动和导入 pypinyin 的开销比编译本身大）
+PARALLEL_MIN_LINES = 1000
+
+# CJK 统一表意文字 [U+4E00, U+9FFF]
+CJK_PATTERN = re.compile(r"([\u4e00-\u9fff])")
+
+
+def parse_keyword(text: str) -> Tuple[str, List[str]]:
+    """
+    把一行关键词拆成短语和附加项
+
+    Returns:
+        (短语, 附加项列表)，附加项为 :boosting_score、#trigger_threshold、@显示文本，顺序保持不变
+    """
+    phrase, extras = [], []
+    for part in text.split():
+        (extras if part[0] in ":#@" else phrase).append(part)
+    return " ".join(phrase), extras
+
+
+def keyword_text(keyword: str) -> str:
+    """唤醒词的显示文本（即检测结果中的 keyword）：有 @显示文本 时取它，否则取短语本身"""
+    phrase, extras = parse_keyword(keyword)
+    labels = [extra[1:] for extra in extras if extra[0] == "@"]
+    if labels:
+        return labels[-1]
+    return "".join(phrase.split()) if CJK_PATTERN.search(phrase) else phrase
+
+
+@dataclass(frozen=True)
+class CompiledKeyword:
+    """一行关键词的编译结果"""
+    source: str                  # 原始行
+    line: Optional[str]          # 关键词文件中的一行，出错时为None
+    error: Optional[str] = None  # 出错原因
+    lineno: int = 0              # 在输入中的行号（从1开始，未知时为0）
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class Vocabulary:
+    """tokens.txt 词表：token -> id 的哈希索引，以及文件内容的摘要（用于判断缓存是否失效）"""
+
+    def __init__(self, tokens_path):
+        self.path = Path(tokens_path)
+        data = self.path.read_bytes()
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.ids: Dict[str, int] = {}
+        for line in data.decode("utf-8").splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                self.ids[parts[0]] = int(parts[1])
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+@lru_cache(maxsize=8)
+def load_vocabulary(tokens_path: str) -> Vocabulary:
+    """加载词表（同一路径只读一次）"""
+    return Vocabulary(tokens_path)
+
+
+class KeywordCompiler:
+    """关键词编译器：短语转 token 并用词表校验"""
+
+    def __init__(self, tokens_path, tokens_type: str = "ppinyin", bpe_model: Optional[str] = None):
+        """
+        初始化编译器
+
+        Args:
+            tokens_path: 模型的 tokens.txt
+            tokens_type: 建模单元，见 TOKENS_TYPES
+            bpe_model: bpe.model 路径，tokens_type 含 bpe 时需要
+        """
+        if tokens_type not in TOKENS_TYPES:
+            raise ValueError(f"不支持的建模单元: {tokens_type}")
+        if "bpe" in tokens_type and not bpe_model:
+            raise ValueError(f"建模单元 {tokens_type} 需要 bpe 模型")
+        self.tokens_path = str(tokens_path)
+        self.tokens_type = tokens_type
+        self.bpe_model = bpe_model
+        self.vocabulary = load_vocabulary(self.tokens_path)
+        self._sp = None
+
+    @property
+    def fingerprint(self) -> Dict[str, Any]:
+        """决定编译结果的全部输入（词表内容、建模单元、转换规则和拼音库版本），任一变化时缓存失效"""
+        try:
+            from pypinyin import __version__ as pypinyin_version
+        except ImportError:
+            pypinyin_version = None
+        return {
+            "compiler_version": COMPILER_VERSION,
+            "vocabulary": self.vocabulary.digest,
+            "tokens_type": self.tokens_type,
+            "bpe_model": self.bpe_model,
+            "pypinyin": pypinyin_version,
+        }
+
+    def _pinyin(self, phrase: str) -> List[str]:
+        """与 sherpa-onnx text2token 相同的拼音切分：ppinyin 拆成声母和带调韵母，fpinyin 为整个带调拼音"""
+        from pypinyin import pinyin
+        from pypinyin.contrib.tone_convert import to_initials, to_finals_tone
+
+        syllables = [x[0] for x in pinyin("".join(phrase.split()))]
+        if self.tokens_type == "fpinyin":
+            return syllables
+        tokens = []
+        for syllable in syllables:
+            initial = to_initials(syllable, strict=False)
+            final = to_finals_tone(syllable, strict=False)
+            if not initial and not final:
+                tokens.append(syllable)
+            else:
+                tokens.extend(t for t in (initial, final) if t)
+        return tokens
+
+    def _bpe(self, text: str) -> List[str]:
+        if self._sp is None:
+            import sentencepiece as spm
+            self._sp = spm.SentencePieceProcessor()
+            self._sp.load(self.bpe_model)
+        return self._sp.encode_as_pieces(text)
+
+    def tokenize(self, phrase: str) -> List[str]:
+        """把短语转换为 token（不校验词表）"""
+        if self.tokens_type in ("ppinyin", "fpinyin"):
+            # 已经是 token 格式的短语（如 xiaoli 的 keyword_token.txt）原样保留
+            parts = phrase.split()
+            if not CJK_PATTERN.search(phrase) and all(p in self.vocabulary for p in parts):
+                return parts
+            return self._pinyin(phrase)
+        if self.tokens_type == "cjkchar":
+            return list("".join(phrase.split()))
+        if self.tokens_type == "bpe":
+            return self._bpe(phrase)
+        tokens = []
+        for piece in CJK_PATTERN.split(phrase):
+            if CJK_PATTERN.fullmatch(piece):
+                tokens.append(piece)
+            elif piece.strip():
+                tokens.extend(self._bpe(piece))
+        return tokens
+
+    def _check_extras(self, extras: List[str]) -> Optional[str]:
+        for extra in extras:
+            value = extra[1:]
+            if extra[0] == "@":
+                if not value:
+                    return "显示文本 @ 为空"
+                continue
+            try:
+                number = float(value)
+            except ValueError:
+                name = "boosting score" if extra[0] == ":" else "trigger threshold"
+                return f"{name} 不是数字: {extra}"
+            if extra[0] == "#" and not 0.0 <= number <= 1.0:
+                return f"trigger threshold 应在 0-1 之间: {extra}"
+        return None
+
+    def compile(self, source: str, lineno: int = 0) -> CompiledKeyword:
+        """
+        编译一行关键词
+
+        Args:
+            source: 关键词（格式: `短语 [:boosting_score] [#trigger_threshold] [@显示文本]`）
+            lineno: 在输入中的行号（用于报告）
+
+        Returns:
+            编译结果，出错时 line 为None、error 为原因
+        """
+        source = source.strip()
+        phrase, extras = parse_keyword(source)
+        if not phrase:
+            return CompiledKeyword(source, None, "缺少唤醒词短语", lineno)
+
+        error = self._check_extras(extras)
+        if error:
+            return CompiledKeyword(source, None, error, lineno)
+
+        try:
+            tokens = self.tokenize(phrase)
+        except ImportError as e:
+            return CompiledKeyword(source, None, f"缺少依赖: {e.name}（pip install pypinyin sentencepiece）", lineno)
+        if not tokens:
+            return CompiledKeyword(source, None, "短语没有可用的 token", lineno)
+
+        unknown = [t for t in tokens if t not in self.vocabulary]
+        if unknown:
+            return CompiledKeyword(source, None, f"词表中没有的 token: {' '.join(dict.fromkeys(unknown))}", lineno)
+
+        # 拼音类建模单元的检测结果只有 token，中文短语补上显示文本，便于结果显示和按集合过滤
+        if (self.tokens_type in ("ppinyin", "fpinyin") and CJK_PATTERN.search(phrase)
+                and not any(e[0] == "@" for e in extras)):
+            extras = extras + [f"@{keyword_text(phrase)}"]
+        return CompiledKeyword(source, " ".join(tokens + extras), None, lineno)
+
+
+# 工作进程中的编译器（由 _init_worker 创建）
+_worker_compiler: Optional[KeywordCompiler] = None
+
+
+def _init_worker(tokens_path: str, tokens_type: str, bpe_model: Optional[str]):
+    global _worker_compiler
+    _worker_compiler = KeywordCompiler(tokens_path, tokens_type, bpe_model)
+
+
+def _compile_in_worker(item: Tuple[str, int]) -> CompiledKeyword:
+    return _worker_compiler.compile(*item)
+
+
+def compile_keywords(keywords: Iterable[str], compiler: KeywordCompiler, workers: int = 1,
+                     cache: Optional[Dict[str, Tuple[Optional[str], Optional[str]]]] = None
+                     ) -> Tuple[List[CompiledKeyword], int]:
+    """
+    编译多行关键词（空行跳过）
+
+    Args:
+        keywords: 关键词行
+        compiler: 编译器
+        workers: 工作进程数，行数少于 PARALLEL_MIN_LINES 时在当前进程编译
+        cache: 原始行 -> (编译结果, 错误) 的缓存，命中的行不再编译；新编译的结果写回该字典
+
+    Returns:
+        (与输入顺序一致的编译结果, 实际编译的行数)
+    """
+    cache = {} if cache is None else cache
+    items = [(line.strip(), lineno) for lineno, line in enumerate(keywords, 1) if line.strip()]
+    pending = list(dict.fromkeys(source for source, _ in items if source not in cache))
+
+    if workers > 1 and len(pending) >= PARALLEL_MIN_LINES:
+        chunksize = max(1, len(pending) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(compiler.tokens_path, compiler.tokens_type, compiler.bpe_model)) as pool:
+            compiled = list(pool.map(_compile_in_worker, [(s, 0) for s in pending], chunksize=chunksize))
+    else:
+        compiled = [compiler.compile(source) for source in pending]
+    for result in compiled:
+        cache[result.source] = (result.line, result.error)
+
+    results = [CompiledKeyword(source, *cache[source], lineno) for source, lineno in items]
+    return results, len(pending)
+
+
+def format_errors(results: Iterable[CompiledKeyword]) -> str:
+    """出错行的报告（每行一条）"""
+    return "\n".join(
+        f"{f'第 {r.lineno} 行 ' if r.lineno else ''}`{r.source}`: {r.error}" for r in results if not r.ok
+    )
+
+
+@dataclass
+class CompileReport:
+    """编译一个关键词文件的结果"""
+    results: List[CompiledKeyword]
+    compiled: int                # 实际编译的行数（其余来自缓存）
+    output: Optional[str] = None
+    errors: List[CompiledKeyword] = field(init=False)
+
+    def __post_init__(self):
+        self.errors = [r for r in self.results if not r.ok]
+
+    @property
+    def reused(self) -> int:
+        return len(self.results) - self.compiled
+
+    def format_errors(self) -> str:
+        """出错行的报告（每行一条）"""
+        return format_errors(self.errors)
+
+
+def _load_cache(path: Path, fingerprint: Dict[str, Any]) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("fingerprint") != fingerprint:
+        logger.info(f"词表或编译规则已变化，忽略缓存 {path}")
+        return {}
+    return {source: tuple(entry) for source, entry in data.get("entries", {}).items()}
+
+
+def compile_file(text_path, output_path, compiler: KeywordCompiler, workers: int = 1,
+                 incremental: bool = True) -> CompileReport:
+    """
+    编译关键词文件：输出只包含编译成功的行，出错的行在报告中列出
+
+    Args:
+        text_path: 输入文件，每行一个关键词
+        output_path: 输出的关键词文件
+        compiler: 编译器
+        workers: 工作进程数
+        incremental: 是否使用输出旁的缓存文件（output_path + CACHE_SUFFIX），只编译新增或变化的行
+
+    Returns:
+        编译报告
+    """
+    output_path = Path(output_path)
+    cache_path = output_path.with_name(output_path.name + CACHE_SUFFIX)
+    fingerprint = compiler.fingerprint
+    cache = _load_cache(cache_path, fingerprint) if incremental else {}
+
+    lines = Path(text_path).read_text(encoding="utf-8").splitlines()
+    results, compiled = compile_keywords(lines, compiler, workers, cache)
+
+    # 先写临时文件再替换，引擎不会读到写了一半的关键词文件
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    tmp_path.write_text("".join(f"{r.line}\n" for r in results if r.ok), encoding="utf-8")
+    os.replace(tmp_path, output_path)
+
+    if incremental:
+        # 只保留当前输入中仍存在的行，删除的行不会让缓存无限增长
+        sources = {r.source for r in results}
+        entries = {source: list(entry) for source, entry in cache.items() if source in sources}
+        cache_path.write_text(json.dumps({"fingerprint": fingerprint, "entries": entries},
+                                         ensure_ascii=False), encoding="utf-8")
+
+    return CompileReport(results, compiled, str(output_path))
@@ -5,9 +5,10 @@ from datetime import datetime
 from typing import Optional
 
 import av
+import numpy as np
 from fractions import Fraction
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
-from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import MediaStreamError
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
@@ -29,6 +30,14 @@ ROOT = os.path.dirname(__file__)
 STATIC_DIR = os.path.join(ROOT, "static")
 SAMPLE_WAV = os.path.join(ROOT, 'sample.wav')
 
+KWS_SAMPLE_RATE = 16000
+KWS_AGGREGATE_SAMPLES = KWS_SAMPLE_RATE // 10  # 解码线程每次处理 100ms
+UPLINK_BUFFER_SECONDS = 2.0  # 解码跟不上时最多积压的上行音频，超出丢弃最旧的
+
+DOWNLINK_SAMPLE_RATE = 48000
+DOWNLINK_FRAME_SAMPLES = DOWNLINK_SAMPLE_RATE // 50  # 20ms 一帧
+DOWNLINK_BUFFER_SECONDS = 2.0  # 待播放 PCM 的上限，写满后 enqueue_pcm 等待播放腾出空间
+
 app = FastAPI()
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
@@ -78,6 +87,55 @@ def init_kws():
 app.state.kws = init_kws()
 
 
+class PcmRing:
+    """定长 PCM 环形缓冲：写满后覆盖最旧的样本，读写都不分配内存"""
+
+    def __init__(self, capacity: int, dtype=np.int16):
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=dtype)
+        self._read = 0
+        self._size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, samples: np.ndarray):
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            self.dropped += n - self.capacity
+            n = self.capacity
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            self._read = (self._read + overflow) % self.capacity
+            self._size -= overflow
+            self.dropped += overflow
+        start = (self._read + self._size) % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = samples[:first]
+        self._buf[:n - first] = samples[first:]
+        self._size += n
+
+    def read_into(self, out: np.ndarray) -> int:
+        """把最多 len(out) 个样本拷入 out，返回实际读取的样本数"""
+        n = min(len(out), self._size)
+        first = min(n, self.capacity - self._read)
+        out[:first] = self._buf[self._read:self._read + first]
+        out[first:n] = self._buf[:n - first]
+        self._read = (self._read + n) % self.capacity
+        self._size -= n
+        return n
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self._size
+
+    def clear(self):
+        self._read = 0
+        self._size = 0
+
+
 class ServerAudioSink(MediaStreamTrack):
     kind = "audio"
 
@@ -95,39 +153,134 @@ class ServerAudioSink(MediaStreamTrack):
         return frame
 
 
-class SilenceAudioTrack(MediaStreamTrack):
+class DownstreamAudioTrack(MediaStreamTrack):
+    """下行音频轨：播放写入 PCM 缓冲的音频（如 TTS），没有音频时输出静音
+
+    帧从预分配的帧池中轮流复用，recv 过程中不分配内存。发送端在编码完一帧后才会取下一帧，
+    所以帧池只需要几帧。
+    """
     kind = "audio"
 
-    def __init__(self, sample_rate: int = 48000, channels: int = 1):
+    POOL_SIZE = 3
+
+    def __init__(self, sample_rate: int = DOWNLINK_SAMPLE_RATE):
         super().__init__()
         self.sample_rate = sample_rate
-        self.channels = channels
-        self._ts = 0
+        self.frame_samples = sample_rate // 50
+        self.pcm = PcmRing(int(sample_rate * DOWNLINK_BUFFER_SECONDS))
+        self._space = asyncio.Event()
+        self._resamplers = {}
+
+        time_base = Fraction(1, sample_rate)
+        self._pool = []
+        for _ in range(self.POOL_SIZE):
+            frame = av.AudioFrame(format="s16", layout="mono", samples=self.frame_samples)
+            frame.sample_rate = sample_rate
+            frame.time_base = time_base
+            self._pool.append((frame, np.frombuffer(frame.planes[0], dtype=np.int16)))
+        self._next = 0
+
+        self._start: Optional[float] = None
+        self._pts = 0
+        self.frames_sent = 0
+        self.silent_frames = 0
 
     async def recv(self):
-        await asyncio.sleep(0.02)  # 20ms 帧间隔
-        samples = int(self.sample_rate * 0.02)  # 20ms
-        frame = av.AudioFrame(format="s16", layout="mono", samples=samples)
-        # 填充静音
-        for p in frame.planes:
-            p.update(b"\x00" * p.buffer_size)
-        frame.pts = self._ts
-        frame.sample_rate = self.sample_rate
-        frame.time_base = Fraction(1, self.sample_rate)
-        self._ts += samples
+        # 按 pts 对应的播放时间节拍发送；落后超过 100ms（如事件循环卡顿）时重新对齐，避免突发补发
+        if self._start is None:
+            self._start = time.monotonic()
+        else:
+            self._pts += self.frame_samples
+            wait = self._start + self._pts / self.sample_rate - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elif wait < -0.1:
+                self._start -= wait
+
+        frame, samples = self._pool[self._next]
+        self._next = (self._next + 1) % self.POOL_SIZE
+        n = self.pcm.read_into(samples)
+        if n < self.frame_samples:
+            samples[n:] = 0
+            if n == 0:
+                self.silent_frames += 1
+        if n:
+            self._space.set()
+        frame.pts = self._pts
+        self.frames_sent += 1
         return frame
 
+    async def enqueue_pcm(self, pcm, sample_rate: int = DOWNLINK_SAMPLE_RATE):
+        """
+        写入待播放的 16-bit 单声道 PCM（bytes 或 int16 数组），采样率不同时先重采样
+
+        缓冲写满时等待播放腾出空间，流式 TTS 可以边合成边写入。
+        """
+        if isinstance(pcm, (bytes, bytearray, memoryview)):
+            pcm = np.frombuffer(pcm, dtype=np.int16)
+        if sample_rate != self.sample_rate:
+            pcm = self._resample(pcm, sample_rate)
+
+        while len(pcm):
+            if self.pcm.free == 0:
+                self._space.clear()
+                await self._space.wait()
+                continue
+            n = min(self.pcm.free, len(pcm))
+            self.pcm.write(pcm[:n])
+            pcm = pcm[n:]
+
+    def _resample(self, pcm: np.ndarray, sample_rate: int) -> np.ndarray:
+        # 每个输入采样率保留一个重采样器，连续写入的分段之间不会出现断点
+        resampler = self._resamplers.get(sample_rate)
+        if resampler is None:
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=self.sample_rate)
+            self._resamplers[sample_rate] = resampler
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = sample_rate
+        out = [f.to_ndarray()[0] for f in resampler.resample(frame)]
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.int16)
+
+    def clear(self):
+        """丢弃尚未播放的音频（如被打断）"""
+        self.pcm.clear()
+        self._space.set()
+
+
+def load_sample_pcm() -> Optional[np.ndarray]:
+    """把 sample.wav 解码为下行采样率的单声道 PCM，作为 TTS 的替代"""
+    if not os.path.exists(SAMPLE_WAV):
+        return None
+    try:
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=DOWNLINK_SAMPLE_RATE)
+        chunks = []
+        with av.open(SAMPLE_WAV) as container:
+            for frame in container.decode(audio=0):
+                chunks.extend(f.to_ndarray()[0] for f in resampler.resample(frame))
+        chunks.extend(f.to_ndarray()[0] for f in resampler.resample(None))
+        return np.concatenate(chunks) if chunks else None
+    except Exception as e:
+        print("[PC] sample.wav decode error, replies will be silent:", e)
+        return None
+
+
+SAMPLE_PCM = load_sample_pcm()
+
 
 class Session:
     def __init__(self, ws: WebSocket):
         self.ws = ws
         self.pc = RTCPeerConnection()
-        self.player: Optional[MediaPlayer] = None
+        self.downstream: Optional[DownstreamAudioTrack] = None
         self.control_dc = None
         self._audio_task: Optional[asyncio.Task] = None
+        self._decode_task: Optional[asyncio.Task] = None
+        self._reply_task: Optional[asyncio.Task] = None
         self.kws_stream = app.state.kws.create_stream() if getattr(app.state, "kws", None) else None
         self._last_trigger_time = 0.0
-        self._down_attached = False
+        # 接收协程只重采样并写入 uplink，解码任务按 100ms 聚合后在线程池中解码
+        self.uplink = PcmRing(int(KWS_SAMPLE_RATE * UPLINK_BUFFER_SECONDS))
+        self._uplink_ready = asyncio.Event()
 
         # 注册事件回调
         self.pc.on("datachannel")(self._on_datachannel)
@@ -143,23 +296,25 @@ class Session:
             await self.ws.send_json({"type": "event", "data": data})
 
     async def close(self):
+        for task in (self._audio_task, self._decode_task, self._reply_task):
+            if task and not task.done():
+                task.cancel()
         await self.pc.close()
+        if self.uplink.dropped:
+            print(f"[AUDIO] uplink dropped {self.uplink.dropped} samples (decode fell behind)")
 
     def ensure_downstream_track(self):
-        if self._down_attached:
+        if self.downstream is not None:
             return
-        added = False
-        if os.path.exists(SAMPLE_WAV):
-            try:
-                self.player = MediaPlayer(SAMPLE_WAV)
-                if self.player.audio:
-                    self.pc.addTrack(self.player.audio)
-                    added = True
-            except Exception as e:
-                print("[PC] MediaPlayer error, fallback to silence:", e)
-        if not added:
-            self.pc.addTrack(SilenceAudioTrack())
-        self._down_attached = True
+        self.downstream = DownstreamAudioTrack()
+        self.pc.addTrack(self.downstream)
+
+    async def play_reply(self):
+        """播放回复音频；接入 TTS 后把合成的 PCM 分段写入 downstream.enqueue_pcm 即可"""
+        if self.downstream is None or SAMPLE_PCM is None:
+            return
+        self.downstream.clear()
+        await self.downstream.enqueue_pcm(SAMPLE_PCM)
 
     # --- event handlers ---
     def _on_datachannel(self, channel):
@@ -171,35 +326,68 @@ class Session:
     def _on_track(self, track):
         print("[PC] Track received:", track.kind)
         if track.kind == "audio":
-            async def consume_audio():
-                resampler = av.audio.resampler.AudioResampler(format="s16", layout="mono", rate=16000)
-                while True:
-                    try:
-                        frame = await track.recv()
-                        try:
-                            f16 = resampler.resample(frame)
-                            pcm = b"".join(p.to_bytes() for p in f16.planes)
-                            import numpy as _np
-                            samples = _np.frombuffer(pcm, dtype=_np.int16).astype(_np.float32) / 32768.0
-                            if self.kws_stream is not None and app.state.kws is not None:
-                                self.kws_stream.accept_waveform(16000, samples)
-                                while app.state.kws.is_ready(self.kws_stream):
-                                    app.state.kws.decode_stream(self.kws_stream)
-                                    result = app.state.kws.get_result(self.kws_stream)
-                                    kw = result if isinstance(result, str) else getattr(result, "keyword", "")
-                                    if kw:
-                                        now = time.monotonic()
-                                        if now - self._last_trigger_time > 1.5:
-                                            self._last_trigger_time = now
-                                            await self.send_event({"type": "kws", "keyword": kw, "ts": datetime.utcnow().isoformat()})
-                        except Exception:
-                            pass
-                    except Exception:
-                        break
-            self._audio_task = asyncio.create_task(consume_audio())
+            self._audio_task = asyncio.create_task(self._receive_audio(track))
+            if self.kws_stream is not None and self._decode_task is None:
+                self._decode_task = asyncio.create_task(self._decode_audio())
         # 确保已添加下行轨
         self.ensure_downstream_track()
 
+    async def _receive_audio(self, track):
+        """接收上行音频：只做重采样和写入缓冲，不等待推理"""
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=KWS_SAMPLE_RATE)
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                break
+            try:
+                for f16 in resampler.resample(frame):
+                    self.uplink.write(f16.to_ndarray()[0])
+            except Exception as e:
+                print("[AUDIO] resample error:", e)
+                continue
+            if len(self.uplink) >= KWS_AGGREGATE_SAMPLES:
+                self._uplink_ready.set()
+
+    async def _decode_audio(self):
+        """解码任务：按 100ms 聚合取出上行音频，在线程池中解码"""
+        loop = asyncio.get_running_loop()
+        pcm = np.empty(KWS_AGGREGATE_SAMPLES, dtype=np.int16)
+        samples = np.empty(KWS_AGGREGATE_SAMPLES, dtype=np.float32)
+        while True:
+            await self._uplink_ready.wait()
+            self._uplink_ready.clear()
+            while len(self.uplink) >= KWS_AGGREGATE_SAMPLES:
+                self.uplink.read_into(pcm)
+                np.multiply(pcm, 1.0 / 32768, out=samples)
+                try:
+                    # 等待解码完成后才复用 samples，解码线程不会读到被覆盖的数据
+                    kw = await loop.run_in_executor(None, self._decode_chunk, samples)
+                except Exception as e:
+                    print("[KWS] decode error:", e)
+                    continue
+                if kw:
+                    now = time.monotonic()
+                    if now - self._last_trigger_time > 1.5:
+                        self._last_trigger_time = now
+                        await self.send_event({"type": "kws", "keyword": kw, "ts": datetime.utcnow().isoformat()})
+                        if self._reply_task and not self._reply_task.done():
+                            self._reply_task.cancel()
+                        self._reply_task = asyncio.create_task(self.play_reply())
+
+    def _decode_chunk(self, samples: np.ndarray) -> str:
+        """在线程池中运行：送入一段音频并解码，返回检测到的关键词"""
+        kws = app.state.kws
+        self.kws_stream.accept_waveform(KWS_SAMPLE_RATE, samples)
+        while kws.is_ready(self.kws_stream):
+            kws.decode_stream(self.kws_stream)
+            result = kws.get_result(self.kws_stream)
+            kw = result if isinstance(result, str) else getattr(result, "keyword", "")
+            if kw:
+                kws.reset_stream(self.kws_stream)
+                return kw
+        return ""
+
     def _on_ice_state(self):
         print("ICE state:", self.pc.iceConnectionState)
 
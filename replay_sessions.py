@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+会话回放工具
+把录音（RECORDING_DIR 下的会话目录）或 WAV 文件按线上的分块和到达时间回放给关键词检测或语音助手流水线，
+默认在虚拟时钟上尽快回放，多个会话用多进程并行。用于在上线前用真实流量验证性能改动。
+
+用法:
+    python replay_sessions.py recordings/ --workers 4
+    python replay_sessions.py models/*/test_wavs --target pipeline --output replay.json
+    python replay_sessions.py recordings/20250101-120000-client_3 --realtime
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def summarize(results):
+    """打印每个会话的检测结果和整体实时率"""
+    for result in results:
+        name = Path(result["source"]).name
+        if "error" in result:
+            print(f"  {name:<40} 失败: {result['error']}")
+            continue
+
+        if result["target"] == "kws":
+            found = [d["keyword"] for d in result["results"]]
+        else:
+            found = [e["data"]["keyword"] for e in result["results"] if e["event_type"] == "wake_word_detected"]
+        expected = [d["keyword"] for d in result["expected"]]
+        match = "" if not expected else ("  ✅ 与录音一致" if found == expected else f"  ⚠️ 录音时: {expected}")
+        print(f"  {name:<40} {result['audio_seconds']:7.1f}s  RTF {result['rtf']:.4f}  检测: {found}{match}")
+
+    ok = [r for r in results if "error" not in r and r["rtf"] is not None]
+    if ok:
+        audio = sum(r["audio_seconds"] for r in ok)
+        print(f"\n共 {len(ok)} 个会话，音频 {audio:.1f}s，"
+              f"RTF 中位数 {statistics.median(r['rtf'] for r in ok):.4f}，最大 {max(r['rtf'] for r in ok):.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录音或 WAV 文件")
+    parser.add_argument("paths", nargs="+", help="录音目录、录音根目录、WAV 文件或含 WAV 的目录")
+    parser.add_argument("--target", choices=["kws", "pipeline"], default="kws", help="回放目标")
+    parser.add_argument("--realtime", action="store_true", help="按实时节奏回放（默认使用虚拟时钟尽快回放）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行回放的进程数")
+    parser.add_argument("--chunk-samples", type=int, default=None, help="WAV 切块大小，默认与目标的网页客户端一致")
+    parser.add_argument("--drain-seconds", type=float, default=10.0, help="流水线目标在音频结束后等待的时长")
+    parser.add_argument("--keyword-set", default=None, help="使用的唤醒词集合，默认使用录音时的集合")
+    parser.add_argument("--output", help="把完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    from backend.core.replay import find_sources, replay_many
+
+    sources = find_sources(args.paths)
+    if not sources:
+        print("没有找到可回放的录音或 WAV 文件")
+        return 1
+
+    workers = max(1, min(args.workers, len(sources)))
+    print(f"回放 {len(sources)} 个会话 -> {args.target}（{'实时' if args.realtime else '虚拟时钟'}，{workers} 个进程）")
+    start_time = time.perf_counter()
+    results = replay_many(
+        sources, args.target, args.realtime, workers,
+        chunk_samples=args.chunk_samples, drain_seconds=args.drain_seconds, keyword_set=args.keyword_set,
+    )
+    elapsed = time.perf_counter() - start_time
+
+    summarize(results)
+    print(f"总耗时 {elapsed:.1f}s")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
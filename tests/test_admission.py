@@ -0,0 +1,172 @@
+"""
+SessionLoad 降级阈值与 AdmissionController 准入排队测试
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.core.admission import (
+    SHED_DECIMATE,
+    SHED_DISCONNECT,
+    SHED_DROP_SILENCE,
+    SHED_NONE,
+    AdmissionController,
+    SessionLoad,
+)
+
+RATE = 100  # 每秒 100 个样本，积压时长 = 样本数 / 100
+
+SILENCE = np.zeros(10, dtype=np.float32)
+SPEECH = np.full(10, 0.5, dtype=np.float32)
+
+
+def make_load() -> SessionLoad:
+    return SessionLoad("s", sample_rate=RATE, drop_silence_lag=0.5, decimate_lag=1.5, disconnect_lag=5.0)
+
+
+@pytest.mark.parametrize("received, level", [
+    (49, SHED_NONE),
+    (50, SHED_DROP_SILENCE),
+    (149, SHED_DROP_SILENCE),
+    (150, SHED_DECIMATE),
+    (500, SHED_DISCONNECT),
+])
+def test_level_follows_lag_thresholds(received, level):
+    load = make_load()
+    load.on_received(received)
+    assert load.level == level
+
+
+def test_on_received_reports_only_level_changes():
+    load = make_load()
+    assert load.on_received(30) is None
+    assert load.on_received(30) == SHED_DROP_SILENCE
+    assert load.on_received(10) is None
+
+
+def test_recovery_has_hysteresis():
+    load = make_load()
+    load.on_received(160)
+    assert load.level == SHED_DECIMATE
+
+    # 积压降到 decimate 阈值以下但仍高于其一半（0.75s），保持当前级别
+    load.on_decoded(80)
+    assert load.level == SHED_DECIMATE
+    load.on_decoded(10)
+    assert load.level == SHED_DROP_SILENCE
+    load.on_decoded(70)
+    assert load.level == SHED_NONE
+    assert load.max_lag_seconds == 1.6
+
+
+def test_should_shed_by_level():
+    load = make_load()
+    assert not load.should_shed(SILENCE)
+    # 内存压力下即使没有积压也丢弃静音块
+    assert load.should_shed(SILENCE, memory_pressure=True)
+    assert not load.should_shed(SPEECH, memory_pressure=True)
+
+    load.on_received(60)
+    assert load.level == SHED_DROP_SILENCE
+    assert load.should_shed(SILENCE)
+    assert not load.should_shed(SPEECH)
+
+    load.on_received(120)
+    assert load.level == SHED_DECIMATE
+    shed = [load.should_shed(SPEECH) for _ in range(4)]
+    assert shed == [True, False, True, False]
+    assert load.shed_chunks == 4
+    assert load.shed_samples == 40
+
+
+async def test_admits_within_capacity_and_rejects_duplicates():
+    admission = AdmissionController(max_sessions=2)
+    load = await admission.acquire("a", sample_rate=RATE)
+    assert isinstance(load, SessionLoad) and load.sample_rate == RATE
+    assert await admission.acquire("b") is not None
+    with pytest.raises(ValueError):
+        await admission.acquire("a")
+    assert admission.is_full
+    assert admission.admitted == 2
+
+
+async def test_queued_sessions_are_admitted_in_order():
+    admission = AdmissionController(max_sessions=1, queue_size=2, queue_timeout=5.0)
+    await admission.acquire("a")
+    notified = []
+
+    async def on_queued(position):
+        notified.append(position)
+
+    b = asyncio.create_task(admission.acquire("b", on_queued=on_queued))
+    c = asyncio.create_task(admission.acquire("c", on_queued=on_queued))
+    await asyncio.sleep(0)
+    assert admission.waiting == 2
+    assert notified == [1, 2]
+
+    # 队列已满时直接拒绝，不通知排队
+    assert await admission.acquire("d", on_queued=on_queued) is None
+    assert admission.rejected == 1
+    assert notified == [1, 2]
+
+    admission.release("a")
+    assert await asyncio.wait_for(b, 1.0) is not None
+    assert not c.done()
+    admission.release("b", disconnected=True)
+    assert await asyncio.wait_for(c, 1.0) is not None
+    assert set(admission.active) == {"c"}
+    assert (admission.queued, admission.disconnected) == (2, 1)
+
+
+async def test_on_queued_not_called_when_admitted_directly():
+    admission = AdmissionController(max_sessions=1)
+    notified = []
+
+    async def on_queued(position):
+        notified.append(position)
+
+    assert await admission.acquire("a", on_queued=on_queued) is not None
+    assert notified == []
+
+
+async def test_queue_timeout():
+    admission = AdmissionController(max_sessions=1, queue_timeout=0.01)
+    await admission.acquire("a")
+    assert await admission.acquire("b") is None
+    assert admission.timed_out == 1
+    assert admission.waiting == 0
+
+
+async def test_cancelled_waiter_passes_slot_on():
+    admission = AdmissionController(max_sessions=1, queue_timeout=5.0)
+    await admission.acquire("a")
+    b = asyncio.create_task(admission.acquire("b"))
+    c = asyncio.create_task(admission.acquire("c"))
+    await asyncio.sleep(0)
+
+    # 名额已转交给 b，但 b 恢复运行前就被取消：名额继续转交给 c
+    admission.release("a")
+    b.cancel()
+    assert await asyncio.wait_for(c, 1.0) is not None
+    assert set(admission.active) == {"c"}
+    admission.release("c")
+    assert not admission.is_full
+
+
+async def test_duplicate_admitted_while_waiting_is_rejected():
+    admission = AdmissionController(max_sessions=2, queue_timeout=5.0)
+    await admission.acquire("a")
+    await admission.acquire("b")
+    first = asyncio.create_task(admission.acquire("x"))
+    second = asyncio.create_task(admission.acquire("x"))
+    await asyncio.sleep(0)
+
+    admission.release("a")
+    assert await asyncio.wait_for(first, 1.0) is not None
+    # 第二个连接排队期间同一ID已被接纳：恢复运行后拒绝，转交给它的名额不会泄漏
+    admission.release("b")
+    with pytest.raises(ValueError):
+        await asyncio.wait_for(second, 1.0)
+    assert set(admission.active) == {"x"}
+    assert not admission.is_full
@@ -0,0 +1,102 @@
+"""
+唤醒后的捕获 -> 流式识别流程测试（使用确定性假识别引擎）
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.core import voice_assistant_pipeline
+from backend.core.asr_engine import FakeASREngine, create_asr_engine
+from backend.core.audio_buffer import CaptureBuffer
+from backend.core.voice_assistant_pipeline import ASRModule
+
+SAMPLE_RATE = 16000
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def test_fake_stream_reveals_text_with_audio():
+    stream = FakeASREngine(["打开灯"], chars_per_second=4.0).create_stream()
+    assert stream.accept_waveform(silence(0.2)) == []
+    [partial] = stream.accept_waveform(silence(0.1))
+    assert (partial.text, partial.is_final) == ("打", False)
+    assert [r.text for r in stream.accept_waveform(silence(5.0))] == ["打开灯"]
+
+    final = stream.finish()
+    assert final.is_final and final.text == "打开灯"
+    assert final.audio_seconds == 5.3
+
+
+def test_fake_engine_cycles_transcripts():
+    engine = FakeASREngine(["一", "二"])
+    assert [engine.create_stream().finish().text for _ in range(3)] == ["一", "二", "一"]
+
+
+def test_fake_engine_is_opt_in(tmp_path):
+    assert isinstance(create_asr_engine("fake"), FakeASREngine)
+    with pytest.raises(RuntimeError):
+        create_asr_engine("sherpa", None)
+    with pytest.raises(RuntimeError):
+        create_asr_engine("sherpa", str(tmp_path / "missing"))
+    with pytest.raises(ValueError):
+        create_asr_engine("whisper", str(tmp_path))
+
+
+async def test_asr_module_unavailable_without_model(monkeypatch):
+    monkeypatch.setattr(voice_assistant_pipeline, "ASR_ENGINE", "sherpa")
+    monkeypatch.setattr(voice_assistant_pipeline, "ASR_MODEL_DIR", None)
+    asr = ASRModule()
+    assert not asr.is_available
+    assert asr.get_info()["available"] is False
+
+    capture = CaptureBuffer(SAMPLE_RATE, lookback_seconds=0.0, max_seconds=1.0)
+    capture.trigger()
+    with pytest.raises(RuntimeError):
+        await asr.start_recognition(capture.stream(), SAMPLE_RATE)
+    assert not asr.is_processing
+
+
+async def test_capture_streams_partials_until_endpoint():
+    asr = ASRModule(FakeASREngine(["今天天气怎么样"], chars_per_second=4.0))
+    capture = CaptureBuffer(SAMPLE_RATE, lookback_seconds=0.5, max_seconds=10.0)
+    partials = []
+
+    capture.append(silence(1.0))
+    capture.trigger()
+    recognition = asyncio.create_task(
+        asr.start_recognition(capture.stream(), SAMPLE_RATE, on_partial=partials.append))
+    for _ in range(10):
+        capture.append(silence(0.16))
+        await asyncio.sleep(0.01)
+    assert asr.is_processing
+    capture.close()
+
+    text = await asyncio.wait_for(recognition, 5.0)
+    assert text == "今天天气怎么样"
+    assert not asr.is_processing
+
+    # 回看音频（0.5s）先被送入识别，之后部分结果随实时音频逐步增长到完整文本
+    texts = [p.text for p in partials]
+    assert texts[0] == "今天"
+    assert texts[-1] == "今天天气怎么样"
+    assert all(b.startswith(a) and len(b) > len(a) for a, b in zip(texts, texts[1:]))
+    assert all(not p.is_final for p in partials)
+
+
+async def test_capture_closed_before_audio_has_no_partials():
+    asr = ASRModule(FakeASREngine(["播放音乐"], chars_per_second=4.0))
+    capture = CaptureBuffer(SAMPLE_RATE, lookback_seconds=0.0, max_seconds=10.0)
+    partials = []
+
+    capture.trigger()
+    recognition = asyncio.create_task(
+        asr.start_recognition(capture.stream(), SAMPLE_RATE, on_partial=partials.append))
+    await asyncio.sleep(0)
+    capture.close()
+
+    # 假引擎的最终结果总是完整文本；没有音频时不产生部分结果
+    assert await asyncio.wait_for(recognition, 5.0) == "播放音乐"
+    assert partials == []
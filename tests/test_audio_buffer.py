@@ -0,0 +1,135 @@
+"""
+AudioRechunker / CaptureBuffer 测试
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.core.audio_buffer import AudioRechunker, AudioRingBuffer, CaptureBuffer
+
+
+def ramp(start: int, n: int) -> np.ndarray:
+    """以绝对样本位置为值的音频，便于检查顺序和连续性"""
+    return np.arange(start, start + n, dtype=np.float32)
+
+
+def push_all(rechunker: AudioRechunker, sizes):
+    pos, out = 0, []
+    for size in sizes:
+        out.extend(c.copy() for c in rechunker.push(ramp(pos, size)))
+        pos += size
+    return out, pos
+
+
+def test_ring_buffer_read_wraps_and_truncates():
+    ring = AudioRingBuffer(8)
+    ring.write(ramp(0, 6))
+    ring.write(ramp(6, 5))
+    assert ring.oldest_pos == 3
+    views = ring.read(0, 100)
+    assert len(views) == 2
+    np.testing.assert_array_equal(np.concatenate(views), ramp(3, 8))
+
+
+def test_ring_buffer_rejects_non_positive_capacity():
+    with pytest.raises(ValueError):
+        AudioRingBuffer(0)
+
+
+@pytest.mark.parametrize("sizes", [[1] * 50, [3, 7, 11, 2, 40], [16, 16, 16], [100], [5, 0, 9, 33]])
+def test_rechunker_emits_whole_chunks_in_order(sizes):
+    rechunker = AudioRechunker(8)
+    chunks, total = push_all(rechunker, sizes)
+    emitted = sum(len(c) for c in chunks)
+
+    assert all(len(c) % 8 == 0 for c in chunks)
+    assert emitted == total // 8 * 8
+    assert rechunker.pending == total - emitted
+    np.testing.assert_array_equal(np.concatenate(chunks + rechunker.flush()), ramp(0, total))
+    assert rechunker.pending == 0
+
+
+def test_rechunker_first_chunk_is_larger():
+    rechunker = AudioRechunker(8, first_chunk_size=12)
+    assert rechunker.push(ramp(0, 10)) == []
+    first = rechunker.push(ramp(10, 4))
+    assert [len(c) for c in first] == [12]
+    assert rechunker.pending == 2
+    rest = rechunker.push(ramp(14, 14))
+    assert [len(c) for c in rest] == [8, 8]
+    assert rechunker.pending == 0
+    np.testing.assert_array_equal(np.concatenate(first + rest), ramp(0, 28))
+
+
+def test_rechunker_aligned_input_is_zero_copy():
+    rechunker = AudioRechunker(8)
+    samples = ramp(0, 24)
+    chunks = rechunker.push(samples)
+    assert len(chunks) == 1
+    assert np.shares_memory(chunks[0], samples)
+
+
+def test_rechunker_rejects_non_positive_chunk_size():
+    with pytest.raises(ValueError):
+        AudioRechunker(0)
+
+
+async def collect(stream):
+    return [view.copy() async for view in stream]
+
+
+async def test_capture_includes_lookback_and_live_audio():
+    capture = CaptureBuffer(sample_rate=10, lookback_seconds=1.0, max_seconds=5.0)
+    capture.append(ramp(0, 25))  # 只保留最近 1 秒（10 个样本）作为回看
+    assert not capture.is_capturing
+
+    capture.trigger()
+    assert capture.is_capturing
+    assert capture.captured_samples == 10
+
+    reader = asyncio.create_task(collect(capture.stream()))
+    await asyncio.sleep(0)
+    capture.append(ramp(25, 5))
+    await asyncio.sleep(0)
+    capture.append(ramp(30, 5))
+    capture.close()
+
+    views = await asyncio.wait_for(reader, 1.0)
+    np.testing.assert_array_equal(np.concatenate(views), ramp(15, 20))
+    assert not capture.is_capturing
+
+
+async def test_capture_closes_at_max_duration():
+    capture = CaptureBuffer(sample_rate=10, lookback_seconds=0.5, max_seconds=1.0)
+    capture.append(ramp(0, 5))
+    capture.trigger()
+    capture.append(ramp(5, 10))
+    assert not capture.is_capturing
+
+    views = await asyncio.wait_for(collect(capture.stream()), 1.0)
+    np.testing.assert_array_equal(np.concatenate(views), ramp(0, 15))
+
+
+async def test_capture_reset_ends_stream():
+    capture = CaptureBuffer(sample_rate=10, lookback_seconds=0.5, max_seconds=1.0)
+    capture.trigger()
+    reader = asyncio.create_task(collect(capture.stream()))
+    await asyncio.sleep(0)
+    capture.reset()
+    assert await asyncio.wait_for(reader, 1.0) == []
+    assert capture.captured_samples == 0
+
+
+async def test_capture_block_stays_valid_until_next_read():
+    capture = CaptureBuffer(sample_rate=10, lookback_seconds=0.5, max_seconds=1.0)
+    capture.append(ramp(0, 5))
+    capture.trigger()
+    stream = capture.stream(block_seconds=0.3)
+
+    block = await stream.__anext__()
+    np.testing.assert_array_equal(block, ramp(0, 3))
+    # 使用方解码期间写入的音频覆盖了整个环形缓冲区，已产出的块不受影响
+    capture.append(ramp(5, 30))
+    np.testing.assert_array_equal(block, ramp(0, 3))
+    await stream.aclose()
@@ -0,0 +1,127 @@
+"""
+EventBus 分发与队列满时的丢弃/合并策略测试
+"""
+import asyncio
+import json
+
+import pytest
+
+from backend.core.event_bus import COALESCE, DROP_OLDEST, EventBus, Subscriber
+
+
+async def never_send(text: str):
+    await asyncio.Event().wait()
+
+
+def make_subscriber(policy: str, max_queue: int = 3) -> Subscriber:
+    # 不启动写任务，只检查队列内容
+    return Subscriber("sub", never_send, None, max_queue, policy, send_timeout=1.0)
+
+
+def queued(subscriber: Subscriber):
+    return [text for _, text in subscriber._queue]
+
+
+def test_drop_oldest_when_full():
+    subscriber = make_subscriber(DROP_OLDEST)
+    for text in "abcde":
+        subscriber.offer(text, coalesce_key="partial")
+    assert queued(subscriber) == ["c", "d", "e"]
+    assert (subscriber.dropped, subscriber.coalesced) == (2, 0)
+    assert subscriber.queued_bytes == 3
+
+
+def test_coalesce_keeps_every_message_until_full():
+    subscriber = make_subscriber(COALESCE, max_queue=4)
+    for text in "abc":
+        subscriber.offer(text, coalesce_key="partial")
+    assert queued(subscriber) == ["a", "b", "c"]
+    assert subscriber.coalesced == 0
+
+
+def test_coalesce_replaces_oldest_same_key_when_full():
+    subscriber = make_subscriber(COALESCE)
+    subscriber.offer("p1", coalesce_key="partial")
+    subscriber.offer("wake", coalesce_key=None)
+    subscriber.offer("p2", coalesce_key="partial")
+    subscriber.offer("p3", coalesce_key="partial")
+    assert queued(subscriber) == ["wake", "p2", "p3"]
+    assert (subscriber.coalesced, subscriber.dropped) == (1, 0)
+
+
+def test_coalesce_falls_back_to_drop_oldest():
+    subscriber = make_subscriber(COALESCE)
+    for text in ("w1", "w2", "w3"):
+        subscriber.offer(text)
+    # 没有可合并的同键消息时丢弃最早的
+    subscriber.offer("p1", coalesce_key="partial")
+    subscriber.offer("w4")
+    assert queued(subscriber) == ["w3", "p1", "w4"]
+    assert (subscriber.coalesced, subscriber.dropped) == (0, 2)
+
+
+def test_closed_subscriber_ignores_messages():
+    subscriber = make_subscriber(DROP_OLDEST)
+    subscriber.closed = True
+    subscriber.offer("a")
+    assert queued(subscriber) == []
+
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        EventBus(policy="newest_only")
+
+
+async def test_publish_routes_by_topic_and_serializes_once():
+    bus = EventBus(max_queue=10)
+    received = {"all": [], "s1": [], "s2": []}
+
+    def sender(name):
+        async def send(text: str):
+            received[name].append(json.loads(text))
+        return send
+
+    bus.subscribe("all", sender("all"))
+    bus.subscribe("s1", sender("s1"), topic="s1")
+    bus.subscribe("s2", sender("s2"), topic="s2")
+
+    bus.publish_message({"n": 1}, topic="s1")
+    bus.publish_message({"n": 2}, topic="s2")
+    bus.publish_message({"n": 3}, topic="s3")
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    assert received == {
+        "all": [{"n": 1}, {"n": 2}, {"n": 3}],
+        "s1": [{"n": 1}],
+        "s2": [{"n": 2}],
+    }
+    assert bus.published == 3
+
+    await bus.unsubscribe("s1")
+    bus.publish_message({"n": 4}, topic="s1")
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert received["s1"] == [{"n": 1}]
+    assert "s1" not in bus.subscribers
+
+    for subscriber_id in list(bus.subscribers):
+        await bus.unsubscribe(subscriber_id)
+
+
+async def test_send_timeout_closes_connection():
+    closed = asyncio.Event()
+
+    async def close():
+        closed.set()
+
+    bus = EventBus(send_timeout=0.01)
+    subscriber = bus.subscribe("slow", never_send, close=close)
+    bus.publish_message({"n": 1})
+    await asyncio.wait_for(closed.wait(), 1.0)
+    assert subscriber.closed and subscriber.timeouts == 1
+
+    # 已关闭的订阅者不再接收消息
+    bus.publish_message({"n": 2})
+    assert bus.get_stats()["subscribers"]["slow"]["queued"] == 0
+    await bus.unsubscribe("slow")
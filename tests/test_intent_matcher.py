@@ -0,0 +1,77 @@
+"""
+AhoCorasickMatcher 与意图优先级测试
+"""
+import pytest
+
+from backend.core.intent_matcher import AhoCorasickMatcher, PatternMatch
+from backend.core.voice_assistant_pipeline import IntentModule
+
+
+def build(*patterns) -> AhoCorasickMatcher:
+    matcher = AhoCorasickMatcher()
+    for pattern in patterns:
+        matcher.add(pattern, pattern.upper())
+    return matcher.build()
+
+
+def test_finds_overlapping_matches_in_end_order():
+    matches = list(build("he", "she", "his", "hers").iter_matches("ushers"))
+    assert matches == [
+        PatternMatch(1, 4, "she", "SHE"),
+        PatternMatch(2, 4, "he", "HE"),
+        PatternMatch(2, 6, "hers", "HERS"),
+    ]
+
+
+def test_follows_failure_links_across_chinese_text():
+    matches = build("天气", "气温", "温度").iter_matches("今天气温度很高")
+    assert [(m.start, m.pattern) for m in matches] == [(1, "天气"), (2, "气温"), (3, "温度")]
+
+
+def test_no_match_and_empty_text():
+    matcher = build("开灯")
+    assert list(matcher.iter_matches("关闭空调")) == []
+    assert list(matcher.iter_matches("")) == []
+
+
+def test_add_and_match_preconditions():
+    matcher = AhoCorasickMatcher()
+    with pytest.raises(ValueError):
+        matcher.add("")
+    matcher.add("灯")
+    with pytest.raises(RuntimeError):
+        list(matcher.iter_matches("开灯"))
+    matcher.build()
+    with pytest.raises(RuntimeError):
+        matcher.add("空调")
+
+
+@pytest.fixture(scope="module")
+def intents() -> IntentModule:
+    return IntentModule()
+
+
+@pytest.mark.parametrize("text, intent", [
+    # 同时命中多个意图时按 intent_patterns 的顺序取优先级最高的，而不是最先出现的
+    ("播放一首关于下雨的歌", "weather"),
+    ("提醒我听歌", "music"),
+    ("开灯之前设个闹钟", "alarm"),
+    ("你好，打开空调", "smart_home"),
+    # 同一意图的多个关键词不影响结果
+    ("播放音乐", "music"),
+])
+async def test_intent_priority(intents, text, intent):
+    result = await intents.recognize_intent(text)
+    assert result["intent"] == intent
+    assert result["confidence"] == 0.9
+
+
+async def test_unmatched_text_falls_back_to_general(intents):
+    result = await intents.recognize_intent("随便说点什么")
+    assert (result["intent"], result["confidence"]) == ("general", 0.5)
+
+
+async def test_entities_take_first_occurrence(intents):
+    result = await intents.recognize_intent("关掉电视和空调")
+    assert result["entities"] == {"device": "电视"}
+    assert [(s["value"], s["start"], s["end"]) for s in result["entity_spans"]] == [("电视", 2, 4), ("空调", 5, 7)]
@@ -0,0 +1,103 @@
+"""
+关键词编译器的词表校验与附加项检查测试
+"""
+import json
+
+import pytest
+
+from keyword_compiler import (
+    KeywordCompiler,
+    compile_file,
+    compile_keywords,
+    format_errors,
+    keyword_text,
+    parse_keyword,
+)
+from keyword_compiler.compiler import CACHE_SUFFIX
+
+TOKENS = ["<blk>", "x", "iǎo", "l", "ì", "n", "ǐ", "h", "ǎo", "小", "莉"]
+
+
+@pytest.fixture
+def tokens_path(tmp_path):
+    path = tmp_path / "tokens.txt"
+    path.write_text("".join(f"{token} {i}\n" for i, token in enumerate(TOKENS)), encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def compiler(tokens_path) -> KeywordCompiler:
+    return KeywordCompiler(tokens_path, "ppinyin")
+
+
+def test_parse_keyword_and_display_text():
+    assert parse_keyword("x iǎo l ì :2.0 #0.3 @小莉") == ("x iǎo l ì", [":2.0", "#0.3", "@小莉"])
+    assert keyword_text("x iǎo l ì @小莉") == "小莉"
+    assert keyword_text("小 莉 :1.5") == "小莉"
+
+
+def test_compiles_chinese_phrase_with_display_text(compiler):
+    result = compiler.compile("小莉你好 :1.5 #0.25")
+    assert result.ok
+    assert result.line == "x iǎo l ì n ǐ h ǎo :1.5 #0.25 @小莉你好"
+
+
+def test_token_phrase_is_kept_as_is(compiler):
+    result = compiler.compile("x iǎo l ì @小莉")
+    assert (result.line, result.error) == ("x iǎo l ì @小莉", None)
+
+
+@pytest.mark.parametrize("source, error", [
+    (":1.5 @小莉", "缺少唤醒词短语"),
+    ("x iǎo :abc", "boosting score 不是数字: :abc"),
+    ("x iǎo #high", "trigger threshold 不是数字: #high"),
+    ("x iǎo #1.5", "trigger threshold 应在 0-1 之间: #1.5"),
+    ("x iǎo @", "显示文本 @ 为空"),
+])
+def test_rejects_malformed_extras(compiler, source, error):
+    result = compiler.compile(source)
+    assert not result.ok and result.line is None
+    assert result.error == error
+
+
+def test_reports_tokens_missing_from_vocabulary(tokens_path):
+    compiler = KeywordCompiler(tokens_path, "cjkchar")
+    assert compiler.compile("小莉").line == "小 莉"
+    result = compiler.compile("小莉莉呀呀 @小莉")
+    assert result.error == "词表中没有的 token: 呀"
+
+
+def test_rejects_unsupported_tokens_type(tokens_path):
+    with pytest.raises(ValueError):
+        KeywordCompiler(tokens_path, "phoneme")
+    with pytest.raises(ValueError):
+        KeywordCompiler(tokens_path, "bpe")
+
+
+def test_compile_keywords_keeps_order_and_line_numbers(compiler):
+    results, compiled = compile_keywords(["x iǎo", "", "x iǎo #2", "x iǎo"], compiler)
+    assert [(r.lineno, r.ok) for r in results] == [(1, True), (3, False), (4, True)]
+    # 重复的行只编译一次
+    assert compiled == 2
+    assert format_errors(results) == "第 3 行 `x iǎo #2`: trigger threshold 应在 0-1 之间: #2"
+
+
+def test_compile_file_writes_valid_lines_and_reuses_cache(compiler, tmp_path):
+    source = tmp_path / "keywords_raw.txt"
+    output = tmp_path / "keywords.txt"
+    source.write_text("x iǎo l ì @小莉\nn ǐ q ì\n", encoding="utf-8")
+
+    report = compile_file(source, output, compiler)
+    assert output.read_text(encoding="utf-8") == "x iǎo l ì @小莉\n"
+    assert [e.lineno for e in report.errors] == [2]
+    assert report.compiled == 2
+
+    source.write_text("x iǎo l ì @小莉\nn ǐ h ǎo\n", encoding="utf-8")
+    report = compile_file(source, output, compiler)
+    assert (report.compiled, report.reused) == (1, 1)
+    assert report.errors == []
+    assert output.read_text(encoding="utf-8") == "x iǎo l ì @小莉\nn ǐ h ǎo\n"
+
+    # 缓存只保留当前输入中的行
+    cache = json.loads((tmp_path / f"keywords.txt{CACHE_SUFFIX}").read_text(encoding="utf-8"))
+    assert set(cache["entries"]) == {"x iǎo l ì @小莉", "n ǐ h ǎo"}
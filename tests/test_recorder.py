@@ -0,0 +1,19 @@
+"""
+录音 PCM 换算测试
+"""
+import numpy as np
+
+from backend.core.recorder import from_pcm16, to_pcm16
+
+
+def test_pcm_round_trip_is_lossless():
+    pcm = np.array([-32768, -1, 0, 1, 12345, 32767], dtype=np.int16)
+    # 与 backend/main.py 一样按 32768 换算成 float32 后写盘，逐样本还原
+    np.testing.assert_array_equal(to_pcm16(pcm.astype(np.float32) / 32768.0), pcm)
+    np.testing.assert_array_equal(to_pcm16(from_pcm16(pcm)), pcm)
+
+
+def test_out_of_range_samples_are_clipped():
+    samples = np.array([-2.0, -1.0, 1.0, 2.0], dtype=np.float32)
+    np.testing.assert_array_equal(to_pcm16(samples), [-32768, -32768, 32767, 32767])
+    assert from_pcm16(np.array([-32768, 32767], dtype=np.int16)).tolist() == [-1.0, 32767 / 32768]
@@ -0,0 +1,9 @@
+"""
+CPU 线程分配方案（backend 与 xiaoli 共用，只依赖标准库）
+"""
+from .plan import ThreadPlan, make_plan
+
+__all__ = [
+    "ThreadPlan",
+    "make_plan",
+]
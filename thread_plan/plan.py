@@ -0,0 +1,57 @@
+"""
+CPU 线程分配方案
+根据 CPU 核数和预期并发计算同时进行的解码数量上限和每次解码的 intra-op 线程数，
+保证 "并发解码数 × 每次解码线程数" 不超过可用核数。
+
+backend（ThreadBudget）和 xiaoli（app.py 的解码信号量、KWSEngine 的线程数）共用本模块，因此只依赖标准库。
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class ThreadPlan:
+    """线程分配方案"""
+    cpu_count: int
+    reserved_cores: int
+    usable_cores: int
+    expected_concurrency: int
+    max_concurrent_decodes: int
+    kws_threads: int
+    asr_threads: int
+    vad_threads: int
+
+
+def make_plan(cpu_count: int, expected_concurrency: int, reserved_cores: int,
+              max_intra_op_threads: Optional[int] = None) -> ThreadPlan:
+    """
+    计算线程分配方案
+
+    并发多时每次解码只用 1 个线程、靠并发吃满核数；并发少时把剩余核数分给单次解码
+
+    Args:
+        cpu_count: CPU 核数
+        expected_concurrency: 预期同时活跃的音频流数量
+        reserved_cores: 预留给事件循环和网络 IO 的核数
+        max_intra_op_threads: 单次解码线程数上限，为None时不限制
+
+    Returns:
+        线程分配方案
+    """
+    usable = max(1, cpu_count - reserved_cores)
+    concurrency = max(1, expected_concurrency)
+    max_decodes = min(concurrency, usable)
+    intra_op = max(1, usable // max_decodes)
+    if max_intra_op_threads is not None:
+        intra_op = max(1, min(intra_op, max_intra_op_threads))
+
+    return ThreadPlan(
+        cpu_count=cpu_count,
+        reserved_cores=cpu_count - usable,
+        usable_cores=usable,
+        expected_concurrency=concurrency,
+        max_concurrent_decodes=max_decodes,
+        kws_threads=intra_op,
+        asr_threads=intra_op,
+        vad_threads=1,  # Silero VAD 模型很小，多线程没有收益
+    )
@@ -5,12 +5,24 @@
 import asyncio
 import json
 import numpy as np
-from typing import Dict, Any
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from typing import Dict, Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.responses import HTMLResponse
 from loguru import logger
 
-from backend.core.voice_assistant_pipeline import VoiceAssistantPipeline, PipelineEvent
+from backend.config import (
+    EVENT_QUEUE_SIZE, EVENT_OVERFLOW_POLICY, EVENT_SEND_TIMEOUT, SAMPLE_RATE,
+    WS_MAX_CONNECTIONS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT,
+    SHED_DROP_SILENCE_LAG, SHED_DECIMATE_LAG, SHED_DISCONNECT_LAG, SHED_SILENCE_RMS,
+    WS_HEARTBEAT_INTERVAL, WS_PONG_TIMEOUT, WS_IDLE_AUDIO_TIMEOUT
+)
+from backend.core.admission import AdmissionController, SHED_DISCONNECT
+from backend.core.event_bus import EventBus
+from backend.core.memory import get_memory_budget
+from backend.core.vad_detector import SileroVAD
+from backend.core.recorder import get_recorder
+from backend.core.session_reaper import SessionReaper
+from backend.core.voice_assistant_pipeline import VoiceAssistantPipeline
 
 
 class VoiceAssistantWebSocketAPI:
@@ -21,8 +33,17 @@ class VoiceAssistantWebSocketAPI:
         self.pipeline = VoiceAssistantPipeline()
         self.active_connections: Dict[str, WebSocket] = {}
         
-        # 设置流水线事件处理
-        self.pipeline.add_event_callback(self.on_pipeline_event)
+        # 事件总线：事件只序列化一次，每个客户端由独立的写任务发送
+        self.event_bus = EventBus(EVENT_QUEUE_SIZE, EVENT_OVERFLOW_POLICY, EVENT_SEND_TIMEOUT)
+        
+        # 准入控制：超过容量的客户端排队，排不上时拒绝
+        self.admission = AdmissionController(WS_MAX_CONNECTIONS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+        
+        # 心跳与空闲会话回收：半开连接和长时间没有音频的会话被关闭，由处理任务的 finally 释放会话
+        self.reaper = SessionReaper(WS_HEARTBEAT_INTERVAL, WS_PONG_TIMEOUT, WS_IDLE_AUDIO_TIMEOUT)
+        
+        # 固定回复的后台预合成任务（不阻塞启动，未完成前的请求照常合成）
+        self.prewarm_task: Optional[asyncio.Task] = None
         
         # 设置路由
         self.setup_routes()
@@ -30,6 +51,24 @@ class VoiceAssistantWebSocketAPI:
     def setup_routes(self):
         """设置路由"""
         
+        @self.app.on_event("startup")
+        async def startup_event():
+            """启动会话回收，后台预合成固定回复，测量每个会话的流和 VAD 的内存成本"""
+            self.reaper.start()
+            self.prewarm_task = asyncio.create_task(self._prewarm(), name="tts-prewarm")
+            memory_budget = get_memory_budget()
+            await asyncio.to_thread(memory_budget.measure, "kws_stream", self.pipeline.kws.warm_stream)
+            await asyncio.to_thread(memory_budget.measure, "vad", lambda: SileroVAD(self.pipeline.model_dir), 4)
+        
+        @self.app.on_event("shutdown")
+        async def shutdown_event():
+            """停止会话回收和未完成的预合成，写完未落盘的录音"""
+            await self.reaper.stop()
+            if self.prewarm_task and not self.prewarm_task.done():
+                self.prewarm_task.cancel()
+                await asyncio.gather(self.prewarm_task, return_exceptions=True)
+            await asyncio.to_thread(get_recorder().stop)
+        
         @self.app.get("/")
         async def get_homepage():
             """返回演示页面"""
@@ -39,97 +78,230 @@ class VoiceAssistantWebSocketAPI:
         async def websocket_endpoint(websocket: WebSocket, client_id: str):
             """WebSocket端点"""
             await websocket.accept()
-            self.active_connections[client_id] = websocket
             
-            logger.info(f"客户端 {client_id} 已连接")
+            if client_id in self.pipeline.sessions or client_id in self.admission.active:
+                await websocket.close(code=1008, reason="客户端ID已存在")
+                return
+            
+            # 连接参数 keyword_set 选择唤醒词集合（所有集合共用同一个模型）
+            keyword_set = websocket.query_params.get("keyword_set")
+            if keyword_set is not None and keyword_set not in self.pipeline.kws.keyword_sets:
+                await websocket.send_text(json.dumps({
+                    "type": "error",
+                    "message": f"未知的唤醒词集合: {keyword_set}"
+                }))
+                await websocket.close(code=1008, reason="未知的唤醒词集合")
+                return
+            
+            async def reject_memory():
+                """内存不足时拒绝连接"""
+                await websocket.send_text(json.dumps({
+                    "type": "overload",
+                    "reason": "memory",
+                    "message": "服务器内存不足，请稍后重试"
+                }))
+                await websocket.close(code=1013, reason="服务器内存不足")
+            
+            # 预计超出进程内存预算时直接拒绝，不进入排队；接纳时预留该会话的预计内存
+            memory_budget = get_memory_budget()
+            if not memory_budget.admit(client_id):
+                await reject_memory()
+                return
+            
+            queued = False
+            
+            async def notify_queued(position: int):
+                """只在确实进入等待队列时通知客户端（队列已满会直接拒绝，不发送）"""
+                nonlocal queued
+                queued = True
+                await websocket.send_text(json.dumps({
+                    "type": "overload",
+                    "reason": "queued",
+                    "position": position,
+                    "message": "服务器繁忙，正在排队"
+                }))
+            
+            # 排队期间同一ID的连接可能已被接纳，acquire 在接纳前再次检查并抛出 ValueError
+            load = None
+            try:
+                load = await self.admission.acquire(
+                    client_id,
+                    on_queued=notify_queued,
+                    sample_rate=SAMPLE_RATE,
+                    drop_silence_lag=SHED_DROP_SILENCE_LAG,
+                    decimate_lag=SHED_DECIMATE_LAG,
+                    disconnect_lag=SHED_DISCONNECT_LAG,
+                    silence_rms=SHED_SILENCE_RMS
+                )
+            except ValueError:
+                await websocket.close(code=1008, reason="客户端ID已存在")
+                return
+            finally:
+                # 未被接纳（含排队期间断开）时释放内存预留
+                if load is None:
+                    memory_budget.release(client_id)
+            if load is None:
+                await websocket.send_text(json.dumps({
+                    "type": "overload",
+                    "reason": "capacity",
+                    "message": "服务器繁忙，请稍后重试"
+                }))
+                await websocket.close(code=1013, reason="服务器繁忙")
+                return
+            
+            # 排队期间其他会话可能已占用内存，接纳后按当前 RSS 和预留重新检查
+            if queued and not memory_budget.admit(client_id):
+                self.admission.release(client_id)
+                await reject_memory()
+                return
             
+            shed = False
+            activity = None
+            recording = None
             try:
+                self.active_connections[client_id] = websocket
+                
+                # 为客户端创建独立会话（共享模型），事件经事件总线只发送给该客户端
+                session = await self.pipeline.create_session(client_id, load=load, keyword_set=keyword_set)
+                subscriber = self.event_bus.subscribe(
+                    client_id, websocket.send_text, topic=client_id,
+                    close=lambda: websocket.close(code=1011, reason="发送超时")
+                )
+                session.add_event_callback(self.event_bus.publish)
+                
+                # 内存记账：流和 VAD 的成本（启动时测得）+ 捕获缓冲区 + 音频积压 + 待发送消息
+                memory_budget.register(
+                    client_id,
+                    kws_stream=memory_budget.unit_cost("kws_stream"),
+                    vad=memory_budget.unit_cost("vad"),
+                    capture_buffer=session.capture.ring.nbytes,
+                    audio_queue=lambda: load.backlog_bytes,
+                    event_queue=lambda: subscriber.queued_bytes,
+                )
+                
+                # 按抽样比例录音，唤醒事件一并记录，便于离线回放对比
+                recording = get_recorder().start_session(client_id, keyword_set=keyword_set)
+                if recording is not None:
+                    def record_detection(event):
+                        if event.event_type == "wake_word_detected":
+                            recording.write_detection(event.data)
+                    session.add_event_callback(record_detection)
+                
+                logger.info(f"客户端 {client_id} 已连接")
+                
                 # 发送连接成功消息
                 await websocket.send_text(json.dumps({
                     "type": "connected",
                     "message": "连接成功",
-                    "client_id": client_id
+                    "client_id": client_id,
+                    "keyword_set": keyword_set
                 }))
                 
-                # 启动流水线
-                await self.pipeline.start_pipeline()
+                # 登记心跳与空闲检测，失效或空闲时由回收器关闭连接并取消本任务
+                activity = self.reaper.register(
+                    client_id,
+                    websocket.send_text,
+                    lambda code, reason: websocket.close(code=code, reason=reason)
+                )
+                
+                # 启动会话
+                await session.start()
                 
                 while True:
                     try:
-                        # 接收音频数据
-                        data = await websocket.receive_bytes()
+                        # 音频为二进制消息，文本消息只有心跳回复
+                        message = await websocket.receive()
+                        if message["type"] == "websocket.disconnect":
+                            raise WebSocketDisconnect(message.get("code", 1000))
+                        data = message.get("bytes")
+                        if data is None:
+                            if json.loads(message["text"]).get("type") == "pong":
+                                activity.on_message()
+                            continue
+                        activity.on_audio()
                         
                         # 将字节数据转换为numpy数组
                         audio_data = np.frombuffer(data, dtype=np.float32)
+                        if recording is not None:
+                            recording.write_audio(audio_data)
                         
                         # 添加调试日志
                         logger.debug(f"收到音频数据: {len(audio_data)} 样本, 范围: [{audio_data.min():.3f}, {audio_data.max():.3f}]")
                         
                         # 处理音频数据
-                        await self.pipeline.process_audio_chunk(audio_data)
+                        await session.process_audio_chunk(audio_data)
+                        
+                        if load.level == SHED_DISCONNECT:
+                            logger.warning(f"⚠️ 客户端 {client_id} 处理积压过高，断开连接")
+                            shed = True
+                            await websocket.close(code=1013, reason="处理积压过高")
+                            break
                         
+                    except WebSocketDisconnect:
+                        raise
                     except Exception as e:
                         logger.error(f"处理音频数据时出错: {e}")
                         # 继续处理，不中断连接
                     
             except WebSocketDisconnect:
                 logger.info(f"客户端 {client_id} 断开连接")
-                await self.pipeline.stop_pipeline()
+            except asyncio.CancelledError:
+                # 被回收器取消时正常结束，其他取消照常传播
+                if activity is None or activity.reap_reason is None:
+                    raise
+                logger.info(f"🧹 客户端 {client_id} 已回收: {activity.reap_reason}")
             except Exception as e:
                 logger.error(f"WebSocket错误: {e}")
                 await websocket.close()
             finally:
+                # 同步清理放在前面，等待关闭会话时本任务再被取消也不会漏掉
+                if activity is not None:
+                    self.reaper.unregister(client_id)
+                self.admission.release(client_id, disconnected=shed)
+                memory_budget.unregister(client_id)
+                if recording is not None:
+                    recording.close()
                 if client_id in self.active_connections:
                     del self.active_connections[client_id]
+                await self.pipeline.close_session(client_id)
+                await self.event_bus.unsubscribe(client_id)
         
         @self.app.get("/api/status")
         async def get_status():
             """获取流水线状态"""
-            return self.pipeline.get_pipeline_status()
+            status = self.pipeline.get_pipeline_status()
+            status["event_bus"] = self.event_bus.get_stats()
+            status["admission"] = self.admission.get_stats()
+            status["recorder"] = get_recorder().get_stats()
+            status["memory"] = get_memory_budget().get_stats()
+            status["reaper"] = self.reaper.get_stats()
+            return status
         
-        @self.app.post("/api/start")
-        async def start_pipeline():
-            """启动流水线"""
-            await self.pipeline.start_pipeline()
-            return {"message": "流水线已启动"}
+        @self.app.get("/api/admin/memory")
+        async def get_memory_stats():
+            """获取进程内存预算和各会话的内存记账"""
+            return get_memory_budget().get_stats()
         
-        @self.app.post("/api/stop")
-        async def stop_pipeline():
-            """停止流水线"""
-            await self.pipeline.stop_pipeline()
-            return {"message": "流水线已停止"}
-    
-    def on_pipeline_event(self, event: PipelineEvent):
-        """处理流水线事件"""
-        # 向所有连接的客户端广播事件
-        message = {
-            "type": "pipeline_event",
-            "event_type": event.event_type,
-            "data": event.data,
-            "state": event.state.value,
-            "timestamp": event.timestamp
-        }
+        @self.app.get("/api/sessions")
+        async def list_sessions():
+            """获取所有会话状态"""
+            return [session.get_status() for session in self.pipeline.sessions.values()]
         
-        # 异步发送消息
-        asyncio.create_task(self.broadcast_message(message))
+        @self.app.post("/api/sessions/{client_id}/stop")
+        async def stop_session(client_id: str):
+            """停止指定会话：关闭该客户端的连接，会话和资源由连接处理任务的 finally 统一释放"""
+            websocket = self.active_connections.get(client_id)
+            if websocket is None:
+                raise HTTPException(status_code=404, detail=f"会话不存在: {client_id}")
+            await websocket.close(code=1000, reason="会话已停止")
+            return {"message": f"会话 {client_id} 已停止"}
     
-    async def broadcast_message(self, message: Dict[str, Any]):
-        """广播消息给所有连接的客户端"""
-        if not self.active_connections:
-            return
-        
-        disconnected_clients = []
-        
-        for client_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"发送消息到客户端 {client_id} 失败: {e}")
-                disconnected_clients.append(client_id)
-        
-        # 清理断开的连接
-        for client_id in disconnected_clients:
-            del self.active_connections[client_id]
+    async def _prewarm(self):
+        """预合成固定回复，失败只记录日志"""
+        try:
+            await self.pipeline.prewarm()
+        except Exception as e:
+            logger.error(f"❌ 固定回复预合成失败: {e}")
     
     def get_demo_html(self) -> str:
         """获取演示页面HTML"""
@@ -259,8 +431,12 @@ class VoiceAssistantWebSocketAPI:
             ws.onmessage = function(event) {
                 const data = JSON.parse(event.data);
                 
-                if (data.type === 'connected') {
+                if (data.type === 'ping') {
+                    ws.send(JSON.stringify({ type: 'pong', timestamp: data.timestamp }));
+                } else if (data.type === 'connected') {
                     log(`连接成功，客户端ID: ${data.client_id}`, 'success');
+                } else if (data.type === 'overload') {
+                    log(`⚠️ 服务器过载: ${data.message}`, 'warning');
                 } else if (data.type === 'pipeline_event') {
                     log(`流水线事件: ${data.event_type} - ${data.state}`, 'info');
                     
@@ -288,11 +464,17 @@ class VoiceAssistantWebSocketAPI:
                     
                     // 显示具体信息
                     if (data.event_type === 'wake_word_detected') {
-                        log(`🎯 检测到唤醒词: ${data.data.keyword}`, 'success');
+                        log(`🎯 检测到唤醒词: ${data.data.keyword} (音频 ${data.data.start_time.toFixed(2)}s-${data.data.end_time.toFixed(2)}s, 算法延迟 ${data.data.algorithmic_latency_ms.toFixed(0)}ms)`, 'success');
+                    } else if (data.event_type === 'asr_partial') {
+                        log(`🎤 识别中: ${data.data.text}`, 'info');
+                    } else if (data.event_type === 'asr_final') {
+                        log(`🎤 识别完成: ${data.data.text}`, 'success');
                     } else if (data.event_type === 'intent_processing_started') {
                         log(`🧠 识别文本: ${data.data.text}`, 'info');
                     } else if (data.event_type === 'tts_started') {
                         log(`🔊 回复: ${data.data.response}`, 'success');
+                    } else if (data.event_type === 'overload') {
+                        log(`⚠️ 处理积压 ${data.data.lag_ms}ms，降级: ${data.data.level}`, 'warning');
                     }
                 }
             };
@@ -4,10 +4,13 @@ Real-time keyword spotting with WebSocket support for PCM audio streaming
 """
 
 import asyncio
+import itertools
 import json
 import base64
 import time
 import logging
+import os
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 import numpy as np
@@ -18,14 +21,32 @@ from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 import uvicorn
 
+from thread_plan import make_plan
+
 # Import KWS and VAD modules
 from .kws import KWSEngine
-from .vad import VADDetector
+from .session import KWSSession
+from .log_ring import LogRingHandler
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keep recent log records in a bounded ring for /api/logs and /ws/logs
+LOG_RING_CAPACITY = 2000
+LOG_BATCH_INTERVAL = 0.5  # seconds between /ws/logs batches
+LOG_BATCH_MAX = 500       # records per batch
+log_ring = LogRingHandler(capacity=LOG_RING_CAPACITY)
+logging.getLogger().addHandler(log_ring)
+
+# VAD + KWS run in worker threads so sessions do not serialize on the event
+# loop. The thread plan (shared with the backend) sizes both the number of
+# decodes at once and each decode's intra-op threads, so together they never
+# use more than the cores left over for the event loop
+EXPECTED_CONCURRENCY = int(os.getenv("EXPECTED_CONCURRENCY", "0")) or (os.cpu_count() or 1)
+thread_plan = make_plan(os.cpu_count() or 1, EXPECTED_CONCURRENCY, reserved_cores=1)
+decode_semaphore = asyncio.Semaphore(thread_plan.max_concurrent_decodes)
+
 # Pydantic models
 class AudioData(BaseModel):
     audio_data: str  # Base64 encoded PCM data
@@ -35,7 +56,11 @@ class AudioData(BaseModel):
 
 class DetectionResult(BaseModel):
     keyword: str
-    confidence: float
+    start_time: float  # Seconds into the session's audio
+    end_time: float
+    tokens: List[str]
+    decode_ms: float
+    algorithmic_latency_ms: float  # Audio received after the keyword ended
     timestamp: str
     processing_time: float
 
@@ -44,12 +69,19 @@ class Settings(BaseModel):
     score: float = 1.0
     max_active_paths: int = 4
     num_trailing_blanks: int = 1
-    num_threads: int = 2
+    num_threads: int = thread_plan.kws_threads
     provider: str = "cpu"
 
 class KeywordsRequest(BaseModel):
     keywords: List[str]
 
+# Named keyword sets a /ws/kws connection can pick with ?keyword_set=<name>.
+# All sets share the one loaded model; without the parameter a connection
+# uses the keywords file
+KEYWORD_SETS: Dict[str, List[str]] = {
+    "xiaoli": ["小莉", "你好小莉"],
+}
+
 class ConnectionManager:
     """Manages WebSocket connections"""
     
@@ -95,13 +127,72 @@ class ConnectionManager:
 # Global instances
 manager = ConnectionManager()
 kws_engine = None
-vad_detector = None
+log_broadcast_task = None
+
+# One session per /ws/kws connection, all sharing kws_engine
+sessions: Dict[str, KWSSession] = {}
+session_ids = itertools.count(1)
+
+# Model readiness, reported by /ready
+readiness = {
+    "ready": False,
+    "status": "starting",  # starting | loading | warming_up | ready | failed
+    "error": None,
+    "load_time_ms": None,
+    "warmup_time_ms": None,
+    "total_time_ms": None
+}
+
+async def load_kws_engine():
+    """Load the shared KWS engine once and warm it up before reporting ready"""
+    global kws_engine
+    
+    start_time = time.perf_counter()
+    try:
+        # Load off the event loop so /ready can answer while the model loads
+        readiness["status"] = "loading"
+        logger.info("Initializing KWS engine...")
+        engine = await asyncio.to_thread(KWSEngine, max_threads=thread_plan.kws_threads)
+        for name, keywords in KEYWORD_SETS.items():
+            await asyncio.to_thread(engine.add_keyword_set, name, keywords)
+        
+        readiness["status"] = "warming_up"
+        await asyncio.to_thread(engine.warmup)
+        
+        kws_engine = engine
+        readiness.update({
+            "ready": True,
+            "status": "ready",
+            "load_time_ms": engine.load_time_ms,
+            "warmup_time_ms": engine.warmup_time_ms,
+            "total_time_ms": (time.perf_counter() - start_time) * 1000
+        })
+        logger.info(f"KWS engine ready ({readiness['total_time_ms']:.0f}ms)")
+        
+    except Exception as e:
+        logger.error(f"Error initializing KWS engine: {e}")
+        # Don't raise, allow app to start without KWS
+        readiness.update({"status": "failed", "error": str(e)})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background tasks and load the KWS engine once per process"""
+    global log_broadcast_task
+    
+    log_broadcast_task = asyncio.create_task(broadcast_logs_loop())
+    model_task = asyncio.create_task(load_kws_engine())
+    
+    yield
+    
+    model_task.cancel()
+    log_broadcast_task.cancel()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Xiaoli KWS API",
     description="Real-time Keyword Spotting with WebSocket support",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Mount static files and templates
@@ -110,8 +201,6 @@ templates = Jinja2Templates(directory="xiaoli/templates")
 
 # Global state
 app_state = {
-    "is_processing": False,
-    "audio_buffer": [],
     "buffer_size": 1600,  # 100ms at 16kHz
     "stats": {
         "total_detections": 0,
@@ -124,39 +213,35 @@ app_state = {
         "score": 1.0,
         "max_active_paths": 4,
         "num_trailing_blanks": 1,
-        "num_threads": 2,
+        "num_threads": thread_plan.kws_threads,
         "provider": "cpu"
     },
     "keywords": ["小莉", "你好小莉"]
 }
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize KWS engine and VAD detector on startup"""
-    global kws_engine, vad_detector
-    
-    try:
-        # Initialize VAD detector first (simpler)
-        vad_detector = VADDetector()
-        logger.info("VAD detector initialized")
-        
-        # Initialize KWS engine (may take longer)
-        logger.info("Initializing KWS engine...")
-        kws_engine = KWSEngine()
-        logger.info("KWS engine initialized")
-        
-    except Exception as e:
-        logger.error(f"Error initializing components: {e}")
-        # Don't raise, allow app to start without KWS
-        kws_engine = None
-        vad_detector = None
-
 # WebSocket endpoints
 @app.websocket("/ws/kws")
 async def websocket_kws_endpoint(websocket: WebSocket):
     """WebSocket endpoint for KWS audio processing"""
     await manager.connect(websocket, "kws")
     
+    # ?keyword_set=<name> picks a keyword set; every set shares the model
+    keyword_set = websocket.query_params.get("keyword_set")
+    known_sets = kws_engine.keyword_sets if kws_engine else KEYWORD_SETS
+    if keyword_set is not None and keyword_set not in known_sets:
+        await manager.send_personal_message(
+            json.dumps({"type": "error", "message": f"Unknown keyword set: {keyword_set}"}),
+            websocket
+        )
+        manager.disconnect(websocket, "kws")
+        await websocket.close(code=1008, reason="Unknown keyword set")
+        return
+    
+    session = KWSSession(f"kws-{next(session_ids)}", kws_engine, app_state["buffer_size"],
+                         keyword_set=keyword_set)
+    sessions[session.session_id] = session
+    logger.info(f"Session {session.session_id} created ({len(sessions)} active)")
+    
     try:
         while True:
             # Receive data from client
@@ -165,21 +250,21 @@ async def websocket_kws_endpoint(websocket: WebSocket):
             
             if message.get("type") == "audio_data":
                 # Process audio data
-                await process_audio_data(message, websocket)
+                await process_audio_data(message, websocket, session)
             elif message.get("type") == "start_detection":
-                app_state["is_processing"] = True
+                # Pick up an engine that finished loading after connect
+                session.engine = kws_engine
+                session.start()
                 await manager.send_personal_message(
-                    json.dumps({"type": "detection_started", "message": "KWS detection started"}),
+                    json.dumps({
+                        "type": "detection_started",
+                        "message": "KWS detection started",
+                        "keyword_set": session.keyword_set
+                    }),
                     websocket
                 )
             elif message.get("type") == "stop_detection":
-                app_state["is_processing"] = False
-                app_state["audio_buffer"].clear()
-                
-                # Reset KWS stream
-                if kws_engine:
-                    kws_engine.reset_stream()
-                
+                session.stop()
                 await manager.send_personal_message(
                     json.dumps({"type": "detection_stopped", "message": "KWS detection stopped"}),
                     websocket
@@ -193,6 +278,10 @@ async def websocket_kws_endpoint(websocket: WebSocket):
             json.dumps({"type": "error", "message": str(e)}),
             websocket
         )
+    finally:
+        sessions.pop(session.session_id, None)
+        session.close()
+        logger.info(f"Session {session.session_id} closed ({len(sessions)} active)")
 
 @app.websocket("/ws/logs")
 async def websocket_logs_endpoint(websocket: WebSocket):
@@ -206,9 +295,25 @@ async def websocket_logs_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         manager.disconnect(websocket, "logs")
 
-async def process_audio_data(message: Dict[str, Any], websocket: WebSocket):
+async def broadcast_logs_loop():
+    """Push new log records to /ws/logs subscribers as batched deltas"""
+    cursor = log_ring.next_cursor
+    while True:
+        await asyncio.sleep(LOG_BATCH_INTERVAL)
+        if not manager.kws_rooms["logs"]:
+            cursor = log_ring.next_cursor
+            continue
+        
+        records, cursor = log_ring.read(cursor, LOG_BATCH_MAX)
+        if records:
+            await manager.broadcast_to_room(
+                json.dumps({"type": "log_batch", "logs": records, "cursor": cursor}),
+                "logs"
+            )
+
+async def process_audio_data(message: Dict[str, Any], websocket: WebSocket, session: KWSSession):
     """Process incoming audio data for keyword detection"""
-    if not app_state["is_processing"] or not kws_engine or not vad_detector:
+    if not session.is_processing or not kws_engine:
         return
     
     try:
@@ -226,78 +331,49 @@ async def process_audio_data(message: Dict[str, Any], websocket: WebSocket):
         # Normalize audio to [-1, 1] range
         audio_normalized = audio_array.astype(np.float32) / 32768.0
         
-        # Add to buffer
-        app_state["audio_buffer"].extend(audio_normalized.tolist())
+        # Buffer in the session and run VAD + KWS on every full chunk
+        try:
+            async with decode_semaphore:
+                results = await asyncio.to_thread(session.process, audio_normalized)
+        except Exception as kws_error:
+            logger.error(f"Error in VAD/KWS processing: {kws_error}")
+            import traceback
+            traceback.print_exc()
+            # Don't send error to client for every audio chunk to avoid spam
+            return
         
-        # Process when buffer is full
-        if len(app_state["audio_buffer"]) >= app_state["buffer_size"]:
-            # Get audio chunk
-            audio_chunk = np.array(
-                app_state["audio_buffer"][:app_state["buffer_size"]], 
-                dtype=np.float32
-            )
+        # A long backlog can hold several keywords; report each one
+        for result in results:
+            # Update aggregate statistics across sessions
+            app_state["stats"]["total_detections"] += 1
+            app_state["stats"]["successful_detections"] += 1
+            app_state["stats"]["last_detection"] = datetime.now().isoformat()
+            app_state["stats"]["processing_time"] = result["processing_time"]
             
-            # VAD detection
-            try:
-                logger.debug(f"Processing audio chunk: {len(audio_chunk)} samples")
-                
-                if vad_detector.is_speech(audio_chunk):
-                    logger.debug("Speech detected, running KWS")
-                    # KWS detection
-                    start_time = time.time()
-                    result = await kws_engine.stream_detect(audio_chunk)
-                    
-                    if result and result.get("keyword"):
-                        logger.info(f"Keyword detected: {result['keyword']}")
-                        # Update statistics
-                        app_state["stats"]["total_detections"] += 1
-                        app_state["stats"]["successful_detections"] += 1
-                        app_state["stats"]["last_detection"] = datetime.now().isoformat()
-                        
-                        # Calculate processing time
-                        processing_time = (time.time() - start_time) * 1000
-                        app_state["stats"]["processing_time"] = processing_time
-                        
-                        # Create detection result
-                        detection_result = {
-                            "type": "detection",
-                            "keyword": result["keyword"],
-                            "confidence": result["confidence"],
-                            "timestamp": datetime.now().isoformat(),
-                            "processing_time": processing_time
-                        }
-                        
-                        # Send result to client
-                        await manager.send_personal_message(
-                            json.dumps(detection_result),
-                            websocket
-                        )
-                        
-                        # Broadcast to logs room
-                        await manager.broadcast_to_room(
-                            json.dumps({
-                                "type": "log",
-                                "level": "info",
-                                "source": "kws",
-                                "message": f"Keyword detected: {result['keyword']} (confidence: {result['confidence']:.3f})",
-                                "timestamp": datetime.now().isoformat()
-                            }),
-                            "logs"
-                        )
-                        
-                        logger.info(f"Keyword detected: {result['keyword']} (confidence: {result['confidence']:.3f})")
-                    else:
-                        logger.debug("No keyword detected")
-                else:
-                    logger.debug("No speech detected")
-            except Exception as vad_error:
-                logger.error(f"Error in VAD/KWS processing: {vad_error}")
-                import traceback
-                traceback.print_exc()
-                # Don't send error to client for every audio chunk to avoid spam
+            # Create detection result
+            detection_result = {
+                "type": "detection",
+                "keyword": result["keyword"],
+                "start_time": result["start_time"],
+                "end_time": result["end_time"],
+                "tokens": result["tokens"],
+                "decode_ms": result["decode_ms"],
+                "algorithmic_latency_ms": result["algorithmic_latency_ms"],
+                "timestamp": datetime.now().isoformat(),
+                "processing_time": result["processing_time"]
+            }
+            
+            # Send result to client
+            await manager.send_personal_message(
+                json.dumps(detection_result),
+                websocket
+            )
             
-            # Clear processed buffer
-            app_state["audio_buffer"] = app_state["audio_buffer"][app_state["buffer_size"]:]
+            logger.info(
+                f"[{session.session_id}] Keyword detected: {result['keyword']} "
+                f"[{result['start_time']:.2f}s-{result['end_time']:.2f}s, "
+                f"algorithmic latency {result['algorithmic_latency_ms']:.0f}ms]"
+            )
             
     except Exception as e:
         logger.error(f"Error processing audio data: {e}")
@@ -354,11 +430,15 @@ async def logs_page(request: Request):
 async def save_settings(settings: Settings):
     """Save KWS settings"""
     try:
-        app_state["settings"].update(settings.dict())
+        new_settings = {**app_state["settings"], **settings.dict()}
+        # The engine caps num_threads at the thread plan; report what it uses
+        new_settings["num_threads"] = min(new_settings["num_threads"], thread_plan.kws_threads)
         
-        # Update KWS engine settings
+        # Update KWS engine settings (the engine reloads off the event loop)
         if kws_engine:
-            await kws_engine.update_settings(app_state["settings"])
+            await kws_engine.update_settings(new_settings)
+        
+        app_state["settings"] = new_settings
         
         return {"status": "success", "message": "Settings saved successfully"}
     except Exception as e:
@@ -369,28 +449,64 @@ async def save_settings(settings: Settings):
 async def save_keywords(keywords_req: KeywordsRequest):
     """Save keywords"""
     try:
-        app_state["keywords"] = keywords_req.keywords
-        
         # Update KWS engine keywords
         if kws_engine:
             await kws_engine.update_keywords(keywords_req.keywords)
         
+        app_state["keywords"] = keywords_req.keywords
+        
         return {"status": "success", "message": "Keywords saved successfully"}
+    except ValueError as e:
+        # Keywords that cannot be encoded; the engine was not reloaded
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error saving keywords: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/keyword_sets")
+async def get_keyword_sets():
+    """List the keyword sets /ws/kws connections can pick"""
+    if kws_engine:
+        return {name: list(ks.keywords) for name, ks in kws_engine.keyword_sets.items()}
+    return KEYWORD_SETS
+
+@app.put("/api/keyword_sets/{name}")
+async def save_keyword_set(name: str, keywords_req: KeywordsRequest):
+    """Add or replace a keyword set without reloading the engine"""
+    try:
+        if kws_engine:
+            await asyncio.to_thread(kws_engine.add_keyword_set, name, keywords_req.keywords)
+        KEYWORD_SETS[name] = keywords_req.keywords
+        
+        return {"status": "success", "message": f"Keyword set {name} saved"}
+    except ValueError as e:
+        # Empty set or keywords that cannot be encoded
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/logs")
-async def get_logs():
-    """Get recent logs"""
-    return get_recent_logs()
+async def get_logs(cursor: Optional[int] = None, limit: int = 100):
+    """Get logs starting at cursor (most recent logs when cursor is omitted)"""
+    limit = max(1, min(limit, LOG_RING_CAPACITY))
+    records, next_cursor = log_ring.read(cursor, limit)
+    return {
+        "logs": records,
+        "next_cursor": next_cursor,
+        "oldest_cursor": log_ring.oldest_cursor,
+        "latest_cursor": log_ring.next_cursor
+    }
 
 @app.delete("/api/logs")
 async def clear_logs():
     """Clear all logs"""
+    log_ring.clear()
     logger.info("Logs cleared")
     return {"status": "success", "message": "Logs cleared"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the KWS engine is loaded and warmed up"""
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
 @app.get("/api/stats")
 async def get_stats():
     """Get KWS statistics"""
@@ -400,37 +516,33 @@ async def get_stats():
 async def get_status():
     """Get system status"""
     return {
-        "is_processing": app_state["is_processing"],
+        "is_processing": any(s.is_processing for s in sessions.values()),
         "kws_engine_ready": kws_engine is not None,
-        "vad_detector_ready": vad_detector is not None,
         "active_connections": len(manager.active_connections),
-        "buffer_size": len(app_state["audio_buffer"])
+        "active_sessions": len(sessions),
+        "processing_sessions": sum(1 for s in sessions.values() if s.is_processing),
+        "buffer_size": sum(len(s.ring) for s in sessions.values())
     }
 
+@app.get("/api/sessions")
+async def get_sessions():
+    """Get per-session statistics"""
+    return {"sessions": [s.get_stats() for s in sessions.values()]}
+
 # Utility functions
 def get_recent_logs(limit: int = 100) -> List[Dict]:
-    """Get recent logs"""
-    logs = []
-    for i in range(min(limit, 20)):
-        logs.append({
-            "timestamp": datetime.now().isoformat(),
-            "level": "info",
-            "source": "kws",
-            "message": f"Log entry {i+1}",
-            "details": None
-        })
-    return logs
+    """Get recent logs, newest first"""
+    records, _ = log_ring.read(None, limit)
+    return records[::-1]
 
 def get_log_stats() -> Dict:
     """Get log statistics"""
-    return {
-        "total_logs": 100,
-        "info_logs": 80,
-        "warning_logs": 15,
-        "error_logs": 5,
+    stats = log_ring.get_stats()
+    stats.update({
         "kws_detections": app_state["stats"]["total_detections"],
         "avg_response_time": app_state["stats"]["processing_time"]
-    }
+    })
+    return stats
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -2,29 +2,102 @@
 Keyword Spotting Engine with streaming support
 """
 
+import asyncio
 import sherpa_onnx
 import numpy as np
 import logging
-from typing import Dict, List, Optional, Any
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Any, Tuple
 import os
 
+from keyword_compiler import KeywordCompiler, compile_keywords, format_errors, keyword_text
+
 logger = logging.getLogger(__name__)
 
+# The chunk-16 model consumes 32 feature frames (320ms) per decode
+DECODE_CHUNK_SECONDS = 0.32
+# Output frame spacing (10ms shift x 4 subsampling); timestamps mark frame starts
+TOKEN_FRAME_SECONDS = 0.04
+
+
+@dataclass
+class Detection:
+    """A keyword detection; times are seconds of audio fed to the stream"""
+    keyword: str
+    start_time: float
+    end_time: float
+    tokens: List[str] = field(default_factory=list)
+    detected_at: float = 0.0  # Audio fed to the stream when the keyword fired
+    decode_ms: float = 0.0
+
+
+@dataclass(frozen=True)
+class KeywordSet:
+    """
+    A named keyword list compiled once and shared by every stream that picks it
+    
+    sherpa-onnx appends per-stream keywords to the ones in the keywords file,
+    so the set's keywords are passed to the stream and detections of file
+    keywords outside the set are dropped.
+    """
+    name: str
+    keywords: Tuple[str, ...]
+    labels: FrozenSet[str]  # Display text of each keyword, as reported in results
+    stream_keywords: str    # Compiled lines joined with "/", for create_stream()
+
+
+class KWSStream:
+    """A sherpa-onnx stream plus the audio clock needed to place its results"""
+    
+    def __init__(self, stream, spotter, keyword_set: Optional[KeywordSet] = None):
+        self.stream = stream
+        # The spotter that created the stream; a stream is only ever decoded
+        # by its own spotter, even while a reload swaps in a new one
+        self.spotter = spotter
+        # None means every keyword in the keywords file
+        self.keyword_set = keyword_set
+        self.num_samples = 0
+        self.decoded_chunks = 0
+        # Result timestamps restart at every reset; remember where that was
+        self.segment_start = 0.0
+    
+    @property
+    def audio_seconds(self) -> float:
+        return self.num_samples / 16000
+    
+    @property
+    def decoded_seconds(self) -> float:
+        return self.decoded_chunks * DECODE_CHUNK_SECONDS
+
+
 class KWSEngine:
     """Keyword Spotting Engine with streaming capabilities"""
     
     def __init__(self, 
                  model_path: str = "xiaoli/model_data/kws",
-                 keywords_file: str = "xiaoli/model_data/kws/text/keyword_token.txt"):
+                 keywords_file: str = "xiaoli/model_data/kws/text/keyword_token.txt",
+                 max_threads: int = 1):
         self.model_path = model_path
         self.keywords_file = keywords_file
+        # Intra-op threads per decode allowed by the thread plan; several
+        # sessions decode at once, so num_threads is capped at this
+        self.max_threads = max(1, max_threads)
         self.kws = None
-        self.current_stream = None
         self.is_initialized = False
+        self._reload_lock = asyncio.Lock()
+        
+        # Per-stream keyword sets; adding one never reloads the spotter
+        self.keyword_sets: Dict[str, KeywordSet] = {}
         
-        # Audio accumulation buffer
-        self.audio_buffer = []
-        self.min_audio_length = 16000  # 1 second at 16kHz
+        # Bumped on every (re)initialization so sessions can tell when
+        # their streams belong to a spotter that has been replaced
+        self.generation = 0
+        
+        # Timings of the last load and warm-up, in milliseconds
+        self.load_time_ms = None
+        self.warmup_time_ms = None
         
         # Default settings
         self.settings = {
@@ -32,7 +105,7 @@ class KWSEngine:
             "score": 1.0,
             "max_active_paths": 4,
             "num_trailing_blanks": 1,
-            "num_threads": 2,
+            "num_threads": self.max_threads,
             "provider": "cpu"
         }
         
@@ -42,33 +115,41 @@ class KWSEngine:
     def _initialize(self):
         """Initialize the KWS engine"""
         try:
-            # Check if model files exist
-            if not self._check_model_files():
-                raise FileNotFoundError("KWS model files not found")
+            start_time = time.perf_counter()
             
-            # Initialize sherpa-onnx keyword spotter
-            self.kws = sherpa_onnx.keyword_spotter.KeywordSpotter(
-                tokens=os.path.join(self.model_path, "tokens.txt"),
-                encoder=os.path.join(self.model_path, "encoder-epoch-12-avg-2-chunk-16-left-64.onnx"),
-                decoder=os.path.join(self.model_path, "decoder-epoch-12-avg-2-chunk-16-left-64.onnx"),
-                joiner=os.path.join(self.model_path, "joiner-epoch-12-avg-2-chunk-16-left-64.onnx"),
-                keywords_file=self.keywords_file,
-                num_threads=self.settings["num_threads"],
-                provider=self.settings["provider"],
-                max_active_paths=self.settings["max_active_paths"],
-                num_trailing_blanks=self.settings["num_trailing_blanks"],
-                keywords_score=self.settings["score"],
-                keywords_threshold=self.settings["threshold"],
-            )
+            self.kws = self._create_spotter(self.settings, self.keywords_file)
             
             self.is_initialized = True
-            logger.info("KWS engine initialized successfully")
+            self.generation += 1
+            self.load_time_ms = (time.perf_counter() - start_time) * 1000
+            self.warmup_time_ms = None
+            logger.info(f"KWS engine initialized successfully ({self.load_time_ms:.0f}ms)")
             
         except Exception as e:
             logger.error(f"Error initializing KWS engine: {e}")
             self.is_initialized = False
             raise
     
+    def _create_spotter(self, settings: Dict[str, Any], keywords_file: str):
+        """Build a sherpa-onnx keyword spotter (blocking)"""
+        # Check if model files exist
+        if not self._check_model_files():
+            raise FileNotFoundError("KWS model files not found")
+        
+        return sherpa_onnx.keyword_spotter.KeywordSpotter(
+            tokens=os.path.join(self.model_path, "tokens.txt"),
+            encoder=os.path.join(self.model_path, "encoder-epoch-12-avg-2-chunk-16-left-64.onnx"),
+            decoder=os.path.join(self.model_path, "decoder-epoch-12-avg-2-chunk-16-left-64.onnx"),
+            joiner=os.path.join(self.model_path, "joiner-epoch-12-avg-2-chunk-16-left-64.onnx"),
+            keywords_file=keywords_file,
+            num_threads=min(settings["num_threads"], self.max_threads),
+            provider=settings["provider"],
+            max_active_paths=settings["max_active_paths"],
+            num_trailing_blanks=settings["num_trailing_blanks"],
+            keywords_score=settings["score"],
+            keywords_threshold=settings["threshold"],
+        )
+    
     def _check_model_files(self) -> bool:
         """Check if all required model files exist"""
         required_files = [
@@ -86,88 +167,199 @@ class KWSEngine:
         
         return True
     
-    async def stream_detect(self, audio_chunk: np.ndarray) -> Optional[Dict[str, Any]]:
+    def warmup(self, seconds: float = 1.0) -> float:
         """
-        Process audio chunk for keyword detection using accumulation
+        Run one decode over synthetic audio
+        
+        The first decode on a fresh spotter pays for ONNX Runtime allocations
+        and kernel selection; doing it here keeps that off the first request.
         
         Args:
-            audio_chunk: Audio data as numpy array (float32, normalized)
+            seconds: Length of synthetic audio to decode
             
         Returns:
-            Detection result dict or None
+            Warm-up time in milliseconds
+        """
+        if not self.is_initialized or self.kws is None:
+            raise RuntimeError("KWS engine not initialized")
+        
+        self.warmup_time_ms = self._warm(self.kws, seconds)
+        logger.info(f"KWS engine warmed up ({self.warmup_time_ms:.0f}ms)")
+        return self.warmup_time_ms
+    
+    @staticmethod
+    def _warm(kws, seconds: float = 1.0) -> float:
+        """Decode synthetic audio on a spotter; returns milliseconds"""
+        start_time = time.perf_counter()
+        
+        # Low-level noise followed by trailing silence so the decoder runs
+        # through several chunks without producing a detection
+        rng = np.random.default_rng(0)
+        noise = (rng.standard_normal(int(16000 * seconds)) * 0.01).astype(np.float32)
+        stream = kws.create_stream()
+        stream.accept_waveform(sample_rate=16000, waveform=noise)
+        stream.accept_waveform(sample_rate=16000, waveform=np.zeros(8000, dtype=np.float32))
+        while kws.is_ready(stream):
+            kws.decode_stream(stream)
+        kws.get_result(stream)
+        
+        return (time.perf_counter() - start_time) * 1000
+    
+    async def _reload(self, settings: Dict[str, Any], keywords_file: str):
+        """
+        Build and warm a replacement spotter off the event loop, then swap it in
+        
+        Sessions keep decoding on the current spotter until the swap; their
+        streams are recreated on the next chunk (see generation). If loading
+        fails the current spotter and settings stay in place.
+        """
+        start_time = time.perf_counter()
+        kws = await asyncio.to_thread(self._create_spotter, settings, keywords_file)
+        load_time_ms = (time.perf_counter() - start_time) * 1000
+        warmup_time_ms = await asyncio.to_thread(self._warm, kws)
+        
+        self.kws = kws
+        self.settings = settings
+        self.is_initialized = True
+        self.generation += 1
+        self.load_time_ms = load_time_ms
+        self.warmup_time_ms = warmup_time_ms
+        logger.info(f"KWS engine reloaded ({load_time_ms:.0f}ms load, {warmup_time_ms:.0f}ms warm-up)")
+    
+    def add_keyword_set(self, name: str, keywords: List[str]) -> KeywordSet:
+        """
+        Compile and register a named keyword set (replacing one of the same name)
+        
+        Streams that already use the old set keep it until they are recreated.
+        
+        Raises:
+            ValueError: if the set is empty or a keyword cannot be encoded
+        """
+        if not keywords:
+            raise ValueError(f"Keyword set {name} is empty")
+        lines = self.compile_keywords(keywords)
+        keyword_set = KeywordSet(
+            name=name,
+            keywords=tuple(keywords),
+            labels=frozenset(keyword_text(kw) for kw in keywords),
+            stream_keywords="/".join(lines),
+        )
+        self.keyword_sets[name] = keyword_set
+        logger.info(f"Keyword set {name}: {sorted(keyword_set.labels)}")
+        return keyword_set
+    
+    def create_stream(self, keyword_set: Optional[str] = None):
+        """
+        Create a new decoding stream on the shared spotter
+        
+        Each connection owns its stream; the model weights are shared.
+        
+        Args:
+            keyword_set: Name of a set added with add_keyword_set(), or None
+                for the keywords file
+        
+        Returns:
+            KWSStream, or None if the engine is not initialized
+        
+        Raises:
+            ValueError: if the keyword set is unknown
         """
         if not self.is_initialized or self.kws is None:
-            logger.warning("KWS engine not initialized")
             return None
+        if keyword_set is None:
+            return KWSStream(self.kws.create_stream(), self.kws)
+        if keyword_set not in self.keyword_sets:
+            raise ValueError(f"Unknown keyword set: {keyword_set}")
+        compiled = self.keyword_sets[keyword_set]
+        return KWSStream(self.kws.create_stream(compiled.stream_keywords), self.kws, compiled)
+    
+    def detect(self, stream: KWSStream, audio_chunk: np.ndarray) -> List[Detection]:
+        """
+        Feed an audio chunk to a stream and decode what is ready
+        
+        The stream keeps its own decoder state, so each chunk is fed exactly
+        once and nothing is buffered here. A long chunk can hold more than
+        one keyword; decoding continues after each hit so none is lost.
+        
+        Args:
+            stream: Stream returned by create_stream()
+            audio_chunk: Audio data as numpy array (float32, normalized)
+            
+        Returns:
+            Detections in order, with times on the stream's audio clock
+        """
+        detections = []
+        if not self.is_initialized or self.kws is None or stream is None:
+            return detections
+        kws = stream.spotter
         
         try:
-            # Ensure audio is in correct format
             if audio_chunk.dtype != np.float32:
                 audio_chunk = audio_chunk.astype(np.float32)
             
-            # Ensure audio is normalized
-            if np.max(np.abs(audio_chunk)) > 1.0:
-                audio_chunk = audio_chunk / np.max(np.abs(audio_chunk))
-            
-            # Add to accumulation buffer
-            self.audio_buffer.extend(audio_chunk.tolist())
-            
-            # Only process when we have enough audio
-            if len(self.audio_buffer) < self.min_audio_length:
-                logger.debug(f"Accumulating audio: {len(self.audio_buffer)}/{self.min_audio_length} samples")
-                return None
+            stream.stream.accept_waveform(sample_rate=16000, waveform=audio_chunk)
+            stream.num_samples += len(audio_chunk)
             
-            # Create stream if not exists
-            if self.current_stream is None:
-                self.current_stream = self.kws.create_stream()
-            
-            # Convert buffer to numpy array
-            accumulated_audio = np.array(self.audio_buffer, dtype=np.float32)
-            
-            # Feed accumulated audio data to stream
-            self.current_stream.accept_waveform(
-                sample_rate=16000,
-                waveform=accumulated_audio
-            )
-            
-            # Decode stream
-            self.kws.decode_stream(self.current_stream)
-            
-            # Check if keyword is detected
-            if self.kws.is_ready(self.current_stream):
-                keyword = self.kws.get_result(self.current_stream)
+            decode_ms = 0.0
+            while kws.is_ready(stream.stream):
+                start_time = time.perf_counter()
+                kws.decode_stream(stream.stream)
+                decode_ms += (time.perf_counter() - start_time) * 1000
+                stream.decoded_chunks += 1
+                
+                keyword = kws.get_result(stream.stream)
                 if keyword and keyword.strip():
-                    # Reset stream and buffer for next detection
-                    self.kws.reset_stream(self.current_stream)
-                    self.current_stream = None
-                    self.audio_buffer = []
-                    
-                    return {
-                        "keyword": keyword.strip(),
-                        "confidence": 0.8,  # Default confidence, sherpa-onnx doesn't provide this directly
-                        "timestamp": None  # Will be set by caller
-                    }
+                    keyword_set = stream.keyword_set
+                    if keyword_set is not None and keyword.strip() not in keyword_set.labels:
+                        # A keywords-file keyword outside this stream's set
+                        self.reset_stream(stream)
+                        continue
+                    detections.append(self._make_detection(stream, keyword.strip(), decode_ms))
+                    decode_ms = 0.0
+                    # Reset so the same keyword is not reported again
+                    self.reset_stream(stream)
             
-            # Keep only recent audio in buffer (sliding window)
-            if len(self.audio_buffer) > self.min_audio_length * 2:
-                self.audio_buffer = self.audio_buffer[-self.min_audio_length:]
-            
-            return None
+            return detections
             
         except Exception as e:
             logger.error(f"Error in KWS detection: {e}")
             import traceback
             traceback.print_exc()
-            return None
+            return detections
+    
+    def _make_detection(self, stream: KWSStream, keyword: str, decode_ms: float) -> Detection:
+        """Build a detection from the stream's result, on the stream's audio clock"""
+        tokens = list(stream.spotter.tokens(stream.stream))
+        timestamps = list(stream.spotter.timestamps(stream.stream))
+        decoded = stream.decoded_seconds
+        
+        if timestamps:
+            start_time = stream.segment_start + timestamps[0]
+            end_time = stream.segment_start + timestamps[-1] + TOKEN_FRAME_SECONDS
+        else:
+            start_time = end_time = decoded
+        
+        return Detection(
+            keyword=keyword,
+            start_time=min(start_time, decoded),
+            end_time=min(end_time, decoded),
+            tokens=tokens,
+            detected_at=stream.audio_seconds,
+            decode_ms=decode_ms,
+        )
     
     async def update_settings(self, new_settings: Dict[str, Any]):
-        """Update KWS engine settings"""
+        """Update KWS engine settings, reloading the spotter off the event loop"""
         try:
-            # Update settings
-            self.settings.update(new_settings)
-            
-            # Reinitialize engine with new settings
-            self._initialize()
+            async with self._reload_lock:
+                settings = {**self.settings, **new_settings}
+                if settings["num_threads"] > self.max_threads:
+                    logger.warning(
+                        f"num_threads={settings['num_threads']} exceeds the thread plan, "
+                        f"using {self.max_threads}"
+                    )
+                    settings["num_threads"] = self.max_threads
+                await self._reload(settings, self.keywords_file)
             
             logger.info("KWS settings updated successfully")
             
@@ -175,16 +367,44 @@ class KWSEngine:
             logger.error(f"Error updating KWS settings: {e}")
             raise
     
+    def compile_keywords(self, keywords: List[str]) -> List[str]:
+        """
+        Compile keywords to keywords-file lines with the shared keyword compiler
+        
+        Phrases may be Chinese text or already tokens, each optionally followed
+        by :boosting_score #trigger_threshold @display_text. Every token is
+        checked against the model's tokens.txt.
+        
+        Raises:
+            ValueError: listing every keyword that cannot be encoded
+        """
+        compiler = KeywordCompiler(os.path.join(self.model_path, "tokens.txt"))
+        results, _ = compile_keywords(keywords, compiler)
+        if any(not r.ok for r in results):
+            raise ValueError(f"Invalid keywords:\n{format_errors(results)}")
+        return [r.line for r in results]
+    
     async def update_keywords(self, keywords: List[str]):
-        """Update keywords list"""
+        """Update keywords list, reloading the spotter off the event loop"""
         try:
-            # Save keywords to file
-            with open(self.keywords_file, 'w', encoding='utf-8') as f:
-                for keyword in keywords:
-                    f.write(f"{keyword}\n")
+            # Validate before touching the file so a typo never costs an engine reload
+            lines = await asyncio.to_thread(self.compile_keywords, keywords)
             
-            # Reinitialize engine to load new keywords
-            self._initialize()
+            async with self._reload_lock:
+                # Load the new spotter from a temporary file and only replace
+                # the keywords file once it is in use
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self.keywords_file) or ".", suffix=".tmp"
+                )
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        for line in lines:
+                            f.write(f"{line}\n")
+                    await self._reload(self.settings, tmp_path)
+                    os.replace(tmp_path, self.keywords_file)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
             
             logger.info(f"Keywords updated: {keywords}")
             
@@ -202,25 +422,21 @@ class KWSEngine:
             "is_initialized": self.is_initialized,
             "model_path": self.model_path,
             "keywords_file": self.keywords_file,
-            "settings": self.settings
+            "generation": self.generation,
+            "load_time_ms": self.load_time_ms,
+            "warmup_time_ms": self.warmup_time_ms,
+            "settings": self.settings,
+            "keyword_sets": {name: list(ks.keywords) for name, ks in self.keyword_sets.items()}
         }
     
     def reset(self):
         """Reset the engine"""
         self.kws = None
-        self.current_stream = None
         self.is_initialized = False
         self._initialize()
     
-    def reset_stream(self):
-        """Reset current stream and audio buffer"""
-        if self.current_stream and self.kws:
-            self.kws.reset_stream(self.current_stream)
-        self.current_stream = None
-        self.audio_buffer = []
-
-# Global KWS engine instance
-kws_engine = KWSEngine()
-
-# Legacy compatibility
-kws = kws_engine.kws if kws_engine.is_initialized else None
\ No newline at end of file
+    def reset_stream(self, stream: KWSStream):
+        """Reset a stream's decoder state"""
+        if stream is not None and self.kws:
+            stream.spotter.reset_stream(stream.stream)
+            stream.segment_start = stream.decoded_seconds
@@ -0,0 +1,129 @@
+"""
+Bounded in-memory log ring
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Logger name suffix -> source shown on the logs page
+SOURCE_BY_LOGGER = {
+    "kws": "kws",
+    "vad": "vad",
+    "session": "audio",
+}
+
+LEVEL_NAMES = {
+    logging.DEBUG: "debug",
+    logging.INFO: "info",
+    logging.WARNING: "warning",
+    logging.ERROR: "error",
+    logging.CRITICAL: "error",
+}
+
+
+class LogRingHandler(logging.Handler):
+    """Logging handler that keeps the most recent records in a fixed-size ring"""
+    
+    def __init__(self, capacity: int = 1000, max_message_length: int = 2000,
+                 level: int = logging.NOTSET):
+        super().__init__(level)
+        self.capacity = capacity
+        self.max_message_length = max_message_length
+        
+        # Preallocated slots; record with sequence number n lives in slot n % capacity
+        self._slots: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._next_seq = 0
+        self._cleared_seq = 0
+        self._level_counts = {"debug": 0, "info": 0, "warning": 0, "error": 0}
+    
+    @property
+    def next_cursor(self) -> int:
+        """Cursor that will be assigned to the next record"""
+        return self._next_seq
+    
+    @property
+    def oldest_cursor(self) -> int:
+        """Cursor of the oldest record still held in the ring"""
+        return max(self._cleared_seq, self._next_seq - self.capacity)
+    
+    def emit(self, record: logging.LogRecord):
+        """Store a structured copy of the record (called under the handler lock)"""
+        try:
+            message = record.getMessage()
+            if len(message) > self.max_message_length:
+                message = message[:self.max_message_length] + "..."
+            
+            details = None
+            if record.exc_info:
+                details = logging.Formatter().formatException(record.exc_info)
+            
+            level = LEVEL_NAMES.get(record.levelno, "info")
+            entry = {
+                "id": self._next_seq,
+                "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+                "level": level,
+                "source": getattr(record, "source", None) or self._source(record.name),
+                "message": message,
+                "details": details,
+            }
+            
+            self._slots[self._next_seq % self.capacity] = entry
+            self._next_seq += 1
+            self._level_counts[level] += 1
+        except Exception:
+            self.handleError(record)
+    
+    @staticmethod
+    def _source(logger_name: str) -> str:
+        """Map logger name to a log source"""
+        return SOURCE_BY_LOGGER.get(logger_name.rsplit(".", 1)[-1], "system")
+    
+    def read(self, cursor: Optional[int] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Read records starting at cursor
+        
+        Args:
+            cursor: First record to return; None returns the most recent `limit` records.
+                    Cursors older than the ring are clamped to the oldest record.
+            limit: Maximum number of records
+            
+        Returns:
+            (records oldest first, cursor to pass to the next call)
+        """
+        self.acquire()
+        try:
+            end = self._next_seq
+            if cursor is None:
+                start = max(self.oldest_cursor, end - limit)
+            else:
+                start = min(max(cursor, self.oldest_cursor), end)
+            stop = min(end, start + limit)
+            records = [self._slots[seq % self.capacity] for seq in range(start, stop)]
+            return records, stop
+        finally:
+            self.release()
+    
+    def clear(self):
+        """Drop all records; cursors keep increasing so clients stay valid"""
+        self.acquire()
+        try:
+            self._slots = [None] * self.capacity
+            self._cleared_seq = self._next_seq
+            for level in self._level_counts:
+                self._level_counts[level] = 0
+        finally:
+            self.release()
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get per-level counts since the last clear"""
+        counts = dict(self._level_counts)
+        return {
+            "total_logs": sum(counts.values()),
+            "debug_logs": counts["debug"],
+            "info_logs": counts["info"],
+            "warning_logs": counts["warning"],
+            "error_logs": counts["error"],
+            "buffered_logs": self._next_seq - self.oldest_cursor,
+            "capacity": self.capacity,
+        }
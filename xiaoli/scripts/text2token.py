@@ -4,6 +4,13 @@
 This script encode the texts (given line by line through `text`) to tokens and
 write the results to the file given by ``output``.
 
+It uses the same keyword compiler as the backend KeywordSpotter
+(keyword_compiler/ at the repository root): every token is checked against tokens.txt,
+lines that cannot be encoded are reported with their line numbers and left out
+of the output, and the remaining lines keep their own extra items. Large phrase
+lists can be compiled across worker processes, and a cache next to the output
+(``<output>.cache.json``) means a re-run only compiles lines that changed.
+
 Usage:
 If the tokens_type is bpe:
 
@@ -31,10 +38,26 @@ python3 ./text2token.py \
           --bpe-model bpe.model \
           --output hotwords.txt
 
+Keyword spotting with the xiaoli model (ppinyin), 8 worker processes:
+
+python3 ./text2token.py \
+          --text keyword_with_scores.txt \
+          --tokens ../model_data/kws/tokens.txt \
+          --tokens-type ppinyin \
+          --output keyword_token.txt \
+          --workers 8
+
 """
 import argparse
+import os
+import sys
+import time
+from pathlib import Path
 
-from sherpa_onnx import text2token
+# Make the shared keyword_compiler package importable when run as a script
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from keyword_compiler import TOKENS_TYPES, KeywordCompiler, compile_file
 
 
 def get_args():
@@ -87,7 +110,7 @@ def get_args():
         "--tokens-type",
         type=str,
         required=True,
-        choices=["cjkchar", "bpe", "cjkchar+bpe", "fpinyin", "ppinyin"],
+        choices=list(TOKENS_TYPES),
         help="""The type of modeling units, should be cjkchar, bpe, cjkchar+bpe, fpinyin or ppinyin.
         fpinyin means full pinyin, each cjkchar has a pinyin(with tone).
         ppinyin means partial pinyin, it splits pinyin into initial and final,
@@ -107,39 +130,46 @@ def get_args():
         help="Path where the encoded tokens will be written to.",
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes used for large inputs.",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Recompile every line instead of reusing <output>.cache.json.",
+    )
+
     return parser.parse_args()
 
 
 def main():
     args = get_args()
 
-    texts = []
-    # extra information like boosting score (start with :), triggering threshold (start with #)
-    # original keyword (start with @)
-    extra_info = []
-    with open(args.text, "r", encoding="utf8") as f:
-        for line in f:
-            extra = []
-            text = []
-            toks = line.strip().split()
-            for tok in toks:
-                if tok[0] == ":" or tok[0] == "#" or tok[0] == "@":
-                    extra.append(tok)
-                else:
-                    text.append(tok)
-            texts.append(" ".join(text))
-            extra_info.append(extra)
-    encoded_texts = text2token(
-        texts,
-        tokens=args.tokens,
-        tokens_type=args.tokens_type,
-        bpe_model=args.bpe_model,
+    compiler = KeywordCompiler(args.tokens, args.tokens_type, args.bpe_model)
+    start_time = time.perf_counter()
+    report = compile_file(
+        args.text,
+        args.output,
+        compiler,
+        workers=args.workers,
+        incremental=not args.no_cache,
+    )
+    elapsed = time.perf_counter() - start_time
+
+    print(
+        f"{len(report.results) - len(report.errors)}/{len(report.results)} lines written to {args.output} "
+        f"({report.compiled} compiled, {report.reused} cached, {elapsed:.2f}s)"
     )
-    with open(args.output, "w", encoding="utf8") as f:
-        for i, txt in enumerate(encoded_texts):
-            txt += extra_info[i]
-            f.write(" ".join(txt) + "\n")
+    if report.errors:
+        print(f"{len(report.errors)} lines could not be encoded:", file=sys.stderr)
+        print(report.format_errors(), file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
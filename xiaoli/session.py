@@ -0,0 +1,246 @@
+"""
+Per-connection KWS sessions
+
+Each /ws/kws connection gets its own session: audio ring buffer, VAD state,
+KWS stream and statistics. The KWS model itself is shared through KWSEngine.
+"""
+
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Any
+import numpy as np
+
+from .vad import VADDetector
+
+logger = logging.getLogger(__name__)
+
+
+class AudioRing:
+    """Fixed-capacity float32 ring buffer that yields fixed-size chunks"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        self._read = 0
+        self._size = 0
+        self.overflowed_samples = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, samples: np.ndarray):
+        """Append samples, overwriting the oldest ones when full"""
+        n = len(samples)
+        if n >= self.capacity:
+            dropped = self._size + n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+            self._read = 0
+            self._size = 0
+        else:
+            dropped = max(0, self._size + n - self.capacity)
+            if dropped:
+                self._read = (self._read + dropped) % self.capacity
+                self._size -= dropped
+        self.overflowed_samples += dropped
+
+        start = (self._read + self._size) % self.capacity
+        first = min(n, self.capacity - start)
+        self._buffer[start:start + first] = samples[:first]
+        if first < n:
+            self._buffer[:n - first] = samples[first:]
+        self._size += n
+
+    def read_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        Yield and consume full chunks
+
+        Chunks that do not wrap around are zero-copy views, so each one must
+        be consumed before the next write.
+        """
+        while self._size >= chunk_size:
+            end = self._read + chunk_size
+            if end <= self.capacity:
+                chunk = self._buffer[self._read:end]
+            else:
+                chunk = np.concatenate((self._buffer[self._read:], self._buffer[:end - self.capacity]))
+            self._read = end % self.capacity
+            self._size -= chunk_size
+            yield chunk
+
+    def clear(self):
+        """Drop all buffered samples"""
+        self._read = 0
+        self._size = 0
+
+
+class KWSSession:
+    """Audio and detection state for a single client connection"""
+
+    def __init__(self,
+                 session_id: str,
+                 engine,
+                 chunk_size: int = 1600,     # 100ms at 16kHz
+                 buffer_chunks: int = 10,
+                 keyword_set: Optional[str] = None):
+        self.session_id = session_id
+        self.engine = engine
+        # Named keyword set on the shared engine; None uses the keywords file
+        self.keyword_set = keyword_set
+        self.chunk_size = chunk_size
+        self.is_processing = False
+
+        self.ring = AudioRing(chunk_size * buffer_chunks)
+        self.vad = VADDetector()
+        self.stream = None
+        self._stream_generation = None
+
+        # VAD skips silent chunks, so the stream hears less audio than the
+        # session received. Keep (stream end, session end) sample offsets of
+        # recently fed chunks to map stream times back to session times.
+        self._fed_chunks = deque(maxlen=64)
+
+        self.stats = {
+            "created_at": datetime.now().isoformat(),
+            "chunks_received": 0,
+            "samples_received": 0,
+            "chunks_processed": 0,
+            "speech_chunks": 0,
+            "total_detections": 0,
+            "processing_time": 0,
+            "last_detection": None
+        }
+
+    def _ensure_stream(self):
+        """Create the KWS stream, or recreate it after the engine reloaded"""
+        if self.engine is None:
+            return None
+        if self.stream is None or self._stream_generation != self.engine.generation:
+            self.stream = self.engine.create_stream(self.keyword_set)
+            self._stream_generation = self.engine.generation
+            self._fed_chunks.clear()
+        return self.stream
+
+    def _session_time(self, stream_time: float) -> float:
+        """Map a time on the stream's audio clock to seconds of session audio"""
+        stream_sample = stream_time * 16000
+        for stream_end, session_end in self._fed_chunks:
+            if stream_sample <= stream_end:
+                return max(0.0, session_end - (stream_end - stream_sample)) / 16000
+        if self._fed_chunks:
+            stream_end, session_end = self._fed_chunks[-1]
+            return session_end / 16000
+        return stream_time
+
+    def start(self):
+        """Start accepting audio"""
+        self.is_processing = True
+        logger.info(f"Session {self.session_id} started detection")
+
+    def stop(self):
+        """Stop accepting audio and drop buffered state"""
+        self.is_processing = False
+        self.reset()
+        logger.info(f"Session {self.session_id} stopped detection")
+
+    def reset(self):
+        """Clear buffered audio, VAD history and the KWS stream"""
+        self.ring.clear()
+        self.vad.reset()
+        if self.engine is None or self.stream is None:
+            return
+        if self._stream_generation != self.engine.generation:
+            # The stream belongs to a spotter that has been replaced; drop it
+            # and let _ensure_stream create one on the current spotter
+            self.stream = None
+            self._fed_chunks.clear()
+        else:
+            self.engine.reset_stream(self.stream)
+
+    def close(self):
+        """Release the stream and buffers"""
+        self.is_processing = False
+        self.ring.clear()
+        self.stream = None
+
+    def process(self, audio: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Buffer audio and run VAD + KWS over every full chunk
+
+        Args:
+            audio: Normalized float32 audio
+
+        Returns:
+            Detection result dicts for every keyword found, in order.
+            start_time/end_time are seconds into the session's audio and
+            algorithmic_latency_ms is the audio received after the keyword
+            ended before it was reported.
+        """
+        self.stats["chunks_received"] += 1
+        self.stats["samples_received"] += len(audio)
+        self.ring.write(audio)
+
+        stream = self._ensure_stream()
+        if stream is None:
+            return []
+
+        # Consecutive speech chunks are fed to the stream in one call, so a
+        # backlog of buffered audio costs one accept-and-decode pass
+        detections = []
+        run, run_end = [], 0
+        for chunk in self.ring.read_chunks(self.chunk_size):
+            self.stats["chunks_processed"] += 1
+            if self.vad.is_speech(chunk):
+                # The ring holds the newest samples, so this chunk ends where
+                # the buffered remainder begins
+                run.append(chunk)
+                run_end = self.stats["samples_received"] - len(self.ring)
+                continue
+            if run:
+                detections.extend(self._feed(stream, run, run_end))
+                run = []
+        if run:
+            detections.extend(self._feed(stream, run, run_end))
+
+        return detections
+
+    def _feed(self, stream, chunks, session_end: int) -> List[Dict[str, Any]]:
+        """Feed contiguous speech chunks ending at session_end to the stream"""
+        self.stats["speech_chunks"] += len(chunks)
+        audio = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        start_time = time.time()
+        results = self.engine.detect(stream, audio)
+        self._fed_chunks.append((stream.num_samples, session_end))
+        if not results:
+            return []
+
+        processing_time = (time.time() - start_time) * 1000
+        self.stats["total_detections"] += len(results)
+        self.stats["processing_time"] = processing_time
+        self.stats["last_detection"] = datetime.now().isoformat()
+        detections = []
+        for result in results:
+            end_time = self._session_time(result.end_time)
+            detections.append({
+                "keyword": result.keyword,
+                "start_time": round(self._session_time(result.start_time), 3),
+                "end_time": round(end_time, 3),
+                "tokens": result.tokens,
+                "decode_ms": round(result.decode_ms, 2),
+                "algorithmic_latency_ms": round(max(0.0, session_end / 16000 - end_time) * 1000, 1),
+                "processing_time": processing_time,
+            })
+        return detections
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get session statistics"""
+        return {
+            "session_id": self.session_id,
+            "is_processing": self.is_processing,
+            "keyword_set": self.keyword_set,
+            "buffered_samples": len(self.ring),
+            "overflowed_samples": self.ring.overflowed_samples,
+            **self.stats
+        }
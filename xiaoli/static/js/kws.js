@@ -290,7 +290,7 @@ class KWSApp {
         detectionItem.innerHTML = `
             <div class="detection-timestamp">${new Date().toLocaleString()}</div>
             <div class="detection-keyword">${data.keyword}</div>
-            <div class="detection-confidence">置信度: ${(data.confidence * 100).toFixed(1)}%</div>
+            <div class="detection-timing">音频 ${data.start_time.toFixed(2)}s - ${data.end_time.toFixed(2)}s · 算法延迟 ${data.algorithmic_latency_ms.toFixed(0)}ms · 解码 ${data.decode_ms.toFixed(1)}ms</div>
         `;
 
         resultsContainer.insertBefore(detectionItem, resultsContainer.firstChild);
@@ -612,8 +612,12 @@ class LogsApp {
         this.ws = new WebSocket(wsUrl);
         
         this.ws.onmessage = (event) => {
-            const logData = JSON.parse(event.data);
-            this.addLogEntry(logData);
+            const data = JSON.parse(event.data);
+            if (data.type === 'log_batch') {
+                data.logs.forEach(log => this.addLogEntry(log));
+            } else {
+                this.addLogEntry(data);
+            }
         };
     }
 
@@ -697,11 +701,11 @@ class LogsApp {
 
     async refreshLogs() {
         try {
-            const response = await fetch('/api/logs');
-            const logs = await response.json();
+            const response = await fetch('/api/logs?limit=100');
+            const data = await response.json();
             
             this.logContainer.innerHTML = '';
-            logs.forEach(log => this.addLogEntry(log));
+            data.logs.forEach(log => this.addLogEntry(log));
             
             this.showToast('日志已刷新', 'success');
         } catch (error) {
@@ -101,7 +101,9 @@ class KWSClient:
                 data = json.loads(message)
                 
                 if data.get("type") == "detection":
-                    print(f"🎯 Keyword detected: {data['keyword']} (confidence: {data['confidence']:.3f})")
+                    print(f"🎯 Keyword detected: {data['keyword']} "
+                          f"[{data['start_time']:.2f}s-{data['end_time']:.2f}s, "
+                          f"algorithmic latency {data['algorithmic_latency_ms']:.0f}ms]")
                 elif data.get("type") == "detection_started":
                     print("✅ Detection started")
                 elif data.get("type") == "detection_stopped":